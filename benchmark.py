@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the hot paths of LWWElementSet and LWWElementGraph
+
+The workloads follow the demo notebook: two editors (Alice and Bob) each
+edit their own replica of a graph, and the replicas are merged at the end.
+There are four kinds of workload:
+
+    random      vertices are added and removed at random and edges join
+                random live vertices
+    powerlaw    edges are attached preferentially to vertices which already
+                have many edges, so a few hubs have most of them
+    churn       a small set of vertices (including the hubs) is removed and
+                added back over and over
+    backdated   as random, but the first add of each vertex, and each edge,
+                lands at a random earlier timestamp, as when older batches
+                are loaded late, so the sets are written out of timestamp
+                order
+
+Timestamps are integers shared by both editors, and are increasing except in
+the backdated workload.
+
+Results are printed (or written with --output) as one JSON object per line,
+with the time per call of each query in seconds and the peak memory of
+building the replicas and of merging them, so that runs can be compared
+between releases. tracemalloc slows down every allocation, so the memory is
+measured in a second pass, and the times are taken without it.
+
+Usage:
+------
+python benchmark.py --sizes 1000 10000 100000 1000000 --kinds random powerlaw churn backdated --output bench.jsonl
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+
+KINDS = ['random', 'powerlaw', 'churn', 'backdated']
+
+def emptyGraph():
+    return LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+
+def generateWorkload(kind, operations, seed=0):
+    """
+    generator of (editor, method, args) for a workload of the given kind with
+    about the given number of operations, where editor is 0 (Alice) or 1 (Bob)
+
+    edges are only generated between vertices which the editor has added, so
+    replaying the workload never raises NonExistentVertex
+    """
+    rng = random.Random(seed)
+    vertexCount = max(10, operations // 5) if kind != 'churn' else max(10, operations // 50)
+
+    # vertices each editor has added and not removed, and for powerlaw the
+    # endpoints of every edge so far (a vertex appears once per edge)
+    live = [[], []]
+    liveSets = [set([]), set([])]
+    endpoints = [[], []]
+
+    # for backdated, the vertices each editor has ever added, and the
+    # timestamp each live vertex has been live since, so that an edge is
+    # never backdated to before one of its endpoints was added
+    added = [set([]), set([])]
+    since = [{}, {}]
+
+    for t in range(operations):
+        editor = rng.randrange(2)
+        r = rng.random()
+
+        if not live[editor] or r < 0.3:
+            v = rng.randrange(vertexCount)
+            timestamp = t
+            if v not in liveSets[editor]:
+                if kind == 'backdated' and v not in added[editor]:
+                    timestamp = rng.randrange(t + 1)
+                live[editor].append(v)
+                liveSets[editor].add(v)
+                since[editor][v] = timestamp
+            added[editor].add(v)
+            yield (editor, 'addVertex', (v, timestamp))
+
+        elif r < (0.5 if kind == 'churn' else 0.4):
+            if kind == 'churn':
+                # remove one of the busiest vertices
+                v = rng.choice(endpoints[editor]) if endpoints[editor] else rng.choice(live[editor])
+            else:
+                v = rng.choice(live[editor])
+            if v in liveSets[editor]:
+                liveSets[editor].discard(v)
+                live[editor].remove(v)
+            yield (editor, 'removeVertex', (v, t))
+
+        else:
+            v1 = rng.choice(live[editor])
+            if kind in ['powerlaw', 'churn'] and endpoints[editor] and rng.random() < 0.8:
+                v2 = rng.choice(endpoints[editor])
+                if v2 not in liveSets[editor]:
+                    v2 = rng.choice(live[editor])
+            else:
+                v2 = rng.choice(live[editor])
+            endpoints[editor] += [v1, v2]
+            timestamp = t
+            if kind == 'backdated':
+                timestamp = rng.randint(max(since[editor][v1], since[editor][v2]), t)
+            yield (editor, 'addEdgeBetween', (v1, v2, timestamp))
+
+def build(kind, operations, seed=0):
+    """
+    replay a workload into two replicas, returning (alice, bob, now) where
+    now is a timestamp after every operation
+    """
+    replicas = [emptyGraph(), emptyGraph()]
+    for (editor, method, args) in generateWorkload(kind, operations, seed):
+        getattr(replicas[editor], method)(*args)
+    return replicas[0], replicas[1], operations
+
+def _timePerCall(function, calls):
+    """
+    return the mean time in seconds of calling function on each argument
+    tuple in calls
+    """
+    start = time.perf_counter()
+    for args in calls:
+        function(*args)
+    return (time.perf_counter() - start) / max(1, len(calls))
+
+def run(kind, operations, queries=1000, seed=0):
+    """
+    benchmark one workload, returning a dict of results
+    """
+    start = time.perf_counter()
+    alice, bob, now = build(kind, operations, seed)
+    buildSeconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    merged = alice.merge(bob)
+    mergeSeconds = time.perf_counter() - start
+
+    # the memory pass: build the replicas again while tracing, then trace
+    # the merge alone (what is allocated before tracing starts is not
+    # counted)
+    tracemalloc.start()
+    build(kind, operations, seed)
+    buildPeakBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    alice.merge(bob)
+    mergePeakBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    rng = random.Random(seed + 1)
+
+    vertices = list(merged.vertices.elements()) or [0]
+    edges = list(merged.edges.elements()) or [frozenset([0])]
+    times = [rng.randrange(now + 1) for i in range(queries)]
+    vertexQueries = [(rng.choice(vertices), t) for t in times]
+    edgeQueries = [(rng.choice(edges), t) for t in times]
+    liveVertices = [v for v in vertices if merged.hasVertex(v, now)]
+
+    results = {
+        'kind': kind,
+        'operations': operations,
+        'queries': queries,
+        'seed': seed,
+        'vertices': len(vertices),
+        'edges': len(edges),
+        'build_seconds': buildSeconds,
+        'build_peak_bytes': buildPeakBytes,
+        'merge_seconds': mergeSeconds,
+        'merge_peak_bytes': mergePeakBytes,
+        'contains_seconds': _timePerCall(merged.vertices.contains, vertexQueries),
+        'hasVertex_seconds': _timePerCall(merged.hasVertex, vertexQueries),
+        'hasEdge_seconds': _timePerCall(merged.hasEdge, edgeQueries),
+        'findAllVerticesConnectedTo_seconds': _timePerCall(merged.findAllVerticesConnectedTo,
+                                                           vertexQueries),
+    }
+
+    # path searches are slower, so do fewer of them, between live vertices
+    pathQueries = [(rng.choice(liveVertices), rng.choice(liveVertices), now)
+                   for i in range(min(queries, 100))] if liveVertices else []
+    results['findAnyPathBetweenTwoVertices_seconds'] = _timePerCall(
+        merged.findAnyPathBetweenTwoVertices, pathQueries)
+
+    # removeVertex changes the graph, so it goes last, on the busiest vertices
+    busiest = sorted(liveVertices, key=lambda v: -len(merged._incidentEdges.get(v, ())))
+    removals = [(v, now + 1) for v in busiest[:min(queries, 100)]]
+    results['removeVertex_seconds'] = _timePerCall(merged.removeVertex, removals)
+
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help='numbers of operations')
+    parser.add_argument('--kinds', nargs='+', default=KINDS, choices=KINDS)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the results to (default stdout)')
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for operations in args.sizes:
+            for kind in args.kinds:
+                results = run(kind, operations, args.queries, args.seed)
+                results['python'] = platform.python_version()
+                out.write(json.dumps(results) + '\n')
+                out.flush()
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+import benchmark
+
+class testBenchmark(unittest.TestCase):
+    
+    def test_workloads(self):
+        for kind in benchmark.KINDS:
+            # replaying never adds an edge to a missing vertex
+            alice, bob, now = benchmark.build(kind, 500, seed=1)
+            self.assertEqual(now, 500)
+            self.assertEqual(list(benchmark.generateWorkload(kind, 100, 2)),
+                             list(benchmark.generateWorkload(kind, 100, 2)))
+        
+    def test_main(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            benchmark.main(['--sizes', '200', '--queries', '20'])
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        
+        self.assertEqual([r['kind'] for r in results], benchmark.KINDS)
+        for r in results:
+            self.assertEqual(r['operations'], 200)
+            self.assertGreater(r['build_peak_bytes'], 0)
+            self.assertGreater(r['merge_peak_bytes'], 0)
+            for key in ['contains', 'hasVertex', 'hasEdge', 'removeVertex', 'merge',
+                        'findAllVerticesConnectedTo', 'findAnyPathBetweenTwoVertices']:
+                self.assertGreaterEqual(r[key + '_seconds'], 0)
+    
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from lwwelementset import LWWElementSet
+
+class ColumnarLWWElementSet:
+    """
+    Columnar Last Writer Wins Element Set Class
+
+    Stores the same operations as LWWElementSet, but as parallel NumPy arrays
+    (element id, timestamp, add/remove flag) instead of sets of tuples. The
+    elements themselves are interned to integer ids. This is slower for one
+    element at a time, but questions about many elements at once ("which of
+    these vertices are live at t", "all live elements at t") are answered
+    with a sort and a few vectorised operations rather than Python loops.
+
+    The timestamps have to fit in a NumPy column: integers or floats, or
+    naive datetimes (including pandas timestamps) which are stored as
+    datetime64 and come back as datetimes.
+
+    Examples:
+    ---------
+    # convert an LWWElementSet
+    y = LWWElementSet(set([(1,0), (2,2), (1,3)]), set([(1,1)]))
+    c = ColumnarLWWElementSet.fromLWWElementSet(y)
+
+    # which elements are live at time 1
+    c.liveElements(1) # set([])
+    c.containsMany([1, 2, 3]) # array([ True,  True, False])
+
+    # convert back
+    c.toLWWElementSet() == y # True
+    """
+    def __init__(self, addSet, removeSet):
+
+        # type checking
+        if not isinstance(addSet, set) or not isinstance(removeSet, set):
+            raise TypeError
+
+        # interned elements: id of each element and element of each id
+        self._ids = {}
+        self._elements = []
+
+        # columns of operations, sorted by element id, then timestamp, then
+        # flag (remove before add). None until the first operation arrives,
+        # because the timestamp dtype is not known before then
+        self._columns = None
+
+        # operations which have not been written to the columns yet, so that
+        # single adds and removes do not copy the columns every time
+        self._pending = []
+
+        for (x, timestamp) in addSet:
+            self.addElement(x, timestamp)
+        for (x, timestamp) in removeSet:
+            self.removeElement(x, timestamp)
+
+    @staticmethod
+    def fromLWWElementSet(s):
+        """
+        convert an LWWElementSet to a ColumnarLWWElementSet
+        """
+        return ColumnarLWWElementSet(s.addSet, s.removeSet)
+
+    @staticmethod
+    def fromColumns(elements, ids, timestamps, isAdd):
+        """
+        make a ColumnarLWWElementSet from a list of elements and columns of
+        operations, where ids are positions in elements
+        """
+        c = ColumnarLWWElementSet(set([]), set([]))
+        for x in elements:
+            c._intern(x)
+        if len(ids) > 0:
+            c._columns = c._sortColumns(np.asarray(ids, dtype=np.int64), np.asarray(timestamps),
+                                        np.asarray(isAdd, dtype=bool))
+        return c
+
+    def toLWWElementSet(self):
+        """
+        convert back to an LWWElementSet (timestamps come back as Python
+        numbers or datetimes, see _timestampList)
+        """
+        addSet = set([])
+        removeSet = set([])
+        ids, timestamps, isAdd = self._flush()
+        for (i, timestamp, a) in zip(ids.tolist(), self._timestampList(timestamps), isAdd.tolist()):
+            (addSet if a else removeSet).add((self._elements[i], timestamp))
+        return LWWElementSet(addSet, removeSet)
+
+    def __eq__(self, other):
+        """
+        test for equality
+        """
+        return self.toLWWElementSet() == other.toLWWElementSet()
+
+    def __repr__(self):
+        """
+        print the contents of the object, for debugging
+        """
+        return self.toLWWElementSet().__repr__()
+
+    def _intern(self, x):
+        """
+        return the id of element x, giving it a new one if necessary
+        """
+        i = self._ids.get(x)
+        if i is None:
+            i = len(self._elements)
+            self._ids[x] = i
+            self._elements.append(x)
+        return i
+
+    def addElement(self, x, timestamp):
+        """
+        add element x at timestamp
+        """
+        self._pending.append((self._intern(x), timestamp, True))
+
+    def removeElement(self, x, timestamp):
+        """
+        remove element x at timestamp
+        """
+        self._pending.append((self._intern(x), timestamp, False))
+
+    @staticmethod
+    def _timestampColumn(timestamps):
+        """
+        make a column out of a list of timestamps
+        """
+        column = np.array(timestamps)
+        if column.dtype == object:
+            # datetime objects
+            column = column.astype('datetime64[ns]')
+        return column
+
+    @staticmethod
+    def _timestampList(timestamps):
+        """
+        turn a column of timestamps back into a list of Python objects, which
+        are numbers, or datetimes for datetime64 columns. Times with
+        nanoseconds, which datetime cannot hold, come back as pandas
+        timestamps (or datetime64 if pandas is not installed)
+        """
+        if timestamps.dtype.kind != 'M':
+            return timestamps.tolist()
+        nanoseconds = timestamps.astype('datetime64[ns]').astype(np.int64)
+        if not (nanoseconds % 1000).any():
+            return timestamps.astype('datetime64[us]').tolist()
+        try:
+            import pandas as pd
+        except ImportError:
+            return list(timestamps)
+        return pd.to_datetime(nanoseconds).tolist()
+
+    @staticmethod
+    def _queryTimestamp(dtype, timestamp):
+        """
+        return timestamp in a form which can be compared with a column of
+        dtype without rounding it. Datetimes become datetime64 in
+        nanoseconds, and numbers are left alone, since NumPy compares an
+        integer column with a float as floats
+        """
+        if dtype.kind != 'M':
+            return timestamp
+        if hasattr(timestamp, 'to_datetime64'):
+            # pandas Timestamp, which may have nanoseconds
+            return timestamp.to_datetime64()
+        return np.datetime64(timestamp, 'ns')
+
+    @staticmethod
+    def _sortColumns(ids, timestamps, isAdd):
+        """
+        sort the columns by id, then timestamp, then flag, and drop repeated
+        operations like the sets would
+        """
+        order = np.lexsort((isAdd, timestamps, ids))
+        ids, timestamps, isAdd = ids[order], timestamps[order], isAdd[order]
+        keep = np.ones(len(ids), dtype=bool)
+        keep[1:] = ((ids[1:] != ids[:-1]) | (timestamps[1:] != timestamps[:-1])
+                    | (isAdd[1:] != isAdd[:-1]))
+        return (ids[keep], timestamps[keep], isAdd[keep])
+
+    def _flush(self):
+        """
+        write the pending operations to the columns, and return the columns
+        (ids, timestamps, isAdd)
+        """
+        if self._pending:
+            ids, timestamps, isAdd = zip(*self._pending)
+            self._pending = []
+            ids = np.array(ids, dtype=np.int64)
+            timestamps = self._timestampColumn(timestamps)
+            isAdd = np.array(isAdd, dtype=bool)
+            if self._columns is not None:
+                ids = np.concatenate([self._columns[0], ids])
+                timestamps = np.concatenate([self._columns[1], timestamps])
+                isAdd = np.concatenate([self._columns[2], isAdd])
+
+            self._columns = self._sortColumns(ids, timestamps, isAdd)
+
+        if self._columns is None:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                    np.zeros(0, dtype=bool))
+        return self._columns
+
+    def _liveMask(self, timestamp=None):
+        """
+        return a boolean array saying which element ids are live at timestamp
+        (or with all operations if timestamp is None)
+        """
+        ids, timestamps, isAdd = self._flush()
+        if timestamp is not None and len(ids) > 0:
+            upTo = timestamps <= self._queryTimestamp(timestamps.dtype, timestamp)
+            ids, isAdd = ids[upTo], isAdd[upTo]
+
+        # the columns are sorted by timestamp then flag within each element,
+        # so the last operation of each element decides whether it is live.
+        # An add sorts after a remove with the same timestamp, so ties go to
+        # add as in LWWElementSet
+        last = np.ones(len(ids), dtype=bool)
+        last[:-1] = ids[1:] != ids[:-1]
+
+        live = np.zeros(len(self._elements), dtype=bool)
+        live[ids[last]] = isAdd[last]
+        return live
+
+    def contains(self, x, timestamp=None):
+        """
+        check whether the set contains x, or contained it at timestamp if one
+        is given
+        """
+        return bool(self.containsMany([x], timestamp)[0])
+
+    def containsMany(self, xs, timestamp=None):
+        """
+        return a boolean array saying which of the elements xs are in the set
+        at timestamp (or now if timestamp is None)
+        """
+        live = self._liveMask(timestamp)
+        # elements which have never been seen get id -1
+        ids = np.fromiter((self._ids.get(x, -1) for x in xs), dtype=np.int64)
+        found = ids >= 0
+        result = np.zeros(len(ids), dtype=bool)
+        result[found] = live[ids[found]]
+        return result
+
+    def liveElements(self, timestamp=None):
+        """
+        return the set of elements in the set at timestamp (or now if
+        timestamp is None)
+        """
+        return set([self._elements[i] for i in np.flatnonzero(self._liveMask(timestamp))])
+
+    def merge(self, other):
+        """
+        merge two ColumnarLWWElementSet objects, returning a new one
+        """
+        merged = ColumnarLWWElementSet(set([]), set([]))
+        columns = []
+        for s in [self, other]:
+            ids, timestamps, isAdd = s._flush()
+            if len(ids) > 0:
+                # translate the ids of s into ids of merged
+                translate = np.array([merged._intern(x) for x in s._elements], dtype=np.int64)
+                columns.append((translate[ids], timestamps, isAdd))
+        if columns:
+            merged._columns = merged._sortColumns(*[np.concatenate(c) for c in zip(*columns)])
+        return merged
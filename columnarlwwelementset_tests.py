@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+from lwwelementset import LWWElementSet
+from columnarlwwelementset import ColumnarLWWElementSet
+
+class testColumnarLWWElementSet(unittest.TestCase):
+    
+    def test_conversion(self):
+        u = LWWElementSet(set([(1, 0), (2, 2), (1, 3), ('a', 1)]), set([(1, 1), (3, 0)]))
+        c = ColumnarLWWElementSet.fromLWWElementSet(u)
+        
+        self.assertEqual(c.toLWWElementSet(), u)
+        
+        # adding an operation twice does not change anything
+        c.addElement(1, 0)
+        self.assertEqual(c.toLWWElementSet(), u)
+        
+    def test_containsMany(self):
+        u = LWWElementSet(set([(1, 0), (2, 2), (1, 3), (4, 1)]), set([(1, 1), (3, 0), (4, 1)]))
+        c = ColumnarLWWElementSet.fromLWWElementSet(u)
+        
+        # agrees with LWWElementSet (including ties going to add)
+        for t in [None, -1, 0, 1, 2, 3]:
+            expected = [u.contains(x, t) for x in [1, 2, 3, 4, 5]]
+            self.assertEqual(c.containsMany([1, 2, 3, 4, 5], t).tolist(), expected)
+            self.assertEqual(c.liveElements(t), set([x for x in [1, 2, 3, 4] if u.contains(x, t)]))
+        
+        c.removeElement(2, 4)
+        self.assertEqual(c.contains(2), False)
+        self.assertEqual(c.contains(2, 3), True)
+        
+        # fractional timestamps are not rounded to the integer column
+        for t in [-0.5, 0.5, 1.5, 3.5]:
+            self.assertEqual(c.containsMany([1, 2, 3, 4], t).tolist(),
+                             [u.contains(x, t) for x in [1, 2, 3, 4]])
+        
+    def test_datetimes(self):
+        day = datetime.datetime(2020, 1, 1)
+        c = ColumnarLWWElementSet(set([('Paris', day)]), set([]))
+        c.removeElement('Paris', day + datetime.timedelta(days=1))
+        
+        self.assertEqual(c.contains('Paris', day), True)
+        self.assertEqual(c.contains('Paris', day - datetime.timedelta(microseconds=1)), False)
+        self.assertEqual(c.contains('Paris', day + datetime.timedelta(days=2)), False)
+        
+        # datetimes come back as datetimes, so the sets can be used together
+        u = LWWElementSet(set([('Paris', day), ('Bonn', day + datetime.timedelta(microseconds=5))]),
+                          set([('Paris', day + datetime.timedelta(days=1))]))
+        v = ColumnarLWWElementSet.fromLWWElementSet(u).toLWWElementSet()
+        self.assertEqual(v, u)
+        self.assertEqual(v.contains('Bonn', day), False)
+        self.assertEqual(v.merge(u), u)
+        
+    def test_merge(self):
+        u = LWWElementSet(set([(1, 0), (2, 0)]), set([(1, 1)]))
+        v = LWWElementSet(set([(2, 0), (3, 2)]), set([(2, 3)]))
+        
+        merged = ColumnarLWWElementSet.fromLWWElementSet(u).merge(ColumnarLWWElementSet.fromLWWElementSet(v))
+        self.assertEqual(merged.toLWWElementSet(), u.merge(v))
+        self.assertEqual(merged.liveElements(), set([3]))
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+from compactlwwelementset import CompactLWWElementSet, toNanoseconds
+from exceptions import NonExistentVertex
+
+# vertex ids are packed into the low and high 32 bits of an edge key
+_MASK = (1 << 32) - 1
+
+def _nanoseconds(timestamp):
+    """
+    toNanoseconds for a query timestamp, which can be None for now
+    """
+    return None if timestamp is None else toNanoseconds(timestamp)
+
+class CompactEdgeSet(CompactLWWElementSet):
+    """
+    CompactLWWElementSet of the edges of a CompactLWWElementGraph
+
+    Edges are not interned. The key of an edge is the pair of ids of its
+    endpoints in the vertices of the graph, packed into one integer (smaller
+    id in the high bits, and the same id twice for a loop), so the edge
+    frozensets are only made again when an edge is returned.
+    """
+    __slots__ = ('_vertices',)
+
+    def __init__(self, vertices, addSet, removeSet):
+        self._vertices = vertices
+        CompactLWWElementSet.__init__(self, addSet, removeSet)
+
+    def _empty(self):
+        return CompactEdgeSet(self._vertices, set([]), set([]))
+
+    def _key(self, e):
+        ids = sorted([self._vertices._key(v) for v in e])
+        if len(ids) not in [1, 2]:
+            raise ValueError('An edge has one or two endpoints.')
+        if ids[-1] > _MASK:
+            raise OverflowError('Too many vertices for a CompactEdgeSet.')
+        return (ids[0] << 32) | ids[-1]
+
+    def _find(self, e):
+        ids = sorted([self._vertices._find(v) for v in e], key=lambda i: -1 if i is None else i)
+        if not ids or ids[0] is None or len(ids) > 2:
+            return None
+        return (ids[0] << 32) | ids[-1]
+
+    def _element(self, key):
+        elements = self._vertices._elements
+        return frozenset([elements[key >> 32], elements[key & _MASK]])
+
+class CompactLWWElementGraph:
+    """
+    Compact LWWElementGraph class
+
+    Has the same rules and query API as LWWElementGraph, but stores the
+    vertices in a CompactLWWElementSet and the edges in a CompactEdgeSet, so
+    operations are held as encoded integers, vertices are interned once and
+    edges are held as packed pairs of vertex ids rather than frozensets. The
+    incidence index holds edge keys too, which takes about a third of the
+    memory of LWWElementGraph for a graph built with datetime timestamps.
+    Timestamps are normalised to nanoseconds when they come in (see
+    compactlwwelementset.toNanoseconds), and vertices and edges are returned
+    as the original objects. As in LWWElementGraph, the queries take None
+    as the timestamp for now.
+
+    Use this for large graphs which are mostly queried. It does not keep a
+    journal, snapshot cache or delta log, so convert it with
+    toLWWElementGraph for those.
+
+    Examples:
+    ---------
+    g = CompactLWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+    g.addVertex('a', pd.to_datetime('2020-01-01'))
+    g.addVertex('b', pd.to_datetime('2020-01-01'))
+    g.addEdgeBetween('a', 'b', pd.to_datetime('2020-01-02'))
+    g.findAllVerticesConnectedTo('a', pd.to_datetime('2020-01-03')) # set(['b'])
+    """
+    __slots__ = ('vertices', 'edges', '_incidentEdges')
+
+    def __init__(self, vertices, edges):
+
+        if not isinstance(vertices, (LWWElementSet, CompactLWWElementSet)) or \
+           not isinstance(edges, (LWWElementSet, CompactLWWElementSet)):
+            raise TypeError
+
+        self.vertices = CompactLWWElementSet(vertices.addSet, vertices.removeSet)
+        self.edges = CompactEdgeSet(self.vertices, edges.addSet, edges.removeSet)
+
+        # incidence index from each vertex id to the keys of the edges which
+        # have an operation with it as an endpoint, as a single key or an
+        # array of keys like the timelines
+        self._incidentEdges = {}
+        for key in self.edges._timelines:
+            self._indexEdge(key)
+
+    @staticmethod
+    def fromLWWElementGraph(g):
+        """
+        convert an LWWElementGraph to a CompactLWWElementGraph
+        """
+        return CompactLWWElementGraph(g.vertices, g.edges)
+
+    def toLWWElementGraph(self):
+        """
+        convert to an LWWElementGraph, with timestamps in nanoseconds
+        """
+        return LWWElementGraph(self.vertices.toLWWElementSet(), self.edges.toLWWElementSet())
+
+    def _indexEdge(self, key):
+        """
+        record edge key in the incidence index of each of its endpoints (once,
+        when the edge has its first operation)
+        """
+        for i in set([key >> 32, key & _MASK]):
+            incident = self._incidentEdges.get(i)
+            if incident is None:
+                self._incidentEdges[i] = key
+            elif type(incident) is int:
+                self._incidentEdges[i] = array('q', [incident, key])
+            else:
+                incident.append(key)
+
+    def _incident(self, i):
+        """
+        keys of the edges in the incidence index of vertex id i
+        """
+        return CompactLWWElementSet._entries(self._incidentEdges.get(i, ()))
+
+    def _insertEdge(self, key, entry):
+        """
+        insert an encoded operation on edge key, indexing the edge if it is new
+        """
+        if key not in self.edges._timelines:
+            self._indexEdge(key)
+        self.edges._insert(key, entry)
+
+    def __eq__(self, other):
+        return self.vertices.__eq__(other.vertices) and self.edges.__eq__(other.edges)
+
+    def __repr__(self):
+        """
+        print the contents of the object, for debugging
+        """
+        return 'vertices:\n' + self.vertices.__repr__() + '\nedges:\n' + self.edges.__repr__()
+
+    def addVertex(self, x, timestamp):
+        """
+        add vertex x at timestamp
+        """
+        self.vertices.addElement(x, timestamp)
+
+    def removeVertex(self, x, timestamp):
+        """
+        remove vertex x at timestamp
+        also remove all trailing edges, as LWWElementGraph does
+        """
+        nanoseconds = toNanoseconds(timestamp)
+        i = self.vertices._key(x)
+        self.vertices._insert(i, nanoseconds << 1)
+        for key in self._incident(i):
+            if not self.edges._removedSinceKey(key, nanoseconds):
+                self.edges._insert(key, nanoseconds << 1)
+
+    def addEdge(self, e, timestamp):
+        """
+        add edge e at timestamp, but only if its endpoints exist
+        """
+        nanoseconds = toNanoseconds(timestamp)
+        for v in e:
+            i = self.vertices._find(v)
+            if i is None or not self.vertices._containsKey(i, nanoseconds):
+                raise NonExistentVertex('Cannot add edge if not all endpoints exist.')
+        self._insertEdge(self.edges._key(e), (nanoseconds << 1) | 1)
+
+    def addEdgeBetween(self, v1, v2, timestamp):
+        """
+        add edge between v1 and v2 at timestamp
+        """
+        self.addEdge(frozenset([v1, v2]), timestamp)
+
+    def removeEdge(self, e, timestamp):
+        """
+        remove edge e at timestamp
+        """
+        self._insertEdge(self.edges._key(e), toNanoseconds(timestamp) << 1)
+
+    def removeEdgeBetween(self, v1, v2, timestamp):
+        """
+        remove edge e at timestamp where e is specified by its endpoints
+        """
+        self.removeEdge(frozenset([v1, v2]), timestamp)
+
+    def hasVertex(self, x, timestamp):
+        """
+        check if vertex x exists at timestamp
+        """
+        return self.vertices.contains(x, timestamp)
+
+    def _hasEdgeKey(self, key, nanoseconds):
+        """
+        hasEdge for an edge key and a timestamp in nanoseconds (or None for
+        now)
+        """
+        return (self.edges._containsKey(key, nanoseconds)
+                and self.vertices._containsKey(key >> 32, nanoseconds)
+                and self.vertices._containsKey(key & _MASK, nanoseconds))
+
+    def hasEdge(self, e, timestamp):
+        """
+        check if edge e and both of its endpoints exist at timestamp
+        """
+        key = self.edges._find(e)
+        return key is not None and self._hasEdgeKey(key, _nanoseconds(timestamp))
+
+    def hasEdgeBetween(self, v1, v2, timestamp):
+        """
+        check if edge between v1 and v2 exists at timestamp
+        """
+        return self.hasEdge(frozenset([v1, v2]), timestamp)
+
+    def _neighbours(self, i, nanoseconds):
+        """
+        ids of the vertices adjacent to vertex id i at timestamp
+        """
+        out = set([])
+        for key in self._incident(i):
+            if self._hasEdgeKey(key, nanoseconds):
+                low, high = key & _MASK, key >> 32
+                out.add(high if low == i else low)
+        return out
+
+    def findAllVerticesConnectedTo(self, v, timestamp):
+        """
+        find all vertices connected to vertex v at timestamp
+        """
+        i = self.vertices._find(v)
+        if i is None:
+            return set([])
+        elements = self.vertices._elements
+        return set([elements[j] for j in self._neighbours(i, _nanoseconds(timestamp))])
+
+    def findAnyPathBetweenTwoVertices(self, v1, v2, timestamp):
+        """
+        Return True if there is a path between v1 and v2 in the graph at timestamp
+        """
+        return self.findShortestPathBetweenTwoVertices(v1, v2, timestamp) is not None
+
+    def findShortestPathBetweenTwoVertices(self, v1, v2, timestamp):
+        """
+        Return a shortest path between v1 and v2 in the graph at timestamp as a
+        list of vertices [v1, ..., v2], or None if there is no path
+        """
+        if not (self.hasVertex(v1, timestamp) and self.hasVertex(v2, timestamp)):
+            raise NonExistentVertex('Vertex does not exist')
+
+        # search over vertex ids, and only turn the path back into vertices
+        nanoseconds = _nanoseconds(timestamp)
+        path = LWWElementGraph._bidirectionalSearch(self.vertices._find(v1), self.vertices._find(v2),
+                                                    lambda i: self._neighbours(i, nanoseconds))
+        if path is None:
+            return None
+        return [self.vertices._element(i) for i in path]
+
+    def mergeInto(self, other):
+        """
+        merge another CompactLWWElementGraph into this one in place
+        """
+        self.vertices.mergeInto(other.vertices)
+        for (key, timeline) in other.edges._timelines.items():
+            mine = self.edges._key(other.edges._element(key))
+            if mine not in self.edges._timelines:
+                self._indexEdge(mine)
+            self.edges._insertAll(mine, CompactLWWElementSet._entries(timeline))
+
+    def merge(self, other):
+        """
+        merge two CompactLWWElementGraph objects together
+        """
+        merged = CompactLWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        merged.mergeInto(self)
+        merged.mergeInto(other)
+        return merged
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import tracemalloc
+import unittest
+import benchmark
+from exceptions import NonExistentVertex
+from lwwelementset import LWWElementSet
+from compactlwwelementgraph import CompactLWWElementGraph
+
+def emptyGraph():
+    return CompactLWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+
+class testCompactLWWElementGraph(unittest.TestCase):
+    
+    def test_sameAsLWWElementGraph(self):
+        for kind in benchmark.KINDS:
+            replicas = [benchmark.emptyGraph(), benchmark.emptyGraph()]
+            compact = [emptyGraph(), emptyGraph()]
+            for (editor, method, args) in benchmark.generateWorkload(kind, 400, seed=3):
+                getattr(replicas[editor], method)(*args)
+                getattr(compact[editor], method)(*args)
+            self.assertEqual(compact[0].toLWWElementGraph(), replicas[0])
+            
+            g = replicas[0].merge(replicas[1])
+            c = compact[0].merge(compact[1])
+            self.assertEqual(c.toLWWElementGraph(), g)
+            self.assertEqual(CompactLWWElementGraph.fromLWWElementGraph(g), c)
+            
+            vertices = list(g.vertices.elements())
+            for t in range(0, 400, 50):
+                for v in vertices:
+                    self.assertEqual(c.hasVertex(v, t), g.hasVertex(v, t))
+                    self.assertEqual(c.findAllVerticesConnectedTo(v, t), g.findAllVerticesConnectedTo(v, t))
+                for e in g.edges.elements():
+                    self.assertEqual(c.hasEdge(e, t), g.hasEdge(e, t))
+            
+            # None is now, as in LWWElementGraph
+            for v in vertices:
+                self.assertEqual(c.hasVertex(v, None), g.hasVertex(v, None))
+                self.assertEqual(c.findAllVerticesConnectedTo(v, None), g.findAllVerticesConnectedTo(v, None))
+            for e in g.edges.elements():
+                self.assertEqual(c.hasEdge(e, None), g.hasEdge(e, None))
+            for (v1, v2) in zip(vertices[:20], vertices[20:40]):
+                if g.hasVertex(v1, 400) and g.hasVertex(v2, 400):
+                    path = c.findShortestPathBetweenTwoVertices(v1, v2, 400)
+                    expected = g.findShortestPathBetweenTwoVertices(v1, v2, 400)
+                    self.assertEqual(None if path is None else len(path), None if expected is None else len(expected))
+                    self.assertEqual(c.findAnyPathBetweenTwoVertices(v1, v2, None), expected is not None)
+    
+    def test_originalObjects(self):
+        c = emptyGraph()
+        day = lambda d: datetime.datetime(2020, 1, d)
+        c.addVertex('a', day(1))
+        c.addVertex(('b', 1), day(1))
+        c.addEdgeBetween('a', ('b', 1), day(2))
+        c.addEdgeBetween('a', 'a', day(2))
+        
+        self.assertEqual(c.findAllVerticesConnectedTo('a', day(3)), set(['a', ('b', 1)]))
+        self.assertEqual(c.findShortestPathBetweenTwoVertices('a', ('b', 1), day(3)), ['a', ('b', 1)])
+        self.assertEqual(c.hasEdge(frozenset(['a']), day(1)), False)
+        self.assertEqual(c.hasEdge(frozenset(['a', 'c']), day(3)), False)
+        self.assertEqual(sorted(c.edges.elements(), key=len), [frozenset(['a']), frozenset(['a', ('b', 1)])])
+        with self.assertRaises(NonExistentVertex):
+            c.addEdgeBetween('a', 'c', day(3))
+        
+        c.removeVertex(('b', 1), day(4))
+        self.assertEqual(c.hasEdgeBetween('a', ('b', 1), day(3)), True)
+        self.assertEqual(c.hasEdgeBetween('a', ('b', 1), day(4)), False)
+        self.assertEqual(c.findAnyPathBetweenTwoVertices('a', 'a', day(4)), True)
+        
+    def test_memory(self):
+        def size(make):
+            tracemalloc.start()
+            g = make()
+            for v in range(2000):
+                g.addVertex(v, datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=v))
+            for v in range(1, 2000):
+                g.addEdgeBetween(v - 1, v, datetime.datetime(2020, 1, 2))
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            return used
+        self.assertLess(size(emptyGraph), size(benchmark.emptyGraph) / 2)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+import operator
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+from lwwelementset import LWWElementSet
+
+_EPOCH = datetime(1970, 1, 1)
+
+def toNanoseconds(timestamp):
+    """
+    convert a timestamp to an integer number of nanoseconds
+
+    integers (including numpy integers) are taken to be nanoseconds already.
+    Datetimes count from 1970-01-01 UTC, where naive datetimes are taken to
+    be in UTC (as pandas does). pandas timestamps are recognised by their
+    value attribute, so pandas does not have to be imported
+    """
+    if isinstance(timestamp, int) and not isinstance(timestamp, bool):
+        return timestamp
+
+    # pandas Timestamp, which already holds nanoseconds since the epoch
+    value = getattr(timestamp, 'value', None)
+    if isinstance(value, int):
+        return value
+
+    if isinstance(timestamp, datetime):
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        delta = timestamp - _EPOCH
+        return (delta.days * 86400 + delta.seconds) * 10**9 + delta.microseconds * 1000
+
+    # numpy datetime64
+    if getattr(getattr(timestamp, 'dtype', None), 'kind', None) == 'M':
+        return int(timestamp.astype('datetime64[ns]').astype('int64'))
+
+    if hasattr(timestamp, '__index__') and not isinstance(timestamp, bool):
+        return operator.index(timestamp)
+
+    raise TypeError('Timestamps must be integers (nanoseconds) or datetimes.')
+
+class CompactLWWElementSet:
+    """
+    Compact Last Writer Wins Element Set Class
+
+    Has the same API as LWWElementSet, but takes much less memory per
+    operation. Elements are interned to integer ids. The history of each
+    element is a single array of 64 bit integers, which holds the timestamp
+    of each operation in nanoseconds (see toNanoseconds), shifted left by one
+    bit, with the low bit set for adds. So an operation takes 8 bytes, rather
+    than a tuple in a set and a timestamp object, and the entries sort by
+    timestamp with a remove before an add at the same timestamp. That makes
+    the last entry at or before a timestamp decide whether the element is
+    present, with ties going to add as in LWWElementSet. Most elements only
+    have one operation, so their history is kept as a plain integer until a
+    second one arrives, rather than as an array.
+
+    Elements are returned as the original objects. Timestamps are returned
+    (by addSet and removeSet) as integer nanoseconds, so a set built from
+    datetimes does not compare equal to the LWWElementSet it came from.
+    Timestamps have to be within about 146 years of 1970.
+
+    Examples:
+    ---------
+    import datetime
+    x = CompactLWWElementSet(set([]), set([]))
+    x.addElement('a', datetime.datetime(2020, 1, 1))
+    x.removeElement('a', datetime.datetime(2020, 1, 2))
+    x.contains('a', datetime.datetime(2020, 1, 1, 12)) # True
+    x.contains('a') # False
+    """
+    __slots__ = ('_ids', '_elements', '_timelines')
+
+    def __init__(self, addSet, removeSet):
+
+        # type checking
+        if not isinstance(addSet, set) or not isinstance(removeSet, set):
+            raise TypeError
+
+        # interned elements: id of each element and element of each id
+        self._ids = {}
+        self._elements = []
+
+        # history of each key (element id) as an encoded operation, or an
+        # array of them once there is more than one
+        self._timelines = {}
+
+        for (x, timestamp) in addSet:
+            self.addElement(x, timestamp)
+        for (x, timestamp) in removeSet:
+            self.removeElement(x, timestamp)
+
+    @staticmethod
+    def fromLWWElementSet(s):
+        """
+        convert an LWWElementSet to a CompactLWWElementSet
+        """
+        return CompactLWWElementSet(s.addSet, s.removeSet)
+
+    def toLWWElementSet(self):
+        """
+        convert to an LWWElementSet, with timestamps in nanoseconds
+        """
+        return LWWElementSet(self.addSet, self.removeSet)
+
+    def _empty(self):
+        """
+        return an empty set of the same kind, whose keys are compatible with
+        the keys of this one
+        """
+        return CompactLWWElementSet(set([]), set([]))
+
+    def _key(self, x):
+        """
+        return the key of element x, giving it a new one if necessary
+        """
+        i = self._ids.get(x)
+        if i is None:
+            i = len(self._elements)
+            self._ids[x] = i
+            self._elements.append(x)
+        return i
+
+    def _find(self, x):
+        """
+        return the key of element x, or None if it has never been seen
+        """
+        return self._ids.get(x)
+
+    def _element(self, key):
+        """
+        return the element with the given key
+        """
+        return self._elements[key]
+
+    @staticmethod
+    def _entries(timeline):
+        """
+        return a timeline (or other int-or-array value) as a sequence
+        """
+        return (timeline,) if type(timeline) is int else timeline
+
+    def _insert(self, key, entry):
+        """
+        insert an encoded operation into the timeline of key, unless it is
+        already there
+        """
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            self._timelines[key] = entry
+            return
+        if type(timeline) is int:
+            if timeline != entry:
+                self._timelines[key] = array('q', sorted([timeline, entry]))
+            return
+        i = bisect_left(timeline, entry)
+        if i == len(timeline) or timeline[i] != entry:
+            timeline.insert(i, entry)
+
+    def _containsKey(self, key, nanoseconds=None):
+        """
+        contains for a key and a timestamp which is already in nanoseconds
+        """
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            return False
+        if type(timeline) is int:
+            return bool(timeline & 1) and (nanoseconds is None or timeline <= (nanoseconds << 1) | 1)
+        if nanoseconds is None:
+            return bool(timeline[-1] & 1)
+        # the last operation at or before the timestamp, where an add at the
+        # timestamp sorts after a remove at the timestamp
+        i = bisect_right(timeline, (nanoseconds << 1) | 1)
+        return i > 0 and bool(timeline[i - 1] & 1)
+
+    def _removedSinceKey(self, key, nanoseconds):
+        """
+        check whether key has a remove at or after a timestamp in nanoseconds
+        """
+        entries = self._entries(self._timelines.get(key, ()))
+        return any([not entry & 1 for entry in entries[bisect_left(entries, nanoseconds << 1):]])
+
+    def __eq__(self, other):
+        """
+        test for equality
+        """
+        return (self.addSet == other.addSet) and (self.removeSet == other.removeSet)
+
+    def __repr__(self):
+        """
+        print the contents of the object, for debugging
+        """
+        return 'addSet:   ' + str(self.addSet) + '\nremoveSet:' + str(self.removeSet)
+
+    def _operations(self, isAdd):
+        """
+        set of (element, nanoseconds) pairs of the adds (isAdd 1) or removes
+        (isAdd 0)
+        """
+        return set([(self._element(key), entry >> 1)
+                    for (key, timeline) in self._timelines.items()
+                    for entry in self._entries(timeline) if (entry & 1) == isAdd])
+
+    @property
+    def addSet(self):
+        """
+        set of (element, nanoseconds) pairs which have been added
+        """
+        return self._operations(1)
+
+    @property
+    def removeSet(self):
+        """
+        set of (element, nanoseconds) pairs which have been removed
+        """
+        return self._operations(0)
+
+    def addElement(self, x, timestamp):
+        """
+        add element x at timestamp
+        """
+        self._insert(self._key(x), (toNanoseconds(timestamp) << 1) | 1)
+
+    def removeElement(self, x, timestamp):
+        """
+        remove element x at timestamp
+        """
+        self._insert(self._key(x), toNanoseconds(timestamp) << 1)
+
+    def contains(self, x, timestamp=None):
+        """
+        check whether the set contains x, or contained it at timestamp if one
+        is given
+        """
+        key = self._find(x)
+        if key is None:
+            return False
+        return self._containsKey(key, None if timestamp is None else toNanoseconds(timestamp))
+
+    def elements(self):
+        """
+        return the elements which have ever been added (whether or not they
+        have been removed since)
+        """
+        return [self._element(key) for (key, timeline) in self._timelines.items()
+                if any([entry & 1 for entry in self._entries(timeline)])]
+
+    def liveElements(self, timestamp=None):
+        """
+        return the set of elements in the set at timestamp (or now if
+        timestamp is None)
+        """
+        nanoseconds = None if timestamp is None else toNanoseconds(timestamp)
+        return set([self._element(key) for key in self._timelines
+                    if self._containsKey(key, nanoseconds)])
+
+    def snapshot(self, timestamp):
+        """
+        return the elements which have been added and removed up to timestamp
+        """
+        bound = (toNanoseconds(timestamp) << 1) | 1
+        snapshot = self._empty()
+        for (key, timeline) in self._timelines.items():
+            entries = self._entries(timeline)
+            i = bisect_right(entries, bound)
+            if i > 0:
+                snapshot._insertAll(snapshot._key(self._element(key)), entries[:i])
+        return snapshot
+
+    def _insertAll(self, key, entries):
+        """
+        insert a sorted sequence of encoded operations into the timeline of
+        key
+        """
+        timeline = self._timelines.get(key)
+        if timeline is not None:
+            entries = sorted(set(self._entries(timeline)).union(entries))
+        self._timelines[key] = entries[0] if len(entries) == 1 else array('q', entries)
+
+    def mergeInto(self, other):
+        """
+        merge another CompactLWWElementSet into this one in place
+        """
+        for (key, timeline) in other._timelines.items():
+            self._insertAll(self._key(other._element(key)), self._entries(timeline))
+
+    def merge(self, other):
+        """
+        merge two CompactLWWElementSet objects, returning a new one
+        """
+        merged = self._empty()
+        merged.mergeInto(self)
+        merged.mergeInto(other)
+        return merged
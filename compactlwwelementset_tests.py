@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+import numpy as np
+from lwwelementset import LWWElementSet
+from compactlwwelementset import CompactLWWElementSet, toNanoseconds
+
+class Timestamp:
+    # looks like a pandas Timestamp
+    def __init__(self, value):
+        self.value = value
+
+class testCompactLWWElementSet(unittest.TestCase):
+    
+    def test_toNanoseconds(self):
+        self.assertEqual(toNanoseconds(5), 5)
+        self.assertEqual(toNanoseconds(np.int64(5)), 5)
+        self.assertEqual(toNanoseconds(Timestamp(7)), 7)
+        self.assertEqual(toNanoseconds(datetime.datetime(1970, 1, 1, 0, 0, 1, 2)), 10**9 + 2000)
+        self.assertEqual(toNanoseconds(datetime.datetime(1970, 1, 1, 1, tzinfo=datetime.timezone(datetime.timedelta(hours=1)))), 0)
+        self.assertEqual(toNanoseconds(datetime.datetime(1969, 12, 31, 23, 59, 59)), -10**9)
+        self.assertEqual(toNanoseconds(np.datetime64('1970-01-01T00:00:01')), 10**9)
+        with self.assertRaises(TypeError):
+            toNanoseconds(1.5)
+    
+    def test_sameAsLWWElementSet(self):
+        # including ties, negative timestamps and removes without adds
+        y = LWWElementSet(set([(1, 0), (2, 2), (1, 3), (3, -2), (4, 1)]),
+                          set([(1, 1), (3, -2), (4, 2), (5, 0), (2, 5)]))
+        c = CompactLWWElementSet.fromLWWElementSet(y)
+        
+        self.assertEqual(c.toLWWElementSet(), y)
+        self.assertEqual(sorted(c.elements()), sorted(y.elements()))
+        for t in [None, -3, -2, 0, 1, 2, 3, 5, 6]:
+            for x in range(7):
+                self.assertEqual(c.contains(x, t), y.contains(x, t))
+            self.assertEqual(c.liveElements(t), set([x for x in range(7) if y.contains(x, t)]))
+        for t in [-2, 1, 3]:
+            self.assertEqual(c.snapshot(t).toLWWElementSet(), y.snapshot(t))
+        
+        z = LWWElementSet(set([(1, 4), (6, 0)]), set([(1, 3)]))
+        self.assertEqual(c.merge(CompactLWWElementSet.fromLWWElementSet(z)).toLWWElementSet(), y.merge(z))
+        
+        # repeated operations are only stored once
+        c.addElement(1, 0)
+        self.assertEqual(len(c._timelines[c._find(1)]), 3)
+        
+    def test_datetimes(self):
+        c = CompactLWWElementSet(set([]), set([]))
+        c.addElement('a', datetime.datetime(2020, 1, 1))
+        c.removeElement('a', np.datetime64('2020-01-02'))
+        self.assertEqual(c.contains('a', Timestamp(toNanoseconds(datetime.datetime(2020, 1, 1, 12)))), True)
+        self.assertEqual(c.contains('a'), False)
+        self.assertEqual(c.addSet, set([('a', toNanoseconds(datetime.datetime(2020, 1, 1)))]))
+        
+if __name__ == '__main__':
+    unittest.main()
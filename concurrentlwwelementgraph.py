@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import threading
+from collections import deque
+from contextlib import ExitStack
+
+from connectivityindex import ConnectivityIndex
+from livenessindex import LivenessIndex
+from lwwelementgraph import LWWElementGraph
+
+class ConcurrentLWWElementGraph(LWWElementGraph):
+    """
+    LWWElementGraph which can be shared between threads
+
+    Writers lock stripes of a fixed array of locks chosen by the hash of the
+    vertices they touch (an edge is locked through its endpoints). Writes to
+    unrelated vertices do not wait for each other, and a removeVertex holds
+    the stripe of the vertex for the whole cascade, so no edge can be added
+    to the vertex while its trailing edges are being removed. Merges and
+    compaction lock every stripe.
+
+    Readers take no locks. Point queries read the sorted timelines, which are
+    only ever changed by single list inserts. materialise returns immutable
+    snapshots, and a snapshot is only cached if no write which could change
+    it happened while it was being built (the cache has a version number
+    which every invalidation bumps).
+
+    The connectivity and liveness indexes have a lock of their own, which
+    writers never take. A write queues the vertices and edges it touched for
+    each index, and a reader applies the queue to an index before using it,
+    so searches and rebuilds only hold up other readers of the indexes. An
+    index is built without holding any lock the first time it is used.
+    Writes made meanwhile are queued for it and applied once it is installed
+    (applying a write the build has already seen changes nothing, since the
+    indexes look every vertex and edge up as it is now). Compaction bumps a
+    version number, and an index built while it ran is thrown away and built
+    again.
+
+    The vertices and edges objects are given locks of their own, which are
+    held briefly while each operation is recorded, to keep their sequence
+    numbers, logs, timestamp indexes and digests in order. These are shared
+    by every element, so this step of every vertex write (and of every edge
+    write) is serialised whatever stripes the writers hold. The stripes keep
+    the steps around it (the removeVertex cascade and the incidence index)
+    atomic per vertex without serialising them too. Writers only take the
+    bookkeeping lock to pass a change to the journal, if there is one, or to
+    drop cached snapshots, if there are any.
+
+    Examples:
+    ---------
+    g = ConcurrentLWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(8) as executor:
+        executor.map(lambda v: g.addVertex(v, 0), range(1000))
+    """
+    def __init__(self, vertices, edges, stripes=64, **kwargs):
+        LWWElementGraph.__init__(self, vertices, edges, **kwargs)
+
+        self._stripes = [threading.RLock() for i in range(stripes)]
+
+        # protects the snapshot cache and the journal
+        self._bookkeeping = threading.RLock()
+        self._versions = itertools.count()
+        self._cacheVersion = next(self._versions)
+
+        # protects the connectivity and liveness indexes, with the writes
+        # queued for each and the number of builds of each in progress
+        self._indexLock = threading.RLock()
+        self._indexWrites = {'connectivity': deque(), 'liveness': deque()}
+        self._indexBuilds = {'connectivity': 0, 'liveness': 0}
+        self._indexVersion = 0
+
+        vertices._lock = threading.RLock()
+        edges._lock = threading.RLock()
+
+    def _locked(self, vertices):
+        """
+        return a context manager which holds the stripes of the given
+        vertices, acquired in a fixed order so that writers cannot deadlock
+        """
+        stack = ExitStack()
+        for i in sorted(set([hash(v) % len(self._stripes) for v in vertices])):
+            stack.enter_context(self._stripes[i])
+        return stack
+
+    def _lockedAll(self):
+        """
+        return a context manager which holds every stripe
+        """
+        stack = ExitStack()
+        for lock in self._stripes:
+            stack.enter_context(lock)
+        return stack
+
+    def _journal(self, method, *args):
+        if self.journal is not None:
+            with self._bookkeeping:
+                LWWElementGraph._journal(self, method, *args)
+
+    def addVertex(self, x, timestamp):
+        with self._locked([x]):
+            LWWElementGraph.addVertex(self, x, timestamp)
+
+    def removeVertex(self, x, timestamp):
+        with self._locked([x]):
+            LWWElementGraph.removeVertex(self, x, timestamp)
+
+    def addEdge(self, e, timestamp):
+        with self._locked(e):
+            LWWElementGraph.addEdge(self, e, timestamp)
+
+    def removeEdge(self, e, timestamp):
+        with self._locked(e):
+            LWWElementGraph.removeEdge(self, e, timestamp)
+
+    def addVertices(self, xs, timestamp):
+        xs = list(xs)
+        with self._locked(xs):
+            LWWElementGraph.addVertices(self, xs, timestamp)
+
+    def removeVertices(self, xs, timestamp):
+        xs = list(xs)
+        with self._locked(xs):
+            LWWElementGraph.removeVertices(self, xs, timestamp)
+
+    def addEdges(self, es, timestamp):
+        es = [frozenset(e) for e in es]
+        with self._locked(set([]).union(*es)):
+            LWWElementGraph.addEdges(self, es, timestamp)
+
+    def removeEdges(self, es, timestamp):
+        es = [frozenset(e) for e in es]
+        with self._locked(set([]).union(*es)):
+            LWWElementGraph.removeEdges(self, es, timestamp)
+
+    def mergeInto(self, other, peer=None):
+        with self._lockedAll():
+            LWWElementGraph.mergeInto(self, other, peer)
+
+    def compact(self, horizon):
+        with self._lockedAll(), self.vertices._lock, self.edges._lock, self._indexLock:
+            self._indexVersion += 1
+            return LWWElementGraph.compact(self, horizon)
+
+    def _updateIndexes(self, vertices, edges):
+        vertices, edges = tuple(vertices), tuple(edges)
+        for (name, writes) in self._indexWrites.items():
+            # the builds are checked before the index, since a build installs
+            # the index before it finishes
+            if self._indexBuilds[name] or getattr(self, name) is not None:
+                writes.append((vertices, edges))
+
+    def _query(self, name, factory, query):
+        """
+        return query(index) for the named index, with the writes queued for
+        it applied, building the index with factory(self) if there is none
+        """
+        while True:
+            with self._indexLock:
+                index = getattr(self, name)
+                if index is not None:
+                    writes = self._indexWrites[name]
+                    while writes:
+                        index.update(*writes.popleft())
+                    return query(index)
+                self._indexBuilds[name] += 1
+                version = self._indexVersion
+
+            # build the index without holding any lock. Writes made meanwhile
+            # are queued for it, since a build is in progress
+            try:
+                index = factory(self)
+            finally:
+                with self._indexLock:
+                    # keep the index another reader built meanwhile, if any,
+                    # and drop this one if compaction ran during the build
+                    if (index is not None and version == self._indexVersion and
+                            getattr(self, name) is None):
+                        setattr(self, name, index)
+                    self._indexBuilds[name] -= 1
+
+    def connected(self, v1, v2):
+        return self._query('connectivity', ConnectivityIndex,
+                           lambda index: index.connected(v1, v2))
+
+    def componentOf(self, v):
+        return self._query('connectivity', ConnectivityIndex,
+                           lambda index: index.component(v))
+
+    def liveVertices(self, timestamp):
+        return self._query('liveness', LivenessIndex,
+                           lambda index: index.vertices(timestamp))
+
+    def liveEdges(self, timestamp):
+        return self._query('liveness', LivenessIndex,
+                           lambda index: index.edges(timestamp))
+
+    def hasVertexDuring(self, v, t1, t2):
+        return self._query('liveness', LivenessIndex,
+                           lambda index: index.vertexDuring(v, t1, t2))
+
+    def hasEdgeDuring(self, e, t1, t2):
+        e = frozenset(e)
+        return self._query('liveness', LivenessIndex,
+                           lambda index: index.edgeDuring(e, t1, t2))
+
+    def findAllVerticesConnectedTo(self, v, timestamp):
+        # iterate over a copy, since a writer may add an edge to v meanwhile
+        out = set([])
+        for e in tuple(self._incidentEdges.get(v, ())):
+            if self.hasEdge(e, timestamp):
+                out.update(e.difference(set([v])) if len(e) == 2 else e)
+        return out
+
+    def materialise(self, timestamp):
+        with self._bookkeeping:
+            if timestamp in self._snapshotCache:
+                self.snapshotCacheHits += 1
+                self._snapshotCache.move_to_end(timestamp)
+                return self._snapshotCache[timestamp]
+            self.snapshotCacheMisses += 1
+            version = self._cacheVersion
+
+        # build the snapshot without holding any lock
+        adjacency = {}
+        for v in list(self.vertices.elements()):
+            if self.hasVertex(v, timestamp):
+                adjacency[v] = self.findAllVerticesConnectedTo(v, timestamp)
+        live = (frozenset(adjacency), adjacency)
+
+        with self._bookkeeping:
+            # only cache the snapshot if nothing was invalidated meanwhile
+            if version == self._cacheVersion and self.snapshotCacheSize > 0:
+                self._snapshotCache[timestamp] = live
+                if len(self._snapshotCache) > self.snapshotCacheSize:
+                    self._snapshotCache.popitem(last=False)
+        return live
+
+    def _invalidateSnapshots(self, timestamp):
+        # every invalidation sets a version number which has not been used
+        # before, so a snapshot which was being built is not cached. next is
+        # atomic, so this needs no lock
+        self._cacheVersion = next(self._versions)
+        if self._snapshotCache:
+            with self._bookkeeping:
+                LWWElementGraph._invalidateSnapshots(self, timestamp)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import threading
+import unittest
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+from concurrentlwwelementgraph import ConcurrentLWWElementGraph
+
+class testConcurrentLWWElementGraph(unittest.TestCase):
+    
+    def test_concurrentWriters(self):
+        g = ConcurrentLWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        g.addVertex('hub', 0)
+        
+        def writer(i):
+            for j in range(50):
+                v = (i, j)
+                g.addVertex(v, 1)
+                g.addEdgeBetween('hub', v, 2)
+                g.findAllVerticesConnectedTo('hub', 2)
+                g.materialise(2)
+        
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(len(g.findAllVerticesConnectedTo('hub', 2)), 400)
+        self.assertEqual(len(g.materialise(2)[1]['hub']), 400)
+        
+        # the sequence numbers were handed out in order
+        self.assertEqual(g.sequence, (401, 400))
+        self.assertEqual(g.deltaSince((0, 0)), g)
+        
+    def test_removeVertexWhileAddingEdges(self):
+        g = ConcurrentLWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        g.addVertices(range(200), 0)
+        errors = []
+        
+        # edges are added to the hub while it is removed, which used to fail
+        # with the incidence set changing size during the cascade
+        def adder():
+            try:
+                for v in range(1, 200):
+                    g.addEdgeBetween(0, v, 1)
+            except Exception as e:
+                errors.append(e)
+        
+        def remover():
+            try:
+                for t in range(2, 40, 2):
+                    g.removeVertex(0, t)
+                    g.addVertex(0, t + 1)
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=adder), threading.Thread(target=remover)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(g.findAllVerticesConnectedTo(0, 1), set(range(1, 200)))
+        self.assertEqual(g.hasVertex(0, 2), False)
+        
+        # the result is an ordinary graph as far as merging is concerned
+        self.assertEqual(LWWElementGraph.mergeAll([g]), g)
+        
+    def test_connectivityWhileWriting(self):
+        for attempt in range(3):
+            g = ConcurrentLWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+            g.addVertices(range(3000), 0)
+            g.addEdges([(v, v + 1) for v in range(0, 3000, 2)], 0)
+            errors = []
+            
+            # new vertices and edges are written while the index is built by
+            # the first query and then used
+            def writer(i):
+                try:
+                    for v in range(3000 + i, 6000, 4):
+                        g.addVertex(v, 1)
+                        g.addEdgeBetween(v, v - 2999, 1)
+                        if v % 3 == 0:
+                            g.removeEdgeBetween(v - 2999, v - 2998, 2)
+                except Exception as e:
+                    errors.append(e)
+            
+            def reader():
+                try:
+                    for v in range(0, 3000, 10):
+                        g.connected(v, v + 1)
+                        g.componentOf(v)
+                except Exception as e:
+                    errors.append(e)
+            
+            threads = ([threading.Thread(target=writer, args=(i,)) for i in range(4)] +
+                       [threading.Thread(target=reader) for i in range(2)])
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            
+            self.assertEqual(errors, [])
+            
+            # the index which was built while writing agrees with one built
+            # afterwards
+            h = LWWElementGraph(g.vertices, g.edges)
+            for v in range(0, 5999, 7):
+                self.assertEqual(g.connected(v, v + 1), h.connected(v, v + 1))
+                self.assertEqual(g.connected(v, 0), h.connected(v, 0))
+        
+    def test_livenessWhileWriting(self):
+        for attempt in range(3):
+            g = ConcurrentLWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+            g.addVertices(range(3000), 0)
+            g.addEdges([(v, v + 1) for v in range(0, 3000, 2)], 0)
+            errors = []
+            
+            # the index is built by the first query, and thrown away by the
+            # compaction, while new vertices and edges are written
+            def writer(i):
+                try:
+                    for v in range(3000 + i, 6000, 4):
+                        g.addVertex(v, 2)
+                        g.addEdgeBetween(v, v - 3000, 3)
+                        if v % 3 == 0:
+                            g.removeVertex(v - 3000, 4)
+                        if v == 4500:
+                            g.compact(1)
+                except Exception as e:
+                    errors.append(e)
+            
+            def reader():
+                try:
+                    for t in range(50):
+                        g.liveVertices(t % 5)
+                        g.liveEdges(t % 5)
+                        g.hasVertexDuring(t, 1, 3)
+                        g.hasEdgeDuring((t, t + 1), 1, 3)
+                except Exception as e:
+                    errors.append(e)
+            
+            threads = ([threading.Thread(target=writer, args=(i,)) for i in range(4)] +
+                       [threading.Thread(target=reader) for i in range(2)])
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            
+            self.assertEqual(errors, [])
+            
+            # the index which was built while writing agrees with one built
+            # afterwards
+            h = LWWElementGraph(g.vertices, g.edges)
+            for t in range(1, 6):
+                self.assertEqual(g.liveVertices(t), h.liveVertices(t))
+                self.assertEqual(g.liveEdges(t), h.liveEdges(t))
+            for v in range(0, 5999, 7):
+                self.assertEqual(g.hasVertexDuring(v, 1, 3), h.hasVertexDuring(v, 1, 3))
+                self.assertEqual(g.hasEdgeDuring((v, v + 1), 3, 4), h.hasEdgeDuring((v, v + 1), 3, 4))
+        
+    def test_readersWhileWriting(self):
+        g = ConcurrentLWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        
+        # a chain of hubs which is never changed, so that some answers are
+        # known whatever the writers do
+        g.addVertices(range(10), 0)
+        g.addEdges([(v, v + 1) for v in range(9)], 0)
+        sequence = g.sequence
+        errors = []
+        done = threading.Event()
+        
+        def writer(i):
+            try:
+                for j in range(300):
+                    t = j + 1
+                    v = 10 + (j * 4 + i) % 400
+                    w = 10 + (v + 1) % 400
+                    g.addVertices([v, w], t)
+                    g.addEdges([(v, v % 10), (v, w)], t)
+                    if j % 3 == 0:
+                        g.removeVertex(10 + (v + 7) % 400, t)
+                    if j % 5 == 0:
+                        g.removeEdges([(v, v % 10)], t)
+                    if j % 50 == 0:
+                        other = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+                        other.addVertices([v, 1000 + j], t)
+                        g.mergeInto(other)
+            except Exception as e:
+                errors.append(e)
+        
+        def reader():
+            # every public reader, checked against what the hubs guarantee
+            try:
+                while not done.is_set():
+                    for t in [None, 0, 50, 150]:
+                        self.assertEqual(g.hasVertex(5, t), True)
+                        self.assertEqual(g.hasEdge(frozenset([4, 5]), t), True)
+                        self.assertEqual(g.hasEdgeBetween(5, 6, t), True)
+                        self.assertEqual(g.hasVertices([0, 9], t), [True, True])
+                        self.assertEqual(g.hasEdges([(0, 1), (8, 9)], t), [True, True])
+                        self.assertEqual(set([4, 6]) <= g.findAllVerticesConnectedTo(5, t), True)
+                        self.assertEqual(g.findAnyPathBetweenTwoVertices(0, 9, t), True)
+                        self.assertEqual(len(g.findShortestPathBetweenTwoVertices(0, 9, t)) <= 10, True)
+                        self.assertEqual(g.findPathsBetweenManyVertices([(0, 9), (3, 3)], t), [True, True])
+                        self.assertEqual(5 in g.materialise(t)[0], True)
+                    for t in [0, 50, 150]:
+                        self.assertEqual(set(range(10)) <= g.liveVertices(t), True)
+                        self.assertEqual(frozenset([0, 1]) in g.liveEdges(t), True)
+                    self.assertEqual(g.connected(0, 9), True)
+                    self.assertEqual(g.componentOf(0), g.componentOf(9))
+                    self.assertEqual(g.vertexIntervals(0), [(0, None)])
+                    self.assertEqual(g.edgeIntervals(frozenset([0, 1])), [(0, None)])
+                    self.assertEqual(g.hasVertexDuring(0, 10, 20), True)
+                    self.assertEqual(g.hasEdgeDuring((0, 1), 10, 20), True)
+                    list(g.changesBetween(0, 200))
+                    g.deltaSince(sequence)
+                    g.deltaFor('peer')
+                    g.vertices.digest.root
+                    self.assertEqual(g.merge(g).hasVertex(5, None), True)
+                    g.sequence
+            except Exception as e:
+                errors.append(e)
+        
+        # switch threads often, so that reads land in the middle of writes
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)
+        try:
+            writers = [threading.Thread(target=writer, args=(i,)) for i in range(4)]
+            readers = [threading.Thread(target=reader) for i in range(3)]
+            for t in writers + readers:
+                t.start()
+            for t in writers:
+                t.join()
+            done.set()
+            for t in readers:
+                t.join()
+        finally:
+            sys.setswitchinterval(interval)
+        
+        self.assertEqual(errors, [])
+        
+        # the indexes and caches which were used while writing agree with an
+        # ordinary graph made from the same operations
+        h = LWWElementGraph(LWWElementSet(set(g.vertices.addSet), set(g.vertices.removeSet)),
+                            LWWElementSet(set(g.edges.addSet), set(g.edges.removeSet)))
+        vertices = set([v for (v, t) in h.vertices.addSet])
+        for t in [None, 100, 300]:
+            self.assertEqual(g.materialise(t), h.materialise(t))
+        for t in [100, 300]:
+            self.assertEqual(g.liveVertices(t), h.liveVertices(t))
+            self.assertEqual(g.liveEdges(t), h.liveEdges(t))
+        live = [v for v in vertices if h.hasVertex(v, None)]
+        for v in live:
+            self.assertEqual(g.connected(0, v), h.connected(0, v))
+        self.assertEqual(set(g.changesBetween(0, 300)), set(h.changesBetween(0, 300)))
+        self.assertEqual(g.vertices.digest.root, h.vertices.digest.root)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from exceptions import NonExistentVertex
+
+class ConnectivityIndex:
+    """
+    index of the connected components of the current state of an
+    LWWElementGraph (taking every operation it knows about into account),
+    made by LWWElementGraph.connected and LWWElementGraph.componentOf and then
+    kept up to date by the graph
+
+    The components are a union-find forest (union by size with path halving),
+    so adding vertices and edges merges components in near constant time.
+    Removing a vertex or edge can split a component, which union-find cannot
+    do, so the component is only marked dirty. The first query that lands in
+    a dirty component rebuilds that component alone by searching its live
+    members, so the work of a removal is bounded by the size of the component
+    it was in. Several removals in the same component share one rebuild.
+
+    A write with an old timestamp may not change the current state, so every
+    vertex and edge a write touches is looked up as it is now before the
+    index is changed.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+
+        # parent of each live vertex in the forest, and the members of each
+        # component keyed by its root
+        self._parent = {}
+        self._members = {}
+
+        # roots of the components which have lost a vertex or an edge since
+        # they were built
+        self._dirty = set([])
+
+        # number of components rebuilt, to see what removals cost
+        self.rebuilds = 0
+
+        # copy the elements first, since writers may add to them while the
+        # index is being built (see ConcurrentLWWElementGraph)
+        for v in tuple(graph.vertices.elements()):
+            if graph.vertices.contains(v):
+                self._makeSet(v)
+        for e in tuple(graph.edges.elements()):
+            self._addEdge(e)
+
+    def _makeSet(self, v):
+        if v not in self._parent:
+            self._parent[v] = v
+            self._members[v] = [v]
+
+    def _find(self, v):
+        parent = self._parent
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    def _union(self, v1, v2):
+        r1, r2 = self._find(v1), self._find(v2)
+        if r1 == r2:
+            return
+        if len(self._members[r1]) < len(self._members[r2]):
+            r1, r2 = r2, r1
+        self._parent[r2] = r1
+        self._members[r1] += self._members.pop(r2)
+        if r2 in self._dirty:
+            self._dirty.discard(r2)
+            self._dirty.add(r1)
+
+    def _addEdge(self, e):
+        """
+        join the components of the endpoints of e if e exists now
+        """
+        if len(e) == 2 and self.graph.hasEdge(e, None):
+            # the endpoints exist if e does, but the write which added one of
+            # them may not have reached the index yet
+            for v in e:
+                self._makeSet(v)
+            self._union(*e)
+
+    def update(self, vertices, edges):
+        """
+        bring the index up to date after a write which touched the given
+        vertices and edges
+        """
+        graph = self.graph
+        live = []
+        for v in vertices:
+            if graph.vertices.contains(v):
+                self._makeSet(v)
+                live.append(v)
+            elif v in self._parent:
+                self._dirty.add(self._find(v))
+        
+        # edges to a vertex come back with it if they were never removed.
+        # This is done once every live vertex has a set, since the other
+        # endpoint may be another of the vertices
+        for v in live:
+            for e in tuple(graph._incidentEdges.get(v, ())):
+                self._addEdge(e)
+
+        for e in edges:
+            e = frozenset(e)
+            if len(e) != 2:
+                # loops do not connect anything
+                continue
+            if graph.hasEdge(e, None):
+                self._addEdge(e)
+            elif all([v in self._parent for v in e]):
+                roots = set([self._find(v) for v in e])
+                if len(roots) == 1:
+                    self._dirty.update(roots)
+
+    def _rebuild(self, root):
+        """
+        split a dirty component into the components of its live members
+        """
+        self.rebuilds += 1
+        self._dirty.discard(root)
+        members = self._members.pop(root)
+        for v in members:
+            del self._parent[v]
+
+        live = [v for v in members if self.graph.vertices.contains(v)]
+        for v in live:
+            self._makeSet(v)
+        # every live neighbour of a member is a member, since the edges to
+        # it would have joined their components
+        for v in live:
+            for w in self.graph.findAllVerticesConnectedTo(v, None):
+                if w in self._parent:
+                    self._union(v, w)
+
+    def component(self, v):
+        """
+        return the id of the component of vertex v, which is one of its
+        vertices. Ids are only stable until the next write
+        """
+        if not self.graph.vertices.contains(v):
+            raise NonExistentVertex('Vertex does not exist')
+        if v not in self._parent:
+            # v was changed without going through the graph's methods
+            self.update([v], [])
+        root = self._find(v)
+        if root in self._dirty:
+            self._rebuild(root)
+            root = self._find(v)
+        return root
+
+    def connected(self, v1, v2):
+        """
+        check whether there is a path between v1 and v2 now
+        """
+        # rebuilding the component of v2 does not move v1, since if they were
+        # in the same component it has already been rebuilt for v1
+        return self.component(v1) == self.component(v2)
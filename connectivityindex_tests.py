@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+import benchmark
+from exceptions import NonExistentVertex
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+
+class testConnectivityIndex(unittest.TestCase):
+    
+    def test_connected(self):
+        g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        g.addVertices([1, 2, 3, 4], 0)
+        g.addEdges([(1, 2), (2, 3)], 1)
+        
+        self.assertEqual(g.connected(1, 3), True)
+        self.assertEqual(g.connected(1, 4), False)
+        self.assertEqual(g.componentOf(1), g.componentOf(3))
+        
+        # additions are merged in without a rebuild
+        g.addEdgeBetween(3, 4, 2)
+        self.assertEqual(g.connected(1, 4), True)
+        self.assertEqual(g.connectivity.rebuilds, 0)
+        
+        # a removal splits the component when it is next asked about
+        g.removeEdgeBetween(2, 3, 3)
+        self.assertEqual(g.connected(1, 4), False)
+        self.assertEqual(g.connected(3, 4), True)
+        self.assertEqual(g.connectivity.rebuilds, 1)
+        
+        # a remove which is older than the add changes nothing
+        g.removeEdgeBetween(3, 4, 1)
+        self.assertEqual(g.connected(3, 4), True)
+        
+        g.removeVertex(4, 4)
+        with self.assertRaises(NonExistentVertex):
+            g.componentOf(4)
+        
+        # Bob removes 2 without removing the edge (1, 2), so when 2 is added
+        # again the edge comes back
+        other = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        other.removeVertex(2, 5)
+        g.mergeInto(other)
+        self.assertEqual(g.connected(1, 3), False)
+        g.addVertex(2, 6)
+        self.assertEqual(g.connected(1, 2), True)
+        
+    def assertSameAsSearch(self, g, rng):
+        live = [v for v in g.vertices.elements() if g.hasVertex(v, None)]
+        for _ in range(10):
+            (v1, v2) = (rng.choice(live), rng.choice(live))
+            self.assertEqual(g.connected(v1, v2), g.findAnyPathBetweenTwoVertices(v1, v2, None))
+        
+    def test_sameAsSearch(self):
+        # the index agrees with a search at the latest timestamp as the two
+        # editors write, and on a replica which both are merged into
+        rng = random.Random(0)
+        for kind in benchmark.KINDS:
+            replicas = [benchmark.emptyGraph(), benchmark.emptyGraph()]
+            merged = benchmark.emptyGraph()
+            for (i, (editor, method, args)) in enumerate(benchmark.generateWorkload(kind, 600, seed=4)):
+                getattr(replicas[editor], method)(*args)
+                if i % 10 == 0:
+                    self.assertSameAsSearch(replicas[editor], rng)
+                if i % 100 == 99:
+                    merged.mergeInto(replicas[0])
+                    merged.mergeInto(replicas[1])
+                    self.assertSameAsSearch(merged, rng)
+            self.assertGreater(merged.connectivity.rebuilds, 0)
+                        
+    def test_outOfOrderTimestamps(self):
+        # writes land at random times, so removals can be in the past or tie
+        # with a later add, and the vertex they remove can still be live
+        for seed in range(60):
+            rng = random.Random(seed)
+            g = benchmark.emptyGraph()
+            g.addVertices(range(6), 0)
+            g.connected(0, 1)
+            for i in range(60):
+                t = rng.randrange(20)
+                (v1, v2) = (rng.randrange(6), rng.randrange(6))
+                r = rng.random()
+                if r < 0.3:
+                    g.addVertex(v1, t)
+                elif r < 0.5:
+                    g.removeVertex(v1, t)
+                elif r < 0.6:
+                    g.removeVertices([v1, v2], t)
+                elif r < 0.7:
+                    g.removeEdgeBetween(v1, v2, t)
+                elif g.hasVertex(v1, t) and g.hasVertex(v2, t):
+                    g.addEdgeBetween(v1, v2, t)
+                
+                live = [v for v in range(6) if g.hasVertex(v, None)]
+                for v1 in live:
+                    for v2 in live:
+                        self.assertEqual(g.connected(v1, v2), g.findAnyPathBetweenTwoVertices(v1, v2, None))
+        
+if __name__ == '__main__':
+    unittest.main()
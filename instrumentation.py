@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Optional instrumentation of LWWElementSet and LWWElementGraph
+
+Nothing is measured unless a measure block is active. On entering the first
+block, the public methods of the instrumented classes are swapped for
+wrappers that time every call and pass the measurements to a sink. When the
+last block exits, the original methods are put back. With no block active,
+the classes run their own methods and pay nothing at all.
+
+What is recorded:
+
+    latency.<Class>.<method>            time of each call in nanoseconds
+    scanned.LWWElementSet.contains      timestamps in the timelines bisected
+                                        by each contains
+    allocations.LWWElementSetView.materialise
+                                        LWWElementSet objects copied out of
+                                        snapshot views
+    allocations.LWWElementGraph.materialise
+                                        live graphs built by materialise
+                                        (cache misses)
+    hasEdgeCalls.<Class>.<search>       hasEdge calls made by each path
+                                        search
+    size.<Class>.<merge>                operations in the result of merge
+                                        and mergeAll, or received by
+                                        mergeInto
+
+A sink has count(name, n) for counters (allocations) and observe(name,
+value) for everything else. Counters keeps totals and power of two
+histograms in memory. Callback passes everything to a function, for example
+to forward it to a metrics library.
+
+The sink is held in a context variable, so a measure block only measures
+what is done in its own thread (or asyncio task), and blocks in different
+threads can overlap. Threads started inside a block are not measured. While
+any block is active, the wrapped methods are called by every thread, and
+the others pay only a lookup of the context variable per call. An inner
+measure block replaces the sink of an outer one until it exits.
+
+Examples:
+---------
+from instrumentation import measure
+
+with measure() as counters:
+    g.findAnyPathBetweenTwoVertices(1, 2, 5)
+counters.histograms['latency.LWWElementGraph.hasEdge'] # {1024: 3, 2048: 1}
+counters.mean('hasEdgeCalls.LWWElementGraph.findAnyPathBetweenTwoVertices')
+
+with measure(Callback(lambda kind, name, value: print(kind, name, value))):
+    g.merge(h)
+"""
+
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# the sink measurements in this context go to, None when nothing is being
+# measured
+sink = contextvars.ContextVar('sink', default=None)
+
+# classes whose public methods are wrapped while measuring (see instrumented)
+_classes = []
+
+# (class, name, attribute) of each method replaced by a wrapper
+_originals = []
+
+# number of active measure blocks in every thread, and a lock for changing
+# it. The methods are wrapped while it is above 0
+_depth = 0
+_lock = threading.Lock()
+
+# calls of each wrapped method in the current measure block, so that probes
+# can tell how many calls another method made
+_calls = contextvars.ContextVar('calls')
+
+class Counters:
+    """
+    sink which keeps counters, and a histogram of the values observed under
+    each name with power of two buckets (a value v goes in the bucket keyed by
+    the smallest power of two greater than v)
+    """
+    def __init__(self):
+        self.counts = {}
+        self.totals = {}
+        self.histograms = {}
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def observe(self, name, value):
+        self.totals[name] = self.totals.get(name, 0) + value
+        histogram = self.histograms.setdefault(name, {})
+        bound = 1 << int(value).bit_length()
+        histogram[bound] = histogram.get(bound, 0) + 1
+
+    def observations(self, name):
+        """
+        number of values observed under name
+        """
+        return sum(self.histograms.get(name, {}).values())
+
+    def mean(self, name):
+        """
+        mean of the values observed under name, or None if there are none
+        """
+        n = self.observations(name)
+        return self.totals[name] / n if n else None
+
+class Callback:
+    """
+    sink which calls function(kind, name, value) with kind 'count' or
+    'observe' for every measurement
+    """
+    def __init__(self, function):
+        self.function = function
+
+    def count(self, name, n=1):
+        self.function('count', name, n)
+
+    def observe(self, name, value):
+        self.function('observe', name, value)
+
+def instrumented(cls):
+    """
+    class decorator which registers the public methods of cls to be wrapped
+    while measuring
+    """
+    _classes.append(cls)
+    return cls
+
+def _size(x):
+    """
+    number of operations in an LWWElementSet or LWWElementGraph
+    """
+    if hasattr(x, 'vertices'):
+        return _size(x.vertices) + _size(x.edges)
+    return len(x.addSet) + len(x.removeSet)
+
+# probes record more than the latency of some methods. A probe is a
+# generator which is started with the sink and the arguments of the call
+# before the method runs, and is sent the result afterwards
+
+def _probeContains(sink, label, args):
+    (s, x) = args[:2]
+    sink.observe('scanned.' + label, len(s._addTimeline.get(x, ())) + len(s._removeTimeline.get(x, ())))
+    yield
+
+def _probeAllocation(sink, label, args):
+    yield
+    sink.count('allocations.' + label)
+
+def _probeMaterialise(sink, label, args):
+    misses = args[0].snapshotCacheMisses
+    yield
+    if args[0].snapshotCacheMisses > misses:
+        sink.count('allocations.' + label)
+
+def _probeSearch(sink, label, args):
+    calls = _calls.get()
+    before = calls.get('LWWElementGraph.hasEdge', 0)
+    yield
+    sink.observe('hasEdgeCalls.' + label, calls.get('LWWElementGraph.hasEdge', 0) - before)
+
+def _probeMerge(sink, label, args):
+    result = yield
+    sink.observe('size.' + label, _size(result))
+
+def _probeMergeInto(sink, label, args):
+    sink.observe('size.' + label, _size(args[1]))
+    yield
+
+_PROBES = {
+    'LWWElementSet.contains': _probeContains,
+    'LWWElementSetView.materialise': _probeAllocation,
+    'LWWElementSet.merge': _probeMerge,
+    'LWWElementSet.mergeAll': _probeMerge,
+    'LWWElementSet.mergeInto': _probeMergeInto,
+    'LWWElementGraph.materialise': _probeMaterialise,
+    'LWWElementGraph.merge': _probeMerge,
+    'LWWElementGraph.mergeAll': _probeMerge,
+    'LWWElementGraph.mergeInto': _probeMergeInto,
+    'LWWElementGraph.findAnyPathBetweenTwoVertices': _probeSearch,
+    'LWWElementGraph.findShortestPathBetweenTwoVertices': _probeSearch,
+    'LWWElementGraph.findPathsBetweenManyVertices': _probeSearch,
+}
+
+def _wrap(label, function):
+    """
+    return a wrapper of function which counts and times its calls, and runs
+    its probe if it has one
+    """
+    probe = _PROBES.get(label)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        s = sink.get()
+        if s is None:
+            return function(*args, **kwargs)
+        calls = _calls.get()
+        calls[label] = calls.get(label, 0) + 1
+        running = None
+        if probe is not None:
+            running = probe(s, label, args)
+            next(running)
+        start = time.perf_counter_ns()
+        result = function(*args, **kwargs)
+        s.observe('latency.' + label, time.perf_counter_ns() - start)
+        if running is not None:
+            try:
+                running.send(result)
+            except StopIteration:
+                pass
+        return result
+    return wrapper
+
+def _patch():
+    for cls in _classes:
+        for (name, attribute) in list(vars(cls).items()):
+            if name.startswith('_'):
+                continue
+            label = cls.__name__ + '.' + name
+            if isinstance(attribute, staticmethod):
+                setattr(cls, name, staticmethod(_wrap(label, attribute.__func__)))
+            elif callable(attribute):
+                setattr(cls, name, _wrap(label, attribute))
+            else:
+                # properties and other attributes are left alone
+                continue
+            _originals.append((cls, name, attribute))
+
+def _unpatch():
+    while _originals:
+        (cls, name, attribute) = _originals.pop()
+        setattr(cls, name, attribute)
+
+@contextmanager
+def measure(into=None):
+    """
+    measure everything done by the instrumented classes inside the block,
+    into the given sink (by default a new Counters), which is returned by the
+    context manager
+    """
+    global _depth
+    if into is None:
+        into = Counters()
+
+    with _lock:
+        if _depth == 0:
+            _patch()
+        _depth += 1
+    tokens = (sink.set(into), _calls.set({}))
+    try:
+        yield into
+    finally:
+        sink.reset(tokens[0])
+        _calls.reset(tokens[1])
+        with _lock:
+            _depth -= 1
+            if _depth == 0:
+                _unpatch()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+import instrumentation
+from instrumentation import measure, Callback
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+
+def path(n):
+    g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+    g.addVertices(range(n), 0)
+    g.addEdges([(i, i + 1) for i in range(n - 1)], 1)
+    return g
+
+class testInstrumentation(unittest.TestCase):
+    
+    def test_disabled(self):
+        # nothing is wrapped outside a measure block
+        contains = LWWElementSet.contains
+        with measure():
+            self.assertNotEqual(LWWElementSet.contains, contains)
+            with measure():
+                pass
+            self.assertNotEqual(LWWElementSet.contains, contains)
+        self.assertIs(LWWElementSet.contains, contains)
+        self.assertIs(instrumentation.sink.get(), None)
+        
+    def test_counters(self):
+        g = path(5)
+        h = path(3)
+        with measure() as counters:
+            self.assertEqual(g.findAnyPathBetweenTwoVertices(0, 4, 1), True)
+            g.vertices.snapshot(1).snapshot(0).materialise()
+            g.materialise(1)
+            g.materialise(1)
+            g.mergeInto(h)
+            merged = LWWElementGraph.mergeAll([g, h])
+        
+        # the path search checks the 4 edges from both ends at most once each
+        self.assertEqual(counters.observations('hasEdgeCalls.LWWElementGraph.findAnyPathBetweenTwoVertices'), 1)
+        self.assertLessEqual(counters.mean('hasEdgeCalls.LWWElementGraph.findAnyPathBetweenTwoVertices'), 8)
+        self.assertGreater(counters.observations('latency.LWWElementGraph.hasEdge'), 0)
+        self.assertEqual(counters.observations('latency.LWWElementGraph.findShortestPathBetweenTwoVertices'), 1)
+        self.assertEqual(counters.mean('scanned.LWWElementSet.contains'), 1)
+        self.assertEqual(counters.counts['allocations.LWWElementSetView.materialise'], 1)
+        self.assertEqual(counters.counts['allocations.LWWElementGraph.materialise'], 1)
+        self.assertEqual(counters.totals['size.LWWElementGraph.mergeInto'], 5)
+        self.assertEqual(counters.totals['size.LWWElementGraph.mergeAll'], 9)
+        self.assertEqual(merged, g)
+        
+    def test_callback(self):
+        seen = []
+        x = LWWElementSet(set([(1, 0)]), set([]))
+        with measure(Callback(lambda kind, name, value: seen.append((kind, name)))):
+            x.contains(1)
+        self.assertEqual(sorted(seen), [('observe', 'latency.LWWElementSet.contains'),
+                                        ('observe', 'scanned.LWWElementSet.contains')])
+        
+    def test_threads(self):
+        x = LWWElementSet(set([(1, 0)]), set([]))
+        entered = [threading.Event(), threading.Event()]
+        exited = threading.Event()
+        counters = [None, None]
+        
+        # the blocks overlap, and the first exits while the second is still
+        # measuring
+        def first():
+            with measure() as counters[0]:
+                entered[0].set()
+                entered[1].wait()
+                x.contains(1)
+            exited.set()
+        
+        def second():
+            entered[0].wait()
+            with measure() as counters[1]:
+                entered[1].set()
+                exited.wait()
+                x.contains(1)
+                x.contains(1, 0)
+        
+        contains = LWWElementSet.contains
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for t in threads:
+            t.start()
+        
+        # this thread is not measured by either block
+        entered[1].wait()
+        x.contains(1)
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(counters[0].observations('latency.LWWElementSet.contains'), 1)
+        self.assertEqual(counters[1].observations('latency.LWWElementSet.contains'), 2)
+        self.assertIs(LWWElementSet.contains, contains)
+        self.assertIs(instrumentation.sink.get(), None)
+        
+if __name__ == '__main__':
+    unittest.main()
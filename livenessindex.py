@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Liveness intervals of the vertices and edges of an LWWElementGraph
+
+An interval is a pair (start, end) of timestamps, meaning present at start
+and up to but not including end, where end is None if the vertex or edge is
+still present. The intervals of a vertex or edge are disjoint and in order.
+"""
+
+def intersectIntervals(a, b):
+    """
+    return the intervals in which both interval lists a and b are present
+    """
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        # the interval which ends first is finished with
+        if b[j][1] is None or (a[i][1] is not None and a[i][1] < b[j][1]):
+            end = a[i][1]
+            i += 1
+        else:
+            end = b[j][1]
+            j += 1
+        if end is None or start < end:
+            out.append((start, end))
+    return out
+
+def _endKey(interval):
+    # sorts intervals by end, with intervals which have not ended last
+    return (interval[1] is None, 0 if interval[1] is None else interval[1])
+
+class _Node:
+    """
+    node of a centered interval tree: the intervals which contain center,
+    sorted by start and by end (latest first), and subtrees for the
+    intervals which end at or before center and which start after it
+    """
+    __slots__ = ('center', 'byStart', 'byEnd', 'left', 'right')
+
+    def __init__(self, intervals):
+        starts = sorted([interval[0] for interval in intervals])
+        self.center = center = starts[len(starts) // 2]
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[0] > center:
+                right.append(interval)
+            elif interval[1] is not None and interval[1] <= center:
+                left.append(interval)
+            else:
+                here.append(interval)
+        self.byStart = sorted(here, key=lambda interval: interval[0])
+        self.byEnd = sorted(here, key=_endKey, reverse=True)
+        self.left = _Node(left) if left else None
+        self.right = _Node(right) if right else None
+
+    def stab(self, timestamp):
+        """
+        generator of the keys of the intervals which contain timestamp
+        """
+        node = self
+        while node is not None:
+            if timestamp < node.center:
+                # every interval here ends after timestamp
+                for (start, end, key) in node.byStart:
+                    if start > timestamp:
+                        break
+                    yield key
+                node = node.left
+            else:
+                # every interval here starts at or before timestamp
+                for (start, end, key) in node.byEnd:
+                    if end is not None and end <= timestamp:
+                        break
+                    yield key
+                node = node.right
+
+class IntervalIndex:
+    """
+    intervals of a set of keys, indexed so that the keys present at a
+    timestamp can be found in O(log n + output) time
+
+    The intervals are held in centered interval trees, which are built all
+    at once. Keys whose intervals change are kept in a buffer of at most
+    BUFFER keys, which is checked one by one. A full buffer is built into a
+    new tree, together with any of the newest trees which are no bigger (the
+    logarithmic method), so there are O(log n) trees of about doubling size,
+    changes cost O(log^2 n) amortised and queries O(log^2 n + output). A key
+    is only read from the newest tree (or the buffer) which has it, and all
+    the trees are built into one again when the older copies of changed keys
+    make up half of the entries.
+    """
+    BUFFER = 64
+
+    def __init__(self, intervals):
+        self._intervals = dict([(key, i) for (key, i) in intervals.items() if i])
+        self._build()
+
+    def _build(self):
+        # trees as (generation, keys, tree), oldest first, and the generation
+        # of the tree which holds the intervals of each key which has changed
+        # since the last build (the others are in the first tree)
+        self._generations = {}
+        self._nextGeneration = 1
+        self._levels = [self._level(0, self._intervals)]
+        self._entries = len(self._intervals)
+        self._buffer = {}
+
+    def _level(self, generation, keys):
+        keys = list(keys)
+        flat = [(start, end, key) for key in keys for (start, end) in self._intervals.get(key, [])]
+        return (generation, keys, _Node(flat) if flat else None)
+
+    def _flush(self):
+        """
+        build the buffer, and the newest trees which are no bigger, into a
+        tree
+        """
+        keys = set(self._buffer)
+        self._buffer = {}
+        while self._levels and len(self._levels[-1][1]) <= len(keys):
+            (generation, levelKeys, tree) = self._levels.pop()
+            self._entries -= len(levelKeys)
+            keys.update([key for key in levelKeys if self._generations.get(key, 0) == generation])
+        if self._entries + len(keys) > 2 * len(self._intervals) + self.BUFFER:
+            self._build()
+            return
+        generation = self._nextGeneration
+        self._nextGeneration += 1
+        for key in keys:
+            self._generations[key] = generation
+        self._levels.append(self._level(generation, keys))
+        self._entries += len(keys)
+
+    def update(self, key, intervals):
+        """
+        replace the intervals of key
+        """
+        intervals = list(intervals)
+        if intervals:
+            self._intervals[key] = intervals
+        else:
+            self._intervals.pop(key, None)
+        self._buffer[key] = intervals
+        if len(self._buffer) >= self.BUFFER:
+            self._flush()
+
+    def intervals(self, key):
+        """
+        return the intervals of key
+        """
+        return self._intervals.get(key, [])
+
+    def at(self, timestamp):
+        """
+        return the set of keys present at timestamp
+        """
+        out = set([])
+        for (generation, keys, tree) in self._levels:
+            if tree is not None:
+                out.update([key for key in tree.stab(timestamp)
+                            if key not in self._buffer and self._generations.get(key, 0) == generation])
+        out.update([key for (key, i) in self._buffer.items() if containsTimestamp(i, timestamp)])
+        return out
+
+    def during(self, key, t1, t2):
+        """
+        check whether key is present at any time from t1 to t2 (inclusive)
+        """
+        return overlapsWindow(self.intervals(key), t1, t2)
+
+def _startingBy(intervals, timestamp):
+    """
+    return the number of intervals in a list which start at or before
+    timestamp (a binary search on the starts)
+    """
+    lo, hi = 0, len(intervals)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if intervals[mid][0] <= timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def containsTimestamp(intervals, timestamp):
+    """
+    check whether a list of intervals covers timestamp
+    """
+    i = _startingBy(intervals, timestamp)
+    return i > 0 and (intervals[i - 1][1] is None or timestamp < intervals[i - 1][1])
+
+def overlapsWindow(intervals, t1, t2):
+    """
+    check whether a list of intervals covers any time from t1 to t2
+    (inclusive)
+    """
+    # the last interval starting at or before t2 is the only one which can
+    # reach past t1, since the intervals are disjoint and in order
+    i = _startingBy(intervals, t2)
+    return i > 0 and (intervals[i - 1][1] is None or intervals[i - 1][1] > t1)
+
+class LivenessIndex:
+    """
+    interval indexes of the vertices and edges of an LWWElementGraph, made
+    by its liveVertices, liveEdges, hasVertexDuring and hasEdgeDuring
+    methods and kept up to date by the graph
+
+    The interval of an edge is cut down to the intervals where both of its
+    endpoints are present too, so edges which hasEdge would reject because
+    of an endpoint are not live. Writes only mark the vertices and edges
+    they touch (and the edges of the vertices they touch) as stale, and
+    their intervals are recomputed at the next query.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+
+        # copy the elements first, since writers may add to them while the
+        # index is being built (see ConcurrentLWWElementGraph)
+        vertexIntervals = dict([(v, graph.vertexIntervals(v)) for v in tuple(graph.vertices.elements())])
+        self._vertices = IntervalIndex(vertexIntervals)
+
+        # as graph.edgeIntervals, but without working out the intervals of
+        # each vertex again for every edge
+        edgeIntervals = {}
+        for e in tuple(graph.edges.elements()):
+            intervals = graph.edges.intervals(e)
+            for v in e:
+                intervals = intersectIntervals(intervals, vertexIntervals.get(v, []))
+            edgeIntervals[e] = intervals
+        self._edges = IntervalIndex(edgeIntervals)
+        self._staleVertices = set([])
+        self._staleEdges = set([])
+
+    def update(self, vertices, edges):
+        """
+        mark the given vertices and edges, and the edges of the vertices, as
+        stale after a write
+        """
+        for v in vertices:
+            self._staleVertices.add(v)
+            self._staleEdges.update(tuple(self.graph._incidentEdges.get(v, ())))
+        self._staleEdges.update([frozenset(e) for e in edges])
+
+    def _refresh(self):
+        for v in self._staleVertices:
+            self._vertices.update(v, self.graph.vertexIntervals(v))
+        for e in self._staleEdges:
+            self._edges.update(e, self.graph.edgeIntervals(e))
+        self._staleVertices = set([])
+        self._staleEdges = set([])
+
+    def vertices(self, timestamp):
+        self._refresh()
+        return self._vertices.at(timestamp)
+
+    def edges(self, timestamp):
+        self._refresh()
+        return self._edges.at(timestamp)
+
+    def vertexDuring(self, v, t1, t2):
+        self._refresh()
+        return self._vertices.during(v, t1, t2)
+
+    def edgeDuring(self, e, t1, t2):
+        self._refresh()
+        return self._edges.during(e, t1, t2)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+import benchmark
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+from livenessindex import IntervalIndex, containsTimestamp, intersectIntervals
+
+class testLivenessIndex(unittest.TestCase):
+    
+    def test_intervals(self):
+        # removed and added again at 2 is no gap, and 3 is a tie so it is added
+        u = LWWElementSet(set([(1, 0), (1, 2), (1, 3), (1, 6), (2, 1)]), set([(1, 2), (1, 3), (1, 4), (1, 5), (3, 0)]))
+        self.assertEqual(u.intervals(1), [(0, 4), (6, None)])
+        self.assertEqual(u.intervals(2), [(1, None)])
+        self.assertEqual(u.intervals(3), [])
+        
+        self.assertEqual(intersectIntervals([(0, 4), (6, None)], [(2, 7), (8, 9), (10, None)]),
+                         [(2, 4), (6, 7), (8, 9), (10, None)])
+        
+        index = IntervalIndex({'a': [(0, 4), (6, None)], 'b': [(1, 2)], 'c': []})
+        self.assertEqual([index.at(t) for t in range(-1, 7)],
+                         [set([]), set(['a']), set(['a', 'b']), set(['a']), set(['a']), set([]), set([]), set(['a'])])
+        index.update('b', [(4, 5)])
+        self.assertEqual(index.at(4), set(['b']))
+        self.assertEqual(index.at(1), set(['a']))
+        self.assertEqual([index.during('a', t1, t2) for (t1, t2) in [(4, 5), (4, 6), (3, 3), (10, 20)]],
+                         [False, True, True, True])
+    
+    def test_updates(self):
+        # after many updates the index still agrees with the intervals, and
+        # only a bounded number of changed keys are checked one by one
+        rng = random.Random(0)
+        def randomIntervals():
+            starts = sorted(rng.sample(range(100), 2 * rng.randrange(3)))
+            return [(starts[i], starts[i + 1]) for i in range(0, len(starts), 2)]
+        intervals = dict([(key, randomIntervals()) for key in range(500)])
+        index = IntervalIndex(intervals)
+        for i in range(3000):
+            key = rng.randrange(600)
+            intervals[key] = randomIntervals()
+            index.update(key, intervals[key])
+            self.assertLessEqual(len(index._buffer), IntervalIndex.BUFFER)
+            if i % 97 == 0:
+                for t in rng.sample(range(100), 5):
+                    self.assertEqual(index.at(t), set([key for (key, i) in intervals.items() if containsTimestamp(i, t)]))
+        
+    def test_graph(self):
+        g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        g.addVertices([1, 2, 3], 0)
+        g.addEdges([(1, 2), (2, 3)], 1)
+        
+        # Bob removes 3 without seeing the edge (2, 3), which dies with it
+        other = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        other.removeVertex(3, 3)
+        g.mergeInto(other)
+        
+        self.assertEqual(g.edgeIntervals(frozenset([2, 3])), [(1, 3)])
+        self.assertEqual(g.liveEdges(2), set([frozenset([1, 2]), frozenset([2, 3])]))
+        self.assertEqual(g.liveEdges(3), set([frozenset([1, 2])]))
+        self.assertEqual(g.hasEdgeDuring((2, 3), 3, 10), False)
+        self.assertEqual(g.hasEdgeDuring((2, 3), 0, 1), True)
+        
+        # later writes are picked up, including revivals through an endpoint
+        g.addVertex(3, 5)
+        self.assertEqual(g.liveVertices(5), set([1, 2, 3]))
+        self.assertEqual(g.liveEdges(5), set([frozenset([1, 2]), frozenset([2, 3])]))
+        self.assertEqual(g.hasVertexDuring(3, 3, 4), False)
+        
+        g.compact(4)
+        self.assertEqual(g.liveEdges(5), set([frozenset([1, 2]), frozenset([2, 3])]))
+    
+    def test_sameAsHasEdge(self):
+        rng = random.Random(0)
+        for kind in benchmark.KINDS:
+            g = benchmark.emptyGraph()
+            g.liveVertices(0)
+            for (i, (editor, method, args)) in enumerate(benchmark.generateWorkload(kind, 1500, seed=5)):
+                if editor == 0:
+                    getattr(g, method)(*args)
+                if i % 150 == 0:
+                    for t in [rng.randrange(i + 1) for _ in range(3)]:
+                        self.assertEqual(g.liveVertices(t),
+                                         set([v for v in g.vertices.elements() if g.hasVertex(v, t)]))
+                        self.assertEqual(g.liveEdges(t),
+                                         set([e for e in g.edges.elements() if g.hasEdge(e, t)]))
+                    for e in rng.sample(list(g.edges.elements()), min(10, len(g.edges.elements()))):
+                        (t1, t2) = sorted([rng.randrange(i + 1), rng.randrange(i + 1)])
+                        self.assertEqual(g.hasEdgeDuring(e, t1, t2),
+                                         any([g.hasEdge(e, t) for t in range(t1, t2 + 1)]))
+        
+if __name__ == '__main__':
+    unittest.main()
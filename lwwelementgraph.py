@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import heapq
+from collections import OrderedDict
+
 from lwwelementset import LWWElementSet
 from exceptions import NonExistentVertex
+from connectivityindex import ConnectivityIndex
+from livenessindex import LivenessIndex, intersectIntervals
+from instrumentation import instrumented
 
+@instrumented
 class LWWElementGraph:
     """
     LWWElementGraph class
@@ -15,7 +22,7 @@ class LWWElementGraph:
     """
     
     
-    def __init__(self, vertices, edges):
+    def __init__(self, vertices, edges, snapshotCacheSize=16, journal=None):
         
         if not isinstance(vertices, LWWElementSet) or not isinstance(edges, LWWElementSet):
             raise TypeError
@@ -23,6 +30,60 @@ class LWWElementGraph:
         self.vertices = vertices
         self.edges = edges
         
+        # incidence index from each vertex to the edges which have ever been
+        # added with it as an endpoint, so that neighbour lookups and vertex
+        # removal do not have to walk every edge in the graph
+        self._incidentEdges = {}
+        for e in edges.addSet:
+            self._indexEdge(e[0])
+            
+        # least recently used cache of the live graphs made by materialise,
+        # keyed by timestamp. Writes through the methods of this class drop
+        # the cached graphs they can affect
+        self.snapshotCacheSize = snapshotCacheSize
+        self.snapshotCacheHits = 0
+        self.snapshotCacheMisses = 0
+        self._snapshotCache = OrderedDict()
+        
+        # optional journal (such as an oplog.OperationLog) which is given
+        # every change made through the methods of this class, as the name of
+        # the method and its arguments, so that it can be replayed later
+        self.journal = journal
+        
+        # index of the connected components now (see ConnectivityIndex),
+        # made the first time connected or componentOf is called and kept up
+        # to date by every write after that
+        self.connectivity = None
+        
+        # index of the liveness intervals of the vertices and edges (see
+        # LivenessIndex), made and kept up to date in the same way by
+        # liveVertices, liveEdges, hasVertexDuring and hasEdgeDuring
+        self.liveness = None
+            
+    def _indexEdge(self, e):
+        """
+        record edge e in the incidence index of each of its endpoints
+        """
+        for v in e:
+            self._incidentEdges.setdefault(v, set()).add(e)
+        
+    def _journal(self, method, *args):
+        """
+        pass a change to the journal, if there is one
+        """
+        if self.journal is not None:
+            self.journal.append(method, args)
+        
+    def _updateIndexes(self, vertices, edges):
+        """
+        pass the vertices and edges touched by a write to the connectivity
+        and liveness indexes, if there are any
+        """
+        if self.connectivity is not None:
+            self.connectivity.update(vertices, edges)
+        if self.liveness is not None:
+            self.liveness.update(vertices, edges)
+        
     def __eq__(self, other):
         # this is required because we need to test that merging is commutative etc.
         # which requires that we can test LWWElementGraph objects for equality
@@ -38,7 +99,10 @@ class LWWElementGraph:
         """
         add vertex x at timestamp
         """
-        self.vertices.addElement(x, timestamp)        
+        self.vertices.addElement(x, timestamp)
+        self._invalidateSnapshots(timestamp)
+        self._updateIndexes([x], [])
+        self._journal('addVertex', x, timestamp)
         
     def removeVertex(self, x, timestamp):
         """
@@ -46,13 +110,24 @@ class LWWElementGraph:
         also remove all trailing edges
         """
         self.vertices.removeElement(x, timestamp)
+        self._invalidateSnapshots(timestamp)
         
         # remove all trailing edges
-        # every potential trailing edge must be in the addset. If it's already 
-        # been deleted, there is no harm in removing it again (or is there?)
-        for e in self.edges.addSet:
-            if (x in e[0]):# and (self.hasEdge(e[0], timestamp)):
-                self.edges.removeElement(e[0], timestamp)
+        # every potential trailing edge must be in the addset, so it is in the
+        # incidence index. An edge is tombstoned even if it is already dead
+        # here, since an add of it from another replica may still arrive.
+        # Only edges which already have a remove at or after timestamp are
+        # skipped, since that remove beats everything this one would, so
+        # removing a vertex again does not grow the remove set
+        trailing = tuple(self._incidentEdges.get(x, ()))
+        for e in trailing:
+            if not self.edges.removedSince(e, timestamp):
+                self.edges.removeElement(e, timestamp)
+        
+        # the vertex can still be live (if the removal is in the past or ties
+        # with an add), so the indexes are told about the edges as well
+        self._updateIndexes([x], trailing)
+        self._journal('removeVertex', x, timestamp)
         
     def addEdge(self, e, timestamp):
         """
@@ -64,6 +139,10 @@ class LWWElementGraph:
                 raise NonExistentVertex('Cannot add edge if not all endpoints exist.')     
         # if no exception was raised
         self.edges.addElement(e, timestamp)
+        self._indexEdge(e)
+        self._invalidateSnapshots(timestamp)
+        self._updateIndexes([], [e])
+        self._journal('addEdge', e, timestamp)
         
     def addEdgeBetween(self, v1, v2, timestamp):
         """
@@ -76,6 +155,9 @@ class LWWElementGraph:
         remove edge e at timestamp
         """
         self.edges.removeElement(e, timestamp)
+        self._invalidateSnapshots(timestamp)
+        self._updateIndexes([], [e])
+        self._journal('removeEdge', e, timestamp)
         
     def removeEdgeBetween(self, v1, v2, timestamp):
         """
@@ -87,7 +169,7 @@ class LWWElementGraph:
         """
         check if vertex x exists at timestamp
         """
-        return self.vertices.snapshot(timestamp).contains(x)
+        return self.vertices.contains(x, timestamp)
         
     def hasEdge(self, e, timestamp):
         """
@@ -104,7 +186,7 @@ class LWWElementGraph:
         When the two graphs are merged, the edge {v, v} exists at time 2 but
         the vertex v doesn't. So the edge {v, v} should not exist either
         """
-        if self.edges.snapshot(timestamp).contains(e):
+        if self.edges.contains(e, timestamp):
             # check whether vertices exist
             for v in e:
                 # if a vertex does not exist, false
@@ -121,23 +203,210 @@ class LWWElementGraph:
         """
         return self.hasEdge(frozenset([v1, v2]), timestamp)
     
+    def addVertices(self, xs, timestamp):
+        """
+        add each vertex in xs at timestamp
+        """
+        xs = list(xs)
+        for x in xs:
+            self.vertices.addElement(x, timestamp)
+        self._invalidateSnapshots(timestamp)
+        self._updateIndexes(xs, [])
+        self._journal('addVertices', xs, timestamp)
+        
+    def removeVertices(self, xs, timestamp):
+        """
+        remove each vertex in xs at timestamp, together with their trailing
+        edges
+        """
+        xs = list(xs)
+        for x in xs:
+            self.vertices.removeElement(x, timestamp)
+        
+        # collect the trailing edges first, so that an edge between two of
+        # the vertices is only looked at once
+        trailing = set([])
+        for x in xs:
+            trailing.update(self._incidentEdges.get(x, ()))
+        for e in trailing:
+            if not self.edges.removedSince(e, timestamp):
+                self.edges.removeElement(e, timestamp)
+        self._invalidateSnapshots(timestamp)
+        self._updateIndexes(xs, trailing)
+        self._journal('removeVertices', xs, timestamp)
+        
+    def addEdges(self, es, timestamp):
+        """
+        add each edge in es at timestamp, where an edge is a frozenset of its
+        endpoints or a pair (v1, v2)
+        
+        the endpoints of all the edges are checked before anything is added,
+        so if one of them does not exist at timestamp NonExistentVertex is
+        raised and none of the edges are added
+        """
+        es = [frozenset(e) for e in es]
+        
+        # check each endpoint once, however many edges it is in
+        endpoints = set([]).union(*es)
+        for v in endpoints:
+            if not self.hasVertex(v, timestamp):
+                raise NonExistentVertex('Cannot add edge if not all endpoints exist.')
+        
+        for e in es:
+            self.edges.addElement(e, timestamp)
+            self._indexEdge(e)
+        self._invalidateSnapshots(timestamp)
+        self._updateIndexes([], es)
+        self._journal('addEdges', es, timestamp)
+        
+    def removeEdges(self, es, timestamp):
+        """
+        remove each edge in es at timestamp, where an edge is a frozenset of
+        its endpoints or a pair (v1, v2)
+        """
+        es = [frozenset(e) for e in es]
+        for e in es:
+            self.edges.removeElement(e, timestamp)
+        self._invalidateSnapshots(timestamp)
+        self._updateIndexes([], es)
+        self._journal('removeEdges', es, timestamp)
+        
+    def hasVertices(self, xs, timestamp):
+        """
+        return the list of booleans saying whether each vertex in xs exists at
+        timestamp
+        """
+        return [self.vertices.contains(x, timestamp) for x in xs]
+        
+    def hasEdges(self, es, timestamp):
+        """
+        return the list of booleans saying whether each edge in es exists at
+        timestamp, where an edge is a frozenset of its endpoints or a pair
+        (v1, v2)
+        """
+        # whether each endpoint exists, so that it is only looked up once
+        live = {}
+        
+        out = []
+        for e in es:
+            e = frozenset(e)
+            exists = self.edges.contains(e, timestamp)
+            for v in e:
+                if not exists:
+                    break
+                if v not in live:
+                    live[v] = self.hasVertex(v, timestamp)
+                exists = live[v]
+            out.append(exists)
+        return out
+    
     def merge(self, other):
         """
         merge two LWWElementGraph objects together
         """
         
-        # create empty sets of vertices and edges
-        v = LWWElementSet(set([]), set([]))
-        e = LWWElementSet(set([]), set([]))
+        # the constructor builds the incidence index of the merged object
+        merged = LWWElementGraph(self.vertices.merge(other.vertices),
+                                 self.edges.merge(other.edges))
+        
+        return merged
+    
+    def compact(self, horizon):
+        """
+        collapse the history of the vertices and edges before horizon, see
+        LWWElementSet.compact. Return the number of operations dropped
+        
+        hasVertex and hasEdge give the same answers at or after horizon
+        """
+        dropped = self.vertices.compact(horizon) + self.edges.compact(horizon)
         
-        # create an object to be the result of the merge
-        merged = LWWElementGraph(v, e)
+        # cached graphs before horizon no longer match the history
+        for t in [t for t in self._snapshotCache if t is not None and t < horizon]:
+            del self._snapshotCache[t]
         
-        # populate the merged object
-        merged.vertices = self.vertices.merge(other.vertices)
-        merged.edges = self.edges.merge(other.edges)
+        self._journal('compact', horizon)
         
-        return merged
+        # intervals before horizon have changed, so the liveness index is
+        # made again when it is next used
+        self.liveness = None
+        
+        # forget edges which no longer have an add
+        for v in list(self._incidentEdges):
+            incident = set([e for e in self._incidentEdges[v] if e in self.edges.elements()])
+            if incident:
+                self._incidentEdges[v] = incident
+            else:
+                del self._incidentEdges[v]
+        
+        return dropped
+    
+    @property
+    def sequence(self):
+        """
+        watermark for deltaSince: the sequence numbers of the vertices and
+        edges
+        """
+        return (self.vertices.sequence, self.edges.sequence)
+    
+    def deltaSince(self, sequence):
+        """
+        return an LWWElementGraph holding only the operations which became
+        known to this replica after sequence (a value of self.sequence)
+        """
+        return LWWElementGraph(self.vertices.deltaSince(sequence[0]),
+                               self.edges.deltaSince(sequence[1]))
+    
+    def deltaFor(self, peer):
+        """
+        return an LWWElementGraph holding the operations which peer has not
+        acknowledged yet (see LWWElementSet.deltaFor)
+        """
+        return LWWElementGraph(self.vertices.deltaFor(peer), self.edges.deltaFor(peer))
+    
+    def ackDelta(self, peer, sequence):
+        """
+        record that peer has applied the operations before sequence (a value
+        of self.sequence read before the delta was made)
+        """
+        self.vertices.ackDelta(peer, sequence[0])
+        self.edges.ackDelta(peer, sequence[1])
+    
+    def applyDelta(self, delta, peer=None):
+        """
+        merge the operations in delta (an LWWElementGraph, usually made by
+        deltaSince or deltaFor on another replica) into this object in place,
+        in time proportional to the size of delta
+        """
+        self.mergeInto(delta, peer)
+    
+    def mergeInto(self, other, peer=None):
+        """
+        merge another LWWElementGraph object into this one in place
+        """
+        self.vertices.mergeInto(other.vertices, peer)
+        self.edges.mergeInto(other.edges, peer)
+        for e in other.edges.addSet:
+            self._indexEdge(e[0])
+        
+        timestamps = [a[1] for ops in [other.vertices.addSet, other.vertices.removeSet,
+                                       other.edges.addSet, other.edges.removeSet]
+                      for a in ops]
+        if timestamps:
+            self._invalidateSnapshots(min(timestamps))
+        self._updateIndexes(set([x for (x, t) in other.vertices.addSet | other.vertices.removeSet]),
+                                 set([e for (e, t) in other.edges.addSet | other.edges.removeSet]))
+        self._journal('mergeInto', other.vertices.addSet, other.vertices.removeSet,
+                      other.edges.addSet, other.edges.removeSet)
+    
+    @staticmethod
+    def mergeAll(replicas):
+        """
+        merge any number of LWWElementGraph objects in one pass, allocating
+        only the result
+        """
+        replicas = list(replicas)
+        return LWWElementGraph(LWWElementSet.mergeAll([r.vertices for r in replicas]),
+                               LWWElementSet.mergeAll([r.edges for r in replicas]))
     
     def findAllVerticesConnectedTo(self, v, timestamp):
         """
@@ -147,18 +416,89 @@ class LWWElementGraph:
         # list to store the results
         out = []
         
-        for e in self.edges.addSet:
-            if (v in e[0]) and self.hasEdge(e[0], timestamp):
-                if len(e[0]) == 1:
+        for e in self._incidentEdges.get(v, ()):
+            if self.hasEdge(e, timestamp):
+                if len(e) == 1:
                     out += [v]
                 else:
                     # e has exactly two elements
                     # add the single element which is not v
-                    out += list( e[0].difference(set([v])) )
+                    out += list( e.difference(set([v])) )
                     
         # return results as a set
         return set(out)
     
+    def connected(self, v1, v2):
+        """
+        Return True if there is a path between v1 and v2 now (taking every
+        operation into account), using the connectivity index
+        
+        the first call builds the index, and later calls take near constant
+        time unless a removal has split the component of v1 or v2 since the
+        last call
+        """
+        if self.connectivity is None:
+            self.connectivity = ConnectivityIndex(self)
+        return self.connectivity.connected(v1, v2)
+    
+    def componentOf(self, v):
+        """
+        Return the id of the connected component of v now, which is one of the
+        vertices in it. Vertices have the same id exactly when they are
+        connected, but ids can change after any write
+        """
+        if self.connectivity is None:
+            self.connectivity = ConnectivityIndex(self)
+        return self.connectivity.component(v)
+    
+    def vertexIntervals(self, v):
+        """
+        return the intervals in which vertex v exists, as (start, end) pairs
+        (see LWWElementSet.intervals)
+        """
+        return self.vertices.intervals(v)
+    
+    def edgeIntervals(self, e):
+        """
+        return the intervals in which edge e exists, which are the intervals
+        of the edge cut down to those in which both endpoints exist
+        """
+        intervals = self.edges.intervals(e)
+        for v in e:
+            intervals = intersectIntervals(intervals, self.vertices.intervals(v))
+        return intervals
+    
+    def _livenessIndex(self):
+        if self.liveness is None:
+            self.liveness = LivenessIndex(self)
+        return self.liveness
+    
+    def liveVertices(self, timestamp):
+        """
+        return the set of vertices which exist at timestamp, in O(log n +
+        output) time using the liveness index
+        """
+        return self._livenessIndex().vertices(timestamp)
+    
+    def liveEdges(self, timestamp):
+        """
+        return the set of edges which exist at timestamp (with both of their
+        endpoints), in O(log n + output) time using the liveness index
+        """
+        return self._livenessIndex().edges(timestamp)
+    
+    def hasVertexDuring(self, v, t1, t2):
+        """
+        check whether vertex v exists at any time from t1 to t2 (inclusive)
+        """
+        return self._livenessIndex().vertexDuring(v, t1, t2)
+    
+    def hasEdgeDuring(self, e, t1, t2):
+        """
+        check whether edge e exists at any time from t1 to t2 (inclusive)
+        """
+        return self._livenessIndex().edgeDuring(frozenset(e), t1, t2)
+    
     def findAnyPathBetweenTwoVertices(self, v1, v2, timestamp):
         """
         Return True if there is a path between v1 and v2 in the graph at timestamp
@@ -169,26 +509,194 @@ class LWWElementGraph:
         
         Also, I am not sure whether there is a path between v and v if there is no loop at v? It is easier to assume that there is a path, even if there is no loop
         """
+        return self.findShortestPathBetweenTwoVertices(v1, v2, timestamp) is not None
+    
+    def findShortestPathBetweenTwoVertices(self, v1, v2, timestamp):
+        """
+        Return a shortest path between v1 and v2 in the graph at timestamp as a
+        list of vertices [v1, ..., v2], or None if there is no path
+        
+        This is a bidirectional breadth first search which looks up the
+        neighbours of each vertex through the incidence index as it goes, so
+        only the part of the graph between v1 and v2 is visited
+        """
         # check whether the vertices are in the graph
         if not (self.hasVertex(v1, timestamp) and self.hasVertex(v2, timestamp)):
             raise NonExistentVertex('Vertex does not exist')
         
-        v1_neighbourhood = set([])
-        v1_neighbourhood_next = set([v1])
+        return self._bidirectionalSearch(v1, v2, lambda v: self.findAllVerticesConnectedTo(v, timestamp))
+    
+    def findPathsBetweenManyVertices(self, pairs, timestamp):
+        """
+        Return a list of booleans saying whether there is a path between v1 and
+        v2 at timestamp for each pair (v1, v2) in pairs
+        
+        The live graph at timestamp is extracted once and shared by all the
+        searches, and there is one breadth first search per distinct v1
+        """
+        pairs = list(pairs)
+        for pair in pairs:
+            for v in pair:
+                if not self.hasVertex(v, timestamp):
+                    raise NonExistentVertex('Vertex does not exist')
+        
+        adjacency = self.materialise(timestamp)[1]
+        
+        # set of vertices reachable from each source
+        reachable = {}
+        for (v1, v2) in pairs:
+            if v1 not in reachable:
+                reachable[v1] = self._breadthFirstSearch(v1, lambda v: adjacency.get(v, ()))
+        
+        return [v2 in reachable[v1] for (v1, v2) in pairs]
+    
+    def changesBetween(self, t1, t2):
+        """
+        generator of the changes to the live graph from t1 to t2, as
+        ('vertex', v, live) and ('edge', e, live) where live says whether the
+        vertex or edge exists at t2 (so it did not at t1)
+        
+        only the vertices and edges with operations after t1 and up to t2 are
+        looked at, in timestamp order, using the timestamp index of the
+        vertices and edges. For each vertex, the edges in its incidence index
+        are checked as well, since an edge stops existing when one of its
+        endpoints is removed even if the edge itself is not (for example after
+        a merge). Each change is yielded once, as soon as it is found, so a
+        large window is streamed rather than built up
+        """
+        seenVertices = set([])
+        seenEdges = set([])
+        operations = heapq.merge(((t, False, x) for (t, x) in self.vertices.operationsBetween(t1, t2)),
+                                 ((t, True, x) for (t, x) in self.edges.operationsBetween(t1, t2)),
+                                 key=lambda op: op[0])
         
-        # grow the neighbourhood of v1 until it has maximum size
-        while v1_neighbourhood != v1_neighbourhood_next:
-            v1_neighbourhood = v1_neighbourhood_next.copy()
+        for (_, isEdge, x) in operations:
+            if isEdge:
+                edges = [x]
+            else:
+                if x in seenVertices:
+                    continue
+                seenVertices.add(x)
+                live = self.hasVertex(x, t2)
+                if live != self.hasVertex(x, t1):
+                    yield ('vertex', x, live)
+                edges = tuple(self._incidentEdges.get(x, ()))
             
-            for e in self.edges.addSet:
-                if self.hasEdge(e[0], timestamp):
-                    if v1 in e[0]:
-                        # if the edge e[0] contains v1, add the other vertex in e[0] to the neighbourhood. Submission was rejected because of a bug in this part which previously had v1_neighbourhood_next.union(e[0])
-                        v1_neighbourhood_next = v1_neighbourhood_next.union(e[0].difference(set([v1])))
-            #print(v1_neighbourhood)
-            #print(v1_neighbourhood_next)
-        
-        # check whether maximal neighbourhood of v1 contains v2            
-        if v2 in v1_neighbourhood:
-            return True
-        return False
\ No newline at end of file
+            for e in edges:
+                if e in seenEdges:
+                    continue
+                seenEdges.add(e)
+                live = self.hasEdge(e, t2)
+                if live != self.hasEdge(e, t1):
+                    yield ('edge', e, live)
+    
+    def materialise(self, timestamp):
+        """
+        return the live graph at timestamp as a pair (vertices, adjacency),
+        where vertices is the set of vertices which exist at timestamp and
+        adjacency is a dict from each of them to the set of its neighbours
+        
+        the result is cached, so the same objects are returned by later calls
+        with the same timestamp and should not be modified. timestamp can be
+        None for the live graph now
+        """
+        if timestamp in self._snapshotCache:
+            self.snapshotCacheHits += 1
+            self._snapshotCache.move_to_end(timestamp)
+            return self._snapshotCache[timestamp]
+        self.snapshotCacheMisses += 1
+        
+        adjacency = {}
+        for v in self.vertices.elements():
+            if self.hasVertex(v, timestamp):
+                adjacency[v] = self.findAllVerticesConnectedTo(v, timestamp)
+        live = (frozenset(adjacency), adjacency)
+        
+        if self.snapshotCacheSize > 0:
+            self._snapshotCache[timestamp] = live
+            if len(self._snapshotCache) > self.snapshotCacheSize:
+                # evict the least recently used graph
+                self._snapshotCache.popitem(last=False)
+        return live
+    
+    def _invalidateSnapshots(self, timestamp):
+        """
+        drop the cached live graphs which a write at timestamp can change,
+        which are the ones at or after timestamp
+        
+        the graph at None (now) comes after every timestamp, so every write
+        drops it
+        """
+        for t in [t for t in self._snapshotCache if t is None or t >= timestamp]:
+            del self._snapshotCache[t]
+    
+    @staticmethod
+    def _breadthFirstSearch(source, neighbours):
+        """
+        return the set of vertices reachable from source, where neighbours(v)
+        gives the vertices adjacent to v
+        """
+        seen = set([source])
+        frontier = [source]
+        while frontier:
+            next_frontier = []
+            for u in frontier:
+                for w in neighbours(u):
+                    if w not in seen:
+                        seen.add(w)
+                        next_frontier.append(w)
+            frontier = next_frontier
+        return seen
+    
+    @staticmethod
+    def _bidirectionalSearch(v1, v2, neighbours):
+        """
+        return a shortest path from v1 to v2 as a list of vertices, or None,
+        where neighbours(v) gives the vertices adjacent to v
+        
+        the searches from v1 and from v2 take turns to expand a whole layer,
+        always expanding the smaller frontier, until they meet
+        """
+        if v1 == v2:
+            # there is a path from v to v even if there is no loop at v
+            return [v1]
+        
+        # parent and distance of each vertex seen from each end
+        parents = ({v1: None}, {v2: None})
+        depth = ({v1: 0}, {v2: 0})
+        frontiers = ([v1], [v2])
+        
+        while frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            other = 1 - side
+            
+            next_frontier = []
+            meetings = []
+            for u in frontiers[side]:
+                for w in neighbours(u):
+                    if w not in parents[side]:
+                        parents[side][w] = u
+                        depth[side][w] = depth[side][u] + 1
+                        next_frontier.append(w)
+                        if w in parents[other]:
+                            meetings.append(w)
+            frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+            
+            if meetings:
+                # finish the layer before choosing, because the first meeting
+                # found is not necessarily on a shortest path
+                meet = min(meetings, key=lambda w: depth[0][w] + depth[1][w])
+                
+                path = []
+                w = meet
+                while w is not None:
+                    path.append(w)
+                    w = parents[0][w]
+                path.reverse()
+                w = parents[1][meet]
+                while w is not None:
+                    path.append(w)
+                    w = parents[1][w]
+                return path
+        
+        return None
@@ -72,7 +72,7 @@ class testLWWElementGraph(unittest.TestCase):
         g.addVertex(1, 0)
         g.addVertex(2, 0)
         g.addEdgeBetween(1, 2, 0)
-
+        
         self.assertEqual(g.hasEdgeBetween(1, 2, 0), True)
         
         # remove the edge and check that it is gone
@@ -114,16 +114,16 @@ class testLWWElementGraph(unittest.TestCase):
         g.removeVertex(2, 3)
         
         self.assertEqual(g.findAllVerticesConnectedTo(1, 3), set([3]))
-
+        
         # add another vertex connected to 3 but not 1
         # graph is now 1---3---4 at timestamp 4
         g.addVertex(4, 4)
         g.addEdgeBetween(3, 4, 4)
-
+        
         self.assertEqual(g.findAllVerticesConnectedTo(1, 4), set([3]))
         
     def test_findAnyPathBetweenTwoVertices(self):
-
+    
         # create instance of LWWElementGraph
         vertices = LWWElementSet(set([]), set([]))
         edges = LWWElementSet(set([]), set([]))
@@ -136,7 +136,7 @@ class testLWWElementGraph(unittest.TestCase):
         g.addEdgeBetween(1, 1, 0)
         g.addEdgeBetween(1, 2, 0)   
         g.addEdgeBetween(2, 3, 0)
-
+        
         self.assertEqual(g.findAnyPathBetweenTwoVertices(1, 3, 0), True)
         
         # check that there is no longer a path if you remove the middle vertex
@@ -146,7 +146,7 @@ class testLWWElementGraph(unittest.TestCase):
         
         # check that there is a path from 1 to 1
         self.assertEqual(g.findAnyPathBetweenTwoVertices(1, 1, 1), True)
-
+    
         
     def test_merge(self):
         """
@@ -177,6 +177,247 @@ class testLWWElementGraph(unittest.TestCase):
         self.assertEqual(Alice.merge(Bob).hasVertex('v', 2), False)
         self.assertEqual(Alice.merge(Bob).hasEdgeBetween('v', 'v', 2), False)
         
+    def test_findShortestPathBetweenTwoVertices(self):
+        
+        g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        
+        for v in range(1, 7):
+            g.addVertex(v, 0)
+        
+        # long way round 1---2---3---4---5 and a short cut 1---6---5
+        for (v1, v2) in [(1, 2), (2, 3), (3, 4), (4, 5), (1, 6), (6, 5)]:
+            g.addEdgeBetween(v1, v2, 0)
+        
+        self.assertEqual(g.findShortestPathBetweenTwoVertices(1, 5, 0), [1, 6, 5])
+        self.assertEqual(g.findShortestPathBetweenTwoVertices(3, 3, 0), [3])
+        
+        # cutting the short cut leaves the long way round
+        g.removeVertex(6, 1)
+        self.assertEqual(g.findShortestPathBetweenTwoVertices(5, 1, 1), [5, 4, 3, 2, 1])
+        
+        # the short cut is still there in the past
+        self.assertEqual(g.findShortestPathBetweenTwoVertices(5, 1, 0), [5, 6, 1])
+        
+        g.removeEdgeBetween(3, 4, 2)
+        self.assertEqual(g.findShortestPathBetweenTwoVertices(1, 5, 2), None)
+        
+        self.assertRaises(NonExistentVertex, g.findShortestPathBetweenTwoVertices, 1, 6, 2)
+        
+    def test_findPathsBetweenManyVertices(self):
+        
+        g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        
+        for v in 'abcde':
+            g.addVertex(v, 0)
+        
+        # two components a---b---c and d---e
+        g.addEdgeBetween('a', 'b', 0)
+        g.addEdgeBetween('b', 'c', 0)
+        g.addEdgeBetween('d', 'e', 0)
+        
+        pairs = [('a', 'c'), ('a', 'd'), ('e', 'd'), ('c', 'c'), ('a', 'b')]
+        self.assertEqual(g.findPathsBetweenManyVertices(pairs, 0), [True, False, True, True, True])
+        
+        # agrees with the single pair query
+        self.assertEqual(g.findPathsBetweenManyVertices(pairs, 0),
+                         [g.findAnyPathBetweenTwoVertices(v1, v2, 0) for (v1, v2) in pairs])
+        
+        self.assertRaises(NonExistentVertex, g.findPathsBetweenManyVertices, [('a', 'z')], 0)
+        
+    def test_bulk(self):
+        
+        g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        
+        g.addVertices(range(5), 0)
+        g.addEdges([(0, 1), (1, 2), frozenset([2, 3]), (3, 3)], 0)
+        
+        # nothing is added if one of the endpoints does not exist
+        self.assertRaises(NonExistentVertex, g.addEdges, [(0, 4), (4, 5)], 0)
+        self.assertEqual(g.hasEdgeBetween(0, 4, 0), False)
+        
+        self.assertEqual(g.hasVertices([0, 4, 5], 0), [True, True, False])
+        self.assertEqual(g.hasEdges([(0, 1), (1, 0), (3, 3), (0, 4)], 0), [True, True, True, False])
+        
+        g.removeVertices([1, 3], 1)
+        g.removeEdges([(0, 1)], 1)
+        self.assertEqual(g.hasVertices(range(5), 1), [True, False, True, False, True])
+        
+        # the trailing edges are removed too, and stay removed
+        g.addVertices([1, 3], 2)
+        self.assertEqual(g.hasEdges([(0, 1), (1, 2), (2, 3), (3, 3)], 2), [False] * 4)
+        self.assertEqual(g.hasEdges([(0, 1), (1, 2), (2, 3), (3, 3)], 0), [True] * 4)
+        
+    def test_incidenceAfterMerge(self):
+        
+        x = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        y = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        
+        x.addVertex('a', 0)
+        x.addVertex('b', 0)
+        x.addEdgeBetween('a', 'b', 0)
+        
+        y.addVertex('a', 0)
+        y.addVertex('c', 0)
+        y.addEdgeBetween('a', 'c', 0)
+        
+        # the merged graph knows about the edges from both replicas
+        merged = x.merge(y)
+        self.assertEqual(merged.findAllVerticesConnectedTo('a', 0), set(['b', 'c']))
+        
+        # removing the hub removes the edges which came from both replicas
+        merged.removeVertex('a', 1)
+        merged.addVertex('a', 2)
+        self.assertEqual(merged.findAllVerticesConnectedTo('a', 2), set([]))
+        self.assertEqual(merged.hasEdgeBetween('a', 'c', 2), False)
+        
+    def test_applyDelta(self):
+        
+        x = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        y = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        
+        x.addVertex('a', 0)
+        x.addVertex('b', 0)
+        y.applyDelta(x.deltaFor('y'), peer='x')
+        
+        sequence = x.sequence
+        x.addEdgeBetween('a', 'b', 1)
+        y.applyDelta(x.deltaSince(sequence), peer='x')
+        
+        self.assertEqual(x, y)
+        self.assertEqual(y.findAllVerticesConnectedTo('a', 1), set(['b']))
+        
+    def test_compact(self):
+        
+        g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        
+        g.addVertex(1, 0)
+        g.addVertex(2, 0)
+        g.addVertex(3, 0)
+        g.addEdgeBetween(1, 2, 0)
+        g.addEdgeBetween(2, 3, 0)
+        
+        # churn the hub vertex 2
+        for t in range(1, 10, 2):
+            g.removeVertex(2, t)
+            g.addVertex(2, t + 1)
+        g.addEdgeBetween(2, 3, 10)
+        
+        # every removal tombstones the edges, even when they are already
+        # dead, but removing the vertex again at the same time does not add
+        # more tombstones
+        self.assertEqual(len(g.edges.removeSet), 10)
+        g.removeVertex(2, 9)
+        self.assertEqual(len(g.edges.removeSet), 10)
+        
+        # compaction drops the tombstones which no longer matter
+        g.compact(10)
+        self.assertEqual(g.edges.removeSet, set([]))
+        
+        self.assertEqual(g.vertices.addSet, set([(1, 0), (2, 10), (3, 0)]))
+        self.assertEqual(g.edges, LWWElementSet(set([(frozenset([2, 3]), 10)]), set([])))
+        self.assertEqual(g.findAllVerticesConnectedTo(2, 10), set([3]))
+        self.assertEqual(g.hasEdgeBetween(1, 2, 10), False)
+        
+        # the incidence index forgets the dropped edge
+        g.removeVertex(1, 11)
+        self.assertEqual(g.edges.removeSet, set([]))
+        
+    def test_removeVertexTombstonesDeadEdges(self):
+        
+        a = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        a.addVertices(['a', 'b'], 0)
+        a.addEdgeBetween('a', 'b', 1)
+        b = a.merge(a)
+        
+        # the edge is dead on a when b is removed, but b adds it back
+        a.removeEdgeBetween('a', 'b', 2)
+        b.addEdgeBetween('a', 'b', 3)
+        a.removeVertex('b', 4)
+        
+        # so the removal of b still has to remove the edge after the merge
+        merged = a.merge(b)
+        merged.addVertex('b', 5)
+        self.assertEqual(merged.hasEdgeBetween('a', 'b', 5), False)
+        self.assertEqual(merged.hasEdgeBetween('a', 'b', 3), True)
+        
+    def test_materialise(self):
+        
+        g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])),
+                            snapshotCacheSize=2)
+        
+        g.addVertex(1, 0)
+        g.addVertex(2, 0)
+        g.addVertex(3, 1)
+        g.addEdgeBetween(1, 2, 1)
+        
+        self.assertEqual(g.materialise(0), (frozenset([1, 2]), {1: set([]), 2: set([])}))
+        self.assertEqual(g.materialise(1), (frozenset([1, 2, 3]), {1: set([2]), 2: set([1]), 3: set([])}))
+        self.assertEqual((g.snapshotCacheHits, g.snapshotCacheMisses), (0, 2))
+        
+        g.materialise(0)
+        g.materialise(1)
+        self.assertEqual((g.snapshotCacheHits, g.snapshotCacheMisses), (2, 2))
+        
+        # the least recently used graph is evicted
+        g.removeEdgeBetween(1, 2, 2)
+        self.assertEqual(g.materialise(2)[1][1], set([]))
+        self.assertEqual(g.materialise(1)[1][1], set([2]))
+        g.materialise(0)
+        self.assertEqual((g.snapshotCacheHits, g.snapshotCacheMisses), (3, 4))
+        
+        # a write at time 2 changes the graphs at or after time 2 only
+        other = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        other.removeVertex(3, 2)
+        g.mergeInto(other)
+        self.assertEqual(g.materialise(2)[0], frozenset([1, 2]))
+        self.assertEqual(g.materialise(0)[0], frozenset([1, 2]))
+        self.assertEqual((g.snapshotCacheHits, g.snapshotCacheMisses), (4, 5))
+        
+        g.addVertex(4, 0)
+        self.assertEqual(g.materialise(0)[0], frozenset([1, 2, 4]))
+        self.assertEqual((g.snapshotCacheHits, g.snapshotCacheMisses), (4, 6))
+        
+        # the graph now is cached under None, and dropped by any write
+        self.assertEqual(g.findPathsBetweenManyVertices([(1, 2)], None), [False])
+        self.assertEqual(g.materialise(None)[0], frozenset([1, 2, 4]))
+        self.assertEqual((g.snapshotCacheHits, g.snapshotCacheMisses), (5, 7))
+        g.addVertex(5, 3)
+        self.assertEqual(g.materialise(None)[0], frozenset([1, 2, 4, 5]))
+        g.compact(1)
+        self.assertEqual(g.materialise(None)[0], frozenset([1, 2, 4, 5]))
+        
+    def test_changesBetween(self):
+        
+        g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        g.addVertices([1, 2, 3], 0)
+        g.addEdges([(1, 2), (2, 3)], 1)
+        g.removeEdgeBetween(1, 2, 2)
+        g.addVertex(4, 2)
+        
+        # Bob removes 3 without seeing the edge, so it dies with its endpoint
+        other = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        other.removeVertex(3, 3)
+        g.mergeInto(other)
+        
+        self.assertEqual(sorted(g.changesBetween(0, 1), key=str),
+                         [('edge', frozenset([1, 2]), True), ('edge', frozenset([2, 3]), True)])
+        self.assertEqual(sorted(g.changesBetween(1, 3), key=str),
+                         [('edge', frozenset([1, 2]), False), ('edge', frozenset([2, 3]), False),
+                          ('vertex', 3, False), ('vertex', 4, True)])
+        self.assertEqual(list(g.changesBetween(3, 10)), [])
+        
+        # the changes are the difference between the live graphs at both ends
+        def live(t):
+            vertices, adjacency = g.materialise(t)
+            edges = set([frozenset([v, w]) for v in adjacency for w in adjacency[v]])
+            return set([('vertex', v) for v in vertices]) | set([('edge', e) for e in edges])
+        for (t1, t2) in [(-1, 0), (0, 2), (0, 3), (2, 3), (-1, 10)]:
+            changes = list(g.changesBetween(t1, t2))
+            self.assertEqual(len(changes), len(set(changes)))
+            self.assertEqual(set([(kind, x) for (kind, x, alive) in changes]), live(t1) ^ live(t2))
+            for (kind, x, alive) in changes:
+                self.assertEqual((kind, x) in live(t2), alive)
+        
     
 class testLWWElementGraphCRDT(unittest.TestCase):
     """
@@ -185,6 +426,8 @@ class testLWWElementGraphCRDT(unittest.TestCase):
     x.merge(x) == x
     x.merge(y) == y.merge(x)
     (x.merge(y)).merge(z) == x.merge(y.merge(z))
+    
+    and the in place and n-way merges should agree with merge
     """    
     def test_crdt(self):
         x = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
@@ -207,7 +450,16 @@ class testLWWElementGraphCRDT(unittest.TestCase):
         self.assertEqual(x.merge(y), y.merge(x))
         self.assertEqual( (x.merge(y)).merge(z), x.merge(y.merge(z)) )
         
+        self.assertEqual(LWWElementGraph.mergeAll([x, y, z]), (x.merge(y)).merge(z))
+        self.assertEqual(LWWElementGraph.mergeAll([z, x, y, x]), LWWElementGraph.mergeAll([x, y, z]))
+        self.assertEqual(LWWElementGraph.mergeAll([x]), x)
         
+        w = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        w.mergeInto(x)
+        w.mergeInto(y)
+        self.assertEqual(w, x.merge(y))
+        w.mergeInto(y)
+        self.assertEqual(w, x.merge(y))
         
-
-
+        # the in place merge keeps the incidence index up to date
+        self.assertEqual(w.findAllVerticesConnectedTo('b', 0), set(['a', 'c']))
@@ -1,7 +1,66 @@
 # -*- coding: utf-8 -*-
 
-import numpy as np
+from bisect import bisect_left, bisect_right, insort
+from contextlib import nullcontext
+from operator import itemgetter
 
+from merkle import MerkleDigest
+from instrumentation import instrumented
+
+# sort key of the (x, timestamp) tuples in the timestamp index
+_timestampOf = itemgetter(1)
+
+class _TimestampIndex:
+    """
+    (x, timestamp) tuples sorted by timestamp, kept in blocks of up to
+    2 * BLOCK tuples, so that an insert at an old timestamp only moves the
+    tuples of one block rather than every tuple after it
+    """
+    BLOCK = 512
+    
+    def __init__(self, operations):
+        """
+        operations is a list of tuples which is already sorted by timestamp
+        """
+        self._blocks = [operations[i:i + self.BLOCK] for i in range(0, len(operations), self.BLOCK)]
+        # the last timestamp in each block, to find the block of a timestamp
+        # with a bisect
+        self._maxes = [block[-1][1] for block in self._blocks]
+        
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+            
+    def insert(self, op):
+        """
+        insert an (x, timestamp) tuple after the ones with the same timestamp
+        """
+        if not self._blocks:
+            self._blocks.append([op])
+            self._maxes.append(op[1])
+            return
+        i = min(bisect_left(self._maxes, op[1]), len(self._blocks) - 1)
+        block = self._blocks[i]
+        insort(block, op, key=_timestampOf)
+        self._maxes[i] = block[-1][1]
+        if len(block) > 2 * self.BLOCK:
+            self._blocks[i:i + 1] = [block[:self.BLOCK], block[self.BLOCK:]]
+            self._maxes[i:i + 1] = [block[self.BLOCK - 1][1], block[-1][1]]
+            
+    def between(self, t1, t2):
+        """
+        return a list of the tuples with a timestamp after t1 and up to t2
+        """
+        out = []
+        for i in range(bisect_right(self._maxes, t1), len(self._blocks)):
+            block = self._blocks[i]
+            end = bisect_right(block, t2, key=_timestampOf)
+            out.extend(block[bisect_right(block, t1, key=_timestampOf):end])
+            if end < len(block):
+                break
+        return out
+
+@instrumented
 class LWWElementSet:
     """
     Last Writer Wins Element Set Class
@@ -24,12 +83,15 @@ class LWWElementSet:
     # create new object y
     y = LWWElementSet(set([(1,0), (2,2), (1,3)]), set([(1,1)]))
     
-    # show elements added or removed up to time 1
+    # show elements added or removed up to time 1 (a read only view of y,
+    # which copies nothing until materialise is called)
     y.snapshot(1)
+    y.snapshot(1).materialise()
     
     # check whether y contains an element
     y.contains(1) # True
     y.snapshot(1).contains(1) # False
+    y.contains(1, 1) # False, the same question
     
     # check that y contains 2
     y.contains(2)
@@ -42,6 +104,11 @@ class LWWElementSet:
     
     # merge two LWWElementSet objects
     y.merge(x)
+    
+    # send only the operations y has not acknowledged before
+    sequence = x.sequence
+    y.applyDelta(x.deltaFor('y'), peer='x')
+    x.ackDelta('y', sequence)
     """
     def __init__(self, addSet, removeSet):
         
@@ -52,10 +119,108 @@ class LWWElementSet:
         self.addSet = addSet
         self.removeSet = removeSet
         
+        # sorted add and remove timestamps of each element, so that contains
+        # does not have to scan the whole set and can answer "was x present
+        # at time t" with a bisect. addSet and removeSet should only be
+        # changed through the methods below, otherwise the timelines go out
+        # of date
+        self._addTimeline = {}
+        self._removeTimeline = {}
+        for (ops, timeline) in [(addSet, self._addTimeline), (removeSet, self._removeTimeline)]:
+            for (x, timestamp) in ops:
+                timeline.setdefault(x, []).append(timestamp)
+            for times in timeline.values():
+                times.sort()
+        
+        # the (x, timestamp) tuples of addSet and removeSet (once each, if
+        # the same one is in both) sorted by timestamp, so that the operations
+        # in a window of time can be found without a scan. It holds the
+        # tuples of the sets rather than making new ones
+        self._indexTimestamps()
+            
+        # log of operations in the order they became known to this replica,
+        # as (sequence, isAdd, x, timestamp, peer) where peer is the replica
+        # the operation was received from (None if it was made locally). The
+        # sequence number counts operations, and is used as a watermark for
+        # delta merges. It is stored in the entry rather than being the
+        # position in the log because compact can drop entries. The log is
+        # only built when it is first needed (see _buildLog), so sets which
+        # never sync, such as the results of merge, do not pay for it
+        self._log = None
+        self._nextSequence = 0
+        
+        # sequence number up to which each peer has acknowledged deltas
+        self._sentTo = {}
+        
+        # Merkle digest of the operations, built the first time it is asked
+        # for and then kept up to date
+        self._digest = None
+        
+        # lock held while an operation is recorded
+        self._lock = nullcontext()
+        
+    def _indexTimestamps(self):
+        """
+        build the timestamp index from the sets
+        """
+        self._byTimestamp = _TimestampIndex(sorted(self.addSet | self.removeSet, key=_timestampOf))
+        
+    @staticmethod
+    def _fromTimelines(addTimeline, removeTimeline):
+        """
+        return an LWWElementSet which takes over the given sorted timelines,
+        without sorting them again
+        """
+        s = LWWElementSet(set([]), set([]))
+        s.addSet = set([(x, timestamp) for (x, times) in addTimeline.items() for timestamp in times])
+        s.removeSet = set([(x, timestamp) for (x, times) in removeTimeline.items() for timestamp in times])
+        s._addTimeline = addTimeline
+        s._removeTimeline = removeTimeline
+        s._indexTimestamps()
+        return s
+        
+    def _record(self, isAdd, x, timestamp, peer=None):
+        """
+        record an add (isAdd True) or remove of x at timestamp in the sets,
+        timelines and log, unless it is already there
+        
+        return True if the operation was new
+        """
+        # the lock is a no-op unless the set is shared between threads (see
+        # ConcurrentLWWElementGraph), in which case it keeps the sequence
+        # numbers and log in order
+        with self._lock:
+            if isAdd:
+                ops, timeline = self.addSet, self._addTimeline
+            else:
+                ops, timeline = self.removeSet, self._removeTimeline
+            
+            op = (x, timestamp)
+            if op in ops:
+                return False
+            ops.add(op)
+            insort(timeline.setdefault(x, []), timestamp)
+            if op not in (self.removeSet if isAdd else self.addSet):
+                self._byTimestamp.insert(op)
+            if self._log is not None:
+                self._log.append((self._nextSequence, isAdd, x, timestamp, peer))
+                self._nextSequence += 1
+            if self._digest is not None:
+                self._digest.add(isAdd, x, timestamp)
+            return True
+        
     def __eq__(self, other):
         """
         test for equality (needed for later unit tests)
+        
+        if both objects have a digest and their roots are equal, the sets are
+        not compared. Different roots do not mean the sets differ, since
+        equal values can pickle differently (such as 1 and 1.0, or a datetime
+        and a pandas Timestamp)
         """
+        if self._digest is not None and getattr(other, '_digest', None) is not None:
+            if self.digest.root == other.digest.root:
+                return True
         return (self.addSet == other.addSet) and (self.removeSet == other.removeSet)
         
     def __repr__(self):
@@ -68,43 +233,155 @@ class LWWElementSet:
         """
         add element x at timestamp
         """
-        self.addSet.add((x, timestamp))
+        self._record(True, x, timestamp)
         
     def snapshot(self, timestamp):
         """
-        return the elements which have been added and removed up to timestamp
+        return the elements which have been added and removed up to timestamp,
+        as a read only LWWElementSetView of this object (see below)
         """
-        snapshot = LWWElementSet(set([]), set([]))
+        return LWWElementSetView(self, timestamp)
         
-        snapshot.addSet = set([a for a in self.addSet if a[1] <= timestamp])
-        snapshot.removeSet = set([a for a in self.removeSet if a[1] <= timestamp])
-        
-        return snapshot
+    def removedSince(self, x, timestamp):
+        """
+        check whether x has a remove at or after timestamp, which beats every
+        add that a remove at timestamp would beat
+        """
+        removes = self._removeTimeline.get(x)
+        return bool(removes) and removes[-1] >= timestamp
         
-    def contains(self, x):
+    def contains(self, x, timestamp=None):
         """
-        check whether the LWWElementSet contains an object x
+        check whether the LWWElementSet contains an object x, or contained it
+        at timestamp if one is given
+        """
+        return self._containsIn(self._addTimeline.get(x), self._removeTimeline.get(x), timestamp)
+    
+    @staticmethod
+    def _containsIn(adds, removes, timestamp):
         """
-        if x not in [a[0] for a in self.addSet]:
+        contains for the add and remove timelines of an element (or None)
+        """
+        if not adds:
             return False
-        else:
-            # x is in the addSet, check that it's not in the removeSet with
-            # a higher timestamp
-            add_ts = [a[1] for a in self.addSet if a[0] == x]
-            max_add_ts = np.array(add_ts).max()
-            rem_ts = [a[1] for a in self.removeSet if a[0] == x]
-            if len(rem_ts) == 0:
-                return True
-            else:
-                max_rem_ts = np.array(rem_ts).max()
-                if max_rem_ts > max_add_ts:
-                    # should this condition be > or >= ?
-                    # according to the spec, it should be >
-                    # note that according to this spec, if the same element is
-                    # simultaneously added and removed, it counts as *added*
-                    return False
+        i = len(adds) if timestamp is None else bisect_right(adds, timestamp)
+        if i == 0:
+            # x was not added until after timestamp
+            return False
+        
+        if not removes:
+            return True
+        j = len(removes) if timestamp is None else bisect_right(removes, timestamp)
+        if j == 0:
+            return True
+        # x has been added, check that it's not removed with a higher timestamp
+        # according to the spec, the condition should be > rather than >=
+        # note that according to this spec, if the same element is
+        # simultaneously added and removed, it counts as *added*
+        return not (removes[j - 1] > adds[i - 1])
+            
+    @property
+    def digest(self):
+        """
+        Merkle digest of the operations (see merkle.MerkleDigest), which is
+        built the first time it is asked for and kept up to date by every
+        later change
+        
+        replicas hold the same operations when their digest roots are equal,
+        and digest.diff(other.digest) gives the buckets where they differ
+        """
+        # built under the lock, so that no operation is recorded between
+        # reading the sets and installing the digest
+        with self._lock:
+            if self._digest is None:
+                digest = MerkleDigest()
+                for (x, timestamp) in self.addSet:
+                    digest.add(True, x, timestamp)
+                for (x, timestamp) in self.removeSet:
+                    digest.add(False, x, timestamp)
+                self._digest = digest
+            # the digest recomputes its hashes under the same lock as the
+            # writes which mark them as changed, and the lock may have been
+            # replaced since the digest was built (see ConcurrentLWWElementGraph)
+            self._digest._lock = self._lock
+            return self._digest
+    
+    def bucketDelta(self, buckets):
+        """
+        return an LWWElementSet holding the operations on the elements in the
+        given digest buckets (usually the result of digest.diff)
+        """
+        return self.elementsDelta(self.digest.elementsIn(buckets))
+    
+    def elementHashes(self, buckets):
+        """
+        return a dict from each element in the given digest buckets to the hash
+        of its operations, so that two replicas can find the elements they
+        disagree on in a bucket without sending the operations
+        """
+        digest = self.digest
+        return dict([(x, digest.hashOf([(True, x, timestamp) for timestamp in self._addTimeline.get(x, [])]
+                                       + [(False, x, timestamp) for timestamp in self._removeTimeline.get(x, [])]))
+                     for x in digest.elementsIn(buckets)])
+    
+    def elementsDelta(self, xs):
+        """
+        return an LWWElementSet holding the operations on the elements xs
+        """
+        delta = LWWElementSet(set([]), set([]))
+        for x in xs:
+            for timestamp in self._addTimeline.get(x, []):
+                delta._record(True, x, timestamp)
+            for timestamp in self._removeTimeline.get(x, []):
+                delta._record(False, x, timestamp)
+        return delta
+    
+    def intervals(self, x):
+        """
+        return the list of intervals in which x is present, as (start, end)
+        pairs meaning from start up to but not including end, in order, where
+        end is None if x is still present
+        """
+        # removes sort before adds at the same timestamp, since ties go to add
+        ops = sorted([(timestamp, False) for timestamp in self._removeTimeline.get(x, [])]
+                     + [(timestamp, True) for timestamp in self._addTimeline.get(x, [])])
+        out = []
+        start = None
+        for (timestamp, isAdd) in ops:
+            if isAdd and start is None:
+                if out and out[-1][1] == timestamp:
+                    # removed and added again at the same time, which is no gap
+                    start = out.pop()[0]
                 else:
-                    return True
+                    start = timestamp
+            elif not isAdd and start is not None:
+                out.append((start, timestamp))
+                start = None
+        if start is not None:
+            out.append((start, None))
+        return out
+    
+    def operationsBetween(self, t1, t2):
+        """
+        generator of (timestamp, x) for each element x with an operation at a
+        timestamp after t1 and up to t2, in timestamp order
+        
+        an element comes up once for every timestamp it has an operation at
+        """
+        # a copy of the window, since the caller may write to the set between
+        # items. The lock keeps a writer from splitting a block of the index
+        # while it is read
+        with self._lock:
+            window = self._byTimestamp.between(t1, t2)
+        for (x, timestamp) in window:
+            yield (timestamp, x)
+    
+    def elements(self):
+        """
+        return the elements which have ever been added (whether or not they
+        have been removed since)
+        """
+        return self._addTimeline.keys()
             
     def removeElement(self, x, timestamp):
         """
@@ -121,16 +398,304 @@ class LWWElementSet:
         # timestamp, you can still remove it
         
         # but I'm not sure whether this is the intended behaviour, because it means you could delete things from someone else's set, which would then disappear when their set is merged with yours
-        self.removeSet.add((x, timestamp))
+        self._record(False, x, timestamp)
         
     def merge(self, other):
         """
         merge two LWWElementSet objects by taking the union of addSets and
         removeSets
         """
-        merged = LWWElementSet(set([]), set([]))
-        merged.addSet = other.addSet.union(self.addSet)
-        merged.removeSet = other.removeSet.union(self.removeSet)
+        merged = LWWElementSet(other.addSet.union(self.addSet),
+                               other.removeSet.union(self.removeSet))
         return merged
     
-    # tests?
\ No newline at end of file
+    def _buildLog(self):
+        """
+        build the log if it has not been built yet, and return it
+        
+        the operations recorded before the log is built count as made
+        locally, in no particular order
+        """
+        with self._lock:
+            if self._log is None:
+                log = [(True, x, timestamp, None) for (x, timestamp) in self.addSet]
+                log += [(False, x, timestamp, None) for (x, timestamp) in self.removeSet]
+                self._log = [(sequence,) + op for (sequence, op) in enumerate(log)]
+                self._nextSequence = len(self._log)
+            return self._log
+    
+    @property
+    def sequence(self):
+        """
+        number of operations this replica knows about, to be used as a
+        watermark for deltaSince and ackDelta
+        """
+        with self._lock:
+            self._buildLog()
+            return self._nextSequence
+    
+    def _logSince(self, sequence):
+        """
+        return the log entries with sequence numbers at or after sequence
+        """
+        log = self._buildLog()
+        # sequence numbers are unique, so the entries sort by their first item
+        return log[bisect_left(log, (sequence,)):]
+    
+    def deltaSince(self, sequence):
+        """
+        return an LWWElementSet holding only the operations which became known
+        to this replica at or after sequence
+        
+        the delta is an ordinary LWWElementSet, so it can be passed to merge,
+        or to applyDelta on another replica
+        """
+        delta = LWWElementSet(set([]), set([]))
+        for (_, isAdd, x, timestamp, peer) in self._logSince(sequence):
+            delta._record(isAdd, x, timestamp)
+        return delta
+    
+    def deltaFor(self, peer):
+        """
+        return the operations which peer has not acknowledged yet (see
+        ackDelta)
+        
+        operations which were received from peer are left out, since peer
+        already has them. The same operations are sent again by every call
+        until they are acknowledged, so a delta which is lost on the way is
+        not lost for good
+        """
+        delta = LWWElementSet(set([]), set([]))
+        for (_, isAdd, x, timestamp, source) in self._logSince(self._sentTo.get(peer, 0)):
+            if source != peer:
+                delta._record(isAdd, x, timestamp)
+        return delta
+    
+    def ackDelta(self, peer, sequence):
+        """
+        record that peer has applied the operations before sequence, so that
+        deltaFor does not send them again
+        
+        sequence should be read before the delta is made, for example
+        
+        sequence = x.sequence
+        y.applyDelta(x.deltaFor('y'), peer='x')
+        x.ackDelta('y', sequence)
+        """
+        self._sentTo[peer] = max(self._sentTo.get(peer, 0), sequence)
+    
+    def applyDelta(self, delta, peer=None):
+        """
+        merge the operations in delta (an LWWElementSet, usually made by
+        deltaSince or deltaFor on another replica) into this object in place,
+        in time proportional to the size of delta
+        
+        peer is the replica the delta came from, if known, so that its
+        operations are not sent back to it by deltaFor
+        """
+        self.mergeInto(delta, peer)
+    
+    def mergeInto(self, other, peer=None):
+        """
+        merge another LWWElementSet object into this one in place, without
+        copying the sets of this object
+        """
+        if peer is not None:
+            # the log is needed to remember where the operations came from
+            self._buildLog()
+        for (x, timestamp) in other.addSet:
+            self._record(True, x, timestamp, peer)
+        for (x, timestamp) in other.removeSet:
+            self._record(False, x, timestamp, peer)
+    
+    def compact(self, horizon):
+        """
+        collapse the history of each element before horizon to the single
+        operation which decides whether it is present at horizon, and return
+        the number of operations dropped
+        
+        answers of contains at timestamps at or after horizon are unchanged,
+        but earlier answers are not kept. horizon should be a timestamp which
+        every replica has passed, so that no new operations before it will
+        arrive, and replicas should be compacted with the same horizon before
+        they are merged (otherwise the dropped operations come back with the
+        merge)
+        """
+        dropped = self._compactable(self._addTimeline, self._removeTimeline, horizon)
+        self._forget(dropped)
+        return len(dropped)
+    
+    @staticmethod
+    def _compactable(addTimeline, removeTimeline, horizon):
+        """
+        return the operations which compact(horizon) drops from the given
+        timelines as (isAdd, x, timestamp), without changing anything. The
+        operations of each element are a prefix of its timeline
+        """
+        dropped = []
+        for (isAdd, timeline) in [(True, addTimeline), (False, removeTimeline)]:
+            for (x, times) in timeline.items():
+                i = bisect_left(times, horizon)
+                if i == 0:
+                    continue
+                
+                if isAdd:
+                    # keep the last add before horizon if it is not beaten by a
+                    # remove before horizon. Later operations override it
+                    # whatever happened before, so nothing else matters
+                    removes = removeTimeline.get(x, [])
+                    j = bisect_left(removes, horizon)
+                    if not (j > 0 and removes[j - 1] > times[i - 1]):
+                        i -= 1
+                # every remove before horizon is either beaten by the add which
+                # is kept, or removes an element which has no add before
+                # horizon, so none of them matter after horizon
+                
+                dropped += [(isAdd, x, t) for t in times[:i]]
+        return dropped
+    
+    def _forget(self, dropped):
+        """
+        drop operations made by _compactable from the sets, timelines, index,
+        digest and log
+        """
+        # the dropped operations of each element are a prefix of its timeline
+        prefixes = {}
+        for (isAdd, x, timestamp) in dropped:
+            prefixes[(isAdd, x)] = prefixes.get((isAdd, x), 0) + 1
+        for ((isAdd, x), n) in prefixes.items():
+            timeline = self._addTimeline if isAdd else self._removeTimeline
+            if n == len(timeline[x]):
+                del timeline[x]
+            else:
+                timeline[x] = timeline[x][n:]
+        
+        for (isAdd, x, timestamp) in dropped:
+            if isAdd:
+                self.addSet.discard((x, timestamp))
+            else:
+                self.removeSet.discard((x, timestamp))
+            if self._digest is not None:
+                self._digest.remove(isAdd, x, timestamp)
+        
+        # the index is filtered once rather than searched for each operation
+        if dropped:
+            self._byTimestamp = _TimestampIndex([op for op in self._byTimestamp
+                                                 if op in self.addSet or op in self.removeSet])
+        
+        # forget the dropped operations in the log so that they are not sent
+        # in deltas
+        if self._log is not None:
+            self._log = [op for op in self._log
+                         if (op[2], op[3]) in (self.addSet if op[1] else self.removeSet)]
+    
+    @staticmethod
+    def mergeAll(replicas):
+        """
+        merge any number of LWWElementSet objects in one pass, allocating only
+        the result (rather than one intermediate object per merge as with
+        reduce and merge)
+        """
+        replicas = list(replicas)
+        return LWWElementSet(set([]).union(*[r.addSet for r in replicas]),
+                             set([]).union(*[r.removeSet for r in replicas]))
+
+@instrumented
+class LWWElementSetView:
+    """
+    read only view of an LWWElementSet as it was at a timestamp, made by
+    LWWElementSet.snapshot
+    
+    Nothing is copied. contains is answered by the timelines of the parent
+    set at the earlier of the view's timestamp and the one asked about, so
+    it costs the same as contains on the parent. The operations up to the
+    timestamp are only filtered out of the parent when they are iterated
+    over (or addSet and removeSet are asked for), and materialise makes an
+    LWWElementSet of them. Views of views are views of the same parent.
+    
+    Since the view is bound to its parent, operations recorded on the
+    parent later with timestamps up to the view's timestamp show up in it.
+    """
+    __slots__ = ('parent', 'timestamp')
+    
+    def __init__(self, parent, timestamp):
+        self.parent = parent
+        self.timestamp = timestamp
+    
+    def _before(self, timestamp):
+        """
+        the earlier of timestamp (if given) and the view's timestamp
+        """
+        if timestamp is None or self.timestamp < timestamp:
+            return self.timestamp
+        return timestamp
+    
+    def __eq__(self, other):
+        """
+        test for equality
+        """
+        return (self.addSet == other.addSet) and (self.removeSet == other.removeSet)
+    
+    def __repr__(self):
+        """
+        print the contents of the object, for debugging
+        """
+        return 'addSet:   ' + str(self.addSet) +'\nremoveSet:' + str(self.removeSet)
+    
+    def contains(self, x, timestamp=None):
+        """
+        check whether the view contains x, or contained it at timestamp if one
+        is given
+        """
+        return self.parent.contains(x, self._before(timestamp))
+    
+    def snapshot(self, timestamp):
+        """
+        return a view of the same parent at the earlier timestamp
+        """
+        return LWWElementSetView(self.parent, self._before(timestamp))
+    
+    def operations(self):
+        """
+        generator of (isAdd, x, timestamp) for the operations in the view
+        """
+        for (isAdd, timelines) in [(True, self.parent._addTimeline), (False, self.parent._removeTimeline)]:
+            for (x, times) in list(timelines.items()):
+                for timestamp in times[:bisect_right(times, self.timestamp)]:
+                    yield (isAdd, x, timestamp)
+    
+    def elements(self):
+        """
+        generator of the elements which have been added in the view (whether
+        or not they have been removed since)
+        """
+        for (x, times) in list(self.parent._addTimeline.items()):
+            if times and times[0] <= self.timestamp:
+                yield x
+    
+    @property
+    def addSet(self):
+        """
+        the set of (x, timestamp) pairs added in the view
+        """
+        return set([(x, timestamp) for (isAdd, x, timestamp) in self.operations() if isAdd])
+    
+    @property
+    def removeSet(self):
+        """
+        the set of (x, timestamp) pairs removed in the view
+        """
+        return set([(x, timestamp) for (isAdd, x, timestamp) in self.operations() if not isAdd])
+    
+    def materialise(self):
+        """
+        return a copy of the view as an LWWElementSet
+        """
+        return LWWElementSet(self.addSet, self.removeSet)
+    
+    def merge(self, other):
+        """
+        merge the view with another LWWElementSet (or view), returning a new
+        LWWElementSet
+        """
+        return self.materialise().merge(other)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 
+import random
 import unittest
 from lwwelementset import LWWElementSet
 
@@ -27,6 +28,29 @@ class testLWWElementSet(unittest.TestCase):
         self.assertEqual(u.snapshot(0).contains(1), True)        
         self.assertEqual(u.snapshot(0).contains(2), False)
         
+    def test_snapshotView(self):
+        u = LWWElementSet(set([(1, 0), (2, 2), (1, 3)]), set([(1, 1)]))
+        v = u.snapshot(2)
+        
+        # nothing is copied, and contains goes to the parent
+        self.assertIs(v.parent, u)
+        self.assertEqual([v.contains(x) for x in [1, 2, 3]], [False, True, False])
+        self.assertEqual(v.contains(2, 1), False)
+        self.assertEqual(v.contains(1, 5), False)
+        
+        # views of views, and views compare equal to the copies they stand for
+        self.assertEqual(v.snapshot(5).timestamp, 2)
+        self.assertEqual(v.snapshot(0).contains(1), True)
+        self.assertEqual(v, LWWElementSet(set([(1, 0), (2, 2)]), set([(1, 1)])))
+        self.assertEqual(sorted(v.elements()), [1, 2])
+        self.assertEqual(v.materialise().merge(u), u)
+        
+        # later operations before the view's timestamp show up in it
+        u.removeElement(2, 2)
+        u.addElement(3, 4)
+        self.assertEqual(v.contains(2), True)
+        self.assertEqual(sorted(v.operations()), [(False, 1, 1), (False, 2, 2), (True, 1, 0), (True, 2, 2)])
+        
     def test_removeElement(self):
         # create instance of LWWElementSet
         u = LWWElementSet(set([]), set([]))
@@ -44,4 +68,125 @@ class testLWWElementSet(unittest.TestCase):
         u.removeElement(1, -1)
         
         # check that 1 exists at the time when it was added
-        self.assertEqual(u.snapshot(0).contains(1), True)
\ No newline at end of file
+        self.assertEqual(u.snapshot(0).contains(1), True)
+        
+    def test_containsIndex(self):
+        # elements added and removed out of timestamp order
+        u = LWWElementSet(set([(1, 5), (2, 0)]), set([(2, 3)]))
+        u.addElement(1, 2)
+        u.removeElement(1, 4)
+        
+        # the add at 5 beats the remove at 4, 2 was removed after it was added
+        self.assertEqual(u.contains(1), True)
+        self.assertEqual(u.contains(2), False)
+        self.assertEqual(u.contains(3), False)
+        
+        # simultaneous add and remove counts as added
+        u.removeElement(1, 5)
+        self.assertEqual(u.contains(1), True)
+        
+        # the index of a merged object agrees with its sets
+        v = LWWElementSet(set([]), set([(1, 6)]))
+        self.assertEqual(u.merge(v).contains(1), False)
+        self.assertEqual(v.merge(u).contains(2), False)
+        
+    def test_containsAtTimestamp(self):
+        u = LWWElementSet(set([(1, 0), (1, 4)]), set([(1, 2)]))
+        
+        # element 1 is added at 0, removed at 2 and added again at 4
+        for t, expected in [(-1, False), (0, True), (1, True), (2, False),
+                            (3, False), (4, True), (5, True)]:
+            self.assertEqual(u.contains(1, t), expected)
+            # agrees with the snapshot
+            self.assertEqual(u.snapshot(t).contains(1), expected)
+        
+        # removing at the same timestamp as an add counts as added
+        u.removeElement(1, 0)
+        self.assertEqual(u.contains(1, 0), True)
+        
+    def test_delta(self):
+        u = LWWElementSet(set([(1, 0)]), set([]))
+        v = LWWElementSet(set([]), set([]))
+        
+        # first sync sends everything
+        sequence = u.sequence
+        v.applyDelta(u.deltaFor('v'), peer='u')
+        u.ackDelta('v', sequence)
+        self.assertEqual(u, v)
+        
+        # only the new operations are sent after that
+        u.addElement(2, 1)
+        u.removeElement(1, 2)
+        delta = u.deltaFor('v')
+        self.assertEqual(delta, LWWElementSet(set([(2, 1)]), set([(1, 2)])))
+        
+        # the delta is sent again until it is acknowledged, in case it was lost
+        sequence = u.sequence
+        self.assertEqual(u.deltaFor('v'), delta)
+        u.ackDelta('v', sequence)
+        self.assertEqual(u.deltaFor('v'), LWWElementSet(set([]), set([])))
+        
+        v.applyDelta(delta, peer='u')
+        self.assertEqual(u, v)
+        self.assertEqual(v.contains(1), False)
+        
+        # v does not send u's operations back to u
+        v.addElement(3, 3)
+        self.assertEqual(v.deltaFor('u'), LWWElementSet(set([(3, 3)]), set([])))
+        
+        # deltas can also be taken from an explicit watermark
+        sequence = u.sequence
+        u.addElement(4, 4)
+        self.assertEqual(u.deltaSince(sequence), LWWElementSet(set([(4, 4)]), set([])))
+        self.assertEqual(u.merge(u.deltaSince(0)), u)
+        
+        # sets which never sync do not build a log
+        self.assertEqual(u.merge(v)._log, None)
+        
+    def test_compact(self):
+        # 1 is added and removed repeatedly and ends up present
+        # 2 ends up removed, 3 is only ever removed, 4 changes after the horizon
+        u = LWWElementSet(set([(1, 0), (1, 2), (1, 4), (2, 0), (2, 1), (4, 0), (4, 6)]),
+                          set([(1, 1), (1, 3), (2, 2), (3, 0), (4, 5)]))
+        expected = dict([((x, t), u.contains(x, t)) for x in [1, 2, 3, 4] for t in range(5, 8)])
+        
+        self.assertEqual(u.compact(5), 8)
+        self.assertEqual(u, LWWElementSet(set([(1, 4), (4, 0), (4, 6)]), set([(4, 5)])))
+        
+        # answers at and after the horizon are unchanged
+        for ((x, t), answer) in expected.items():
+            self.assertEqual(u.contains(x, t), answer)
+        
+        # compacting again changes nothing, and the log no longer has the
+        # dropped operations
+        self.assertEqual(u.compact(5), 0)
+        self.assertEqual(u.deltaSince(0), u)
+        
+        # the timestamp index no longer has them either
+        self.assertEqual(sorted(u.operationsBetween(-1, 10)), [(0, 4), (4, 1), (5, 4), (6, 4)])
+        
+    def test_operationsBetween(self):
+        u = LWWElementSet(set([(1, 0), (2, 2), (1, 3)]), set([(1, 1), (3, 2)]))
+        u.addElement(4, 2)
+        u.removeElement(4, 2)
+        
+        self.assertEqual(list(u.operationsBetween(0, 1)), [(1, 1)])
+        self.assertEqual(sorted(u.operationsBetween(0, 3)), [(1, 1), (2, 2), (2, 3), (2, 4), (3, 1)])
+        self.assertEqual(list(u.operationsBetween(3, 10)), [])
+        
+        # writes at old timestamps, enough of them to split the index into
+        # blocks, come back in timestamp order (the order of writes at the
+        # same timestamp is not defined)
+        rng = random.Random(0)
+        v = LWWElementSet(set([]), set([]))
+        for i in range(5000):
+            v.addElement(i % 50, rng.randrange(1000))
+        operations = sorted((timestamp, x) for (x, timestamp) in v.addSet)
+        window = list(v.operationsBetween(-1, 1000))
+        self.assertEqual(sorted(window), operations)
+        self.assertEqual([timestamp for (timestamp, x) in window], [timestamp for (timestamp, x) in operations])
+        self.assertEqual(sorted(v.operationsBetween(99, 500)),
+                         [(timestamp, x) for (timestamp, x) in operations if 99 < timestamp <= 500])
+        v.compact(500)
+        self.assertEqual(sorted(v.operationsBetween(-1, 1000)),
+                         sorted((timestamp, x) for (x, timestamp) in v.addSet))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Merkle digest of the operations in an LWWElementSet
+
+Elements are hash partitioned into 2**depth buckets, so every operation on
+an element lands in the same bucket. Each bucket keeps the sum of the hashes
+of its operations, which can be updated when an operation is added or
+dropped without looking at the others, and the buckets are the leaves of a
+binary hash tree. Two replicas hold the same operations exactly when (up to
+hash collisions) their roots are equal, and the buckets where they differ
+are found by walking down only the subtrees whose hashes differ.
+
+The hashes are computed from pickles rather than with the built in hash
+(which changes between processes for strings), so that digests can be
+compared between processes.
+"""
+
+import hashlib
+import pickle
+from contextlib import nullcontext
+
+# leaves hold sums of 128 bit operation hashes
+_MODULUS = 1 << 128
+
+def _blake(data, size=16):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=size).digest(), 'little')
+
+def stableHash(obj):
+    """
+    64 bit hash of obj which is the same in every process
+
+    sets and frozensets (such as edges) hash the same whatever order their
+    members come in
+    """
+    if isinstance(obj, (set, frozenset)):
+        total = sum([stableHash(member) for member in obj]) % (1 << 64)
+        return _blake(b'S' + total.to_bytes(8, 'little'), 8)
+    if isinstance(obj, tuple):
+        return _blake(b'T' + b''.join([stableHash(member).to_bytes(8, 'little') for member in obj]), 8)
+    return _blake(b'P' + pickle.dumps(obj, protocol=4), 8)
+
+class MerkleDigest:
+    """
+    Merkle digest of a set of (isAdd, x, timestamp) operations
+
+    the tree is stored as a list in heap order (node i has children 2i and
+    2i + 1, the root is node 1 and the leaves are nodes 2**depth onwards),
+    and hashes are only recomputed along the paths of buckets which have
+    changed, when the root or a node is asked for
+    """
+    def __init__(self, depth=10):
+        self.depth = depth
+        self._leaves = 1 << depth
+        self._sums = [0] * self._leaves
+        self._nodes = [None] * (2 * self._leaves)
+        self._dirty = set(range(self._leaves))
+
+        # elements in each bucket, with the number of operations on each, so
+        # that the operations in a bucket can be found without a scan
+        self._elements = {}
+
+        # lock held while the hashes are recomputed, which is the lock of the
+        # LWWElementSet the digest belongs to, so that a bucket is not marked
+        # as changed half way through
+        self._lock = nullcontext()
+
+    def bucket(self, x):
+        """
+        return the bucket of element x
+        """
+        return stableHash(x) % self._leaves
+
+    @staticmethod
+    def _operationHash(isAdd, x, timestamp):
+        return _blake((b'A' if isAdd else b'R') + stableHash(x).to_bytes(8, 'little')
+                      + stableHash(timestamp).to_bytes(8, 'little'))
+
+    def add(self, isAdd, x, timestamp):
+        """
+        account for a new operation
+        """
+        b = self.bucket(x)
+        self._sums[b] = (self._sums[b] + self._operationHash(isAdd, x, timestamp)) % _MODULUS
+        self._dirty.add(b)
+        counts = self._elements.setdefault(b, {})
+        counts[x] = counts.get(x, 0) + 1
+
+    def hashOf(self, operations):
+        """
+        hash of an iterable of (isAdd, x, timestamp) operations, which is the
+        same whatever order they come in, such as the operations on one
+        element
+        """
+        return sum([self._operationHash(isAdd, x, timestamp) for (isAdd, x, timestamp) in operations]) % _MODULUS
+
+    def remove(self, isAdd, x, timestamp):
+        """
+        account for an operation which has been dropped
+        """
+        b = self.bucket(x)
+        self._sums[b] = (self._sums[b] - self._operationHash(isAdd, x, timestamp)) % _MODULUS
+        self._dirty.add(b)
+        counts = self._elements[b]
+        counts[x] -= 1
+        if counts[x] == 0:
+            del counts[x]
+
+    def _update(self):
+        """
+        recompute the hashes on the paths from the changed buckets to the root
+        """
+        if not self._dirty:
+            return
+        with self._lock:
+            level = set([])
+            for b in self._dirty:
+                i = self._leaves + b
+                self._nodes[i] = _blake(b'L' + self._sums[b].to_bytes(16, 'little'))
+                level.add(i // 2)
+            while level:
+                parents = set([])
+                for i in level:
+                    self._nodes[i] = _blake(b'N' + self._nodes[2 * i].to_bytes(16, 'little')
+                                            + self._nodes[2 * i + 1].to_bytes(16, 'little'))
+                    if i > 1:
+                        parents.add(i // 2)
+                level = parents
+            # cleared last, so that a reader which finds nothing to do does
+            # not read nodes which are still being recomputed
+            self._dirty = set([])
+
+    @property
+    def root(self):
+        """
+        hash of the whole digest
+        """
+        return self.node(1)
+
+    def node(self, i):
+        """
+        hash of node i of the tree
+        """
+        self._update()
+        return self._nodes[i]
+
+    def nodes(self):
+        """
+        return the list of all node hashes, to be sent to another process
+        which can wrap it in a RemoteDigest
+        """
+        self._update()
+        return list(self._nodes)
+
+    def diff(self, other):
+        """
+        return the sorted list of buckets whose operations differ between this
+        digest and other (a MerkleDigest of the same depth, or anything with
+        the same depth attribute and node method, such as a remote digest)
+
+        only subtrees whose hashes differ are visited, so this takes
+        O(differences * depth) node comparisons
+        """
+        if other.depth != self.depth:
+            raise ValueError('Cannot compare digests of different depths.')
+        out = []
+        stack = [1]
+        while stack:
+            i = stack.pop()
+            if self.node(i) == other.node(i):
+                continue
+            if i >= self._leaves:
+                out.append(i - self._leaves)
+            else:
+                stack += [2 * i, 2 * i + 1]
+        return sorted(out)
+
+    def elementsIn(self, buckets):
+        """
+        return the set of elements in the given buckets
+        """
+        out = set([])
+        for b in buckets:
+            out.update(self._elements.get(b, {}))
+        return out
+
+class RemoteDigest:
+    """
+    read only copy of the nodes of another replica's MerkleDigest, which can
+    be passed to MerkleDigest.diff
+    """
+    def __init__(self, depth, nodes):
+        self.depth = depth
+        self._nodes = nodes
+
+    def node(self, i):
+        return self._nodes[i]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from lwwelementset import LWWElementSet
+from merkle import MerkleDigest, stableHash
+
+class testMerkleDigest(unittest.TestCase):
+    
+    def test_stableHash(self):
+        # edges hash the same whichever way round they are built
+        self.assertEqual(stableHash(frozenset(['a', 'b'])), stableHash(frozenset(['b', 'a'])))
+        self.assertNotEqual(stableHash(('a', 'b')), stableHash(('b', 'a')))
+        
+    def test_digest(self):
+        u = LWWElementSet(set([(i, 0) for i in range(100)]), set([]))
+        v = LWWElementSet(set([(i, 0) for i in range(100)]), set([]))
+        
+        self.assertEqual(u.digest.root, v.digest.root)
+        self.assertEqual(u.digest.diff(v.digest), [])
+        
+        # digests are kept up to date by adds and removes
+        u.removeElement(7, 1)
+        v.addElement(150, 1)
+        self.assertNotEqual(u.digest.root, v.digest.root)
+        self.assertNotEqual(u, v)
+        
+        buckets = u.digest.diff(v.digest)
+        self.assertEqual(buckets, sorted(set([u.digest.bucket(7), u.digest.bucket(150)])))
+        
+        # within the buckets, only the elements which were written to hash
+        # differently
+        (hashesU, hashesV) = (u.elementHashes(buckets), v.elementHashes(buckets))
+        self.assertEqual(set([x for x in set(hashesU) | set(hashesV) if hashesU.get(x) != hashesV.get(x)]), set([7, 150]))
+        
+        # exchanging the differing buckets makes the replicas equal
+        fromU = u.bucketDelta(buckets)
+        fromV = v.bucketDelta(buckets)
+        self.assertEqual(len(fromU.addSet) + len(fromU.removeSet) < 20, True)
+        u.mergeInto(fromV)
+        v.mergeInto(fromU)
+        self.assertEqual(u.digest.root, v.digest.root)
+        self.assertEqual(u.addSet, v.addSet)
+        self.assertEqual(u.removeSet, v.removeSet)
+        
+    def test_equalValues(self):
+        u = LWWElementSet(set([(1, 0)]), set([]))
+        v = LWWElementSet(set([(1.0, 0)]), set([]))
+        self.assertEqual(u, v)
+        
+        # 1 and 1.0 pickle differently, so the roots differ but the sets do not
+        self.assertNotEqual(u.digest.root, v.digest.root)
+        self.assertEqual(u, v)
+        
+    def test_compact(self):
+        u = LWWElementSet(set([(1, 0), (1, 2)]), set([(1, 1)]))
+        u.digest
+        u.compact(3)
+        
+        # the digest of the compacted set matches one built from scratch
+        self.assertEqual(u.digest.root, LWWElementSet(set([(1, 2)]), set([])).digest.root)
+        
+    def test_depth(self):
+        self.assertRaises(ValueError, MerkleDigest(4).diff, MerkleDigest(5))
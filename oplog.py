@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only operation log for LWWElementGraph
+
+An OperationLog is given to an LWWElementGraph as its journal, and records
+every change made through the methods of the graph (the name of the method
+and its arguments). Records are buffered and written in batches, and the
+file is optionally fsynced after each batch. After a restart, replay reads
+the log back in chunks and applies it to a graph, so the state can be
+rebuilt without holding the whole log in memory. replay returns the offset
+it got to, so a graph can later be caught up from there.
+
+Each record is a header (length and CRC32 of the data) followed by the
+pickled (method, args) pair. A record which was only partly written when
+the process died (or the zeros a file system can leave at the end of a file
+after a crash) is ignored by replay, and cut off when the log is opened
+again for writing.
+
+Examples:
+---------
+log = OperationLog('graph.oplog')
+g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])),
+                    journal=log)
+g.addVertex('Paris', now())
+log.close()
+
+# after a restart
+g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+offset = replay(g, 'graph.oplog')
+
+# later, apply whatever has been written since
+offset = replay(g, 'graph.oplog', start=offset)
+"""
+
+import os
+import pickle
+import struct
+import zlib
+
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+
+# length and CRC32 of the pickled record which follows
+RECORD_HEADER = struct.Struct('<II')
+
+def _frames(f):
+    """
+    generator of the pickled data of the records in the open log f from its
+    current position, stopping at the first record which is incomplete,
+    empty or fails its CRC check
+    """
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        length, crc = RECORD_HEADER.unpack(header)
+        if length == 0:
+            # nothing pickles to no data, so this is a zero filled tail
+            # (whose CRC would match, since the CRC of no data is 0)
+            return
+        data = f.read(length)
+        if len(data) < length or zlib.crc32(data) != crc:
+            return
+        yield data
+
+def _validLength(path):
+    """
+    return the length of the part of the log at path which is made of whole
+    records which pass their CRC check
+    """
+    offset = 0
+    with open(path, 'rb') as f:
+        for data in _frames(f):
+            offset += RECORD_HEADER.size + len(data)
+    return offset
+
+class OperationLog:
+    """
+    append-only log of the changes made to an LWWElementGraph
+
+    records are written to the file when batchSize of them have been
+    buffered, or when flush or close is called. If fsync is True the file is
+    also fsynced after each write, so that a batch which has been written
+    survives a crash of the machine as well as of the process
+    """
+    def __init__(self, path, batchSize=1000, fsync=True):
+        self.path = path
+        self.batchSize = batchSize
+        self.fsync = fsync
+
+        # cut off whatever follows the last whole record, such as a record
+        # which was only partly written before a crash
+        if os.path.exists(path):
+            valid = _validLength(path)
+            if valid < os.path.getsize(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(valid)
+
+        self._file = open(path, 'ab')
+        self._buffer = []
+
+    def append(self, method, args):
+        """
+        add a record to the log (called by LWWElementGraph)
+        """
+        data = pickle.dumps((method, args))
+        self._buffer.append(RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data)
+        if len(self._buffer) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        """
+        write the buffered records to the file
+        """
+        if not self._buffer:
+            return
+        self._file.write(b''.join(self._buffer))
+        self._buffer = []
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        write the buffered records and close the file
+        """
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def readOperations(path, start=0, chunkSize=10000):
+    """
+    generator of the records in the log at path from offset start, in lists
+    of at most chunkSize (method, args) pairs
+
+    each chunk is yielded as (offset, records) where offset is the position
+    just after the last record in the chunk. Reading stops at the first
+    record which is incomplete, empty, fails its CRC check or cannot be
+    unpickled
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        records = []
+        for data in _frames(f):
+            try:
+                records.append(pickle.loads(data))
+            except Exception:
+                break
+            offset += RECORD_HEADER.size + len(data)
+            if len(records) >= chunkSize:
+                yield (offset, records)
+                records = []
+        if records:
+            yield (offset, records)
+
+def apply(graph, method, args):
+    """
+    apply one record of the log to graph
+    """
+    if method == 'mergeInto':
+        # merges are journaled as the four sets of the other graph
+        (vertexAdds, vertexRemoves, edgeAdds, edgeRemoves) = args
+        graph.mergeInto(LWWElementGraph(LWWElementSet(vertexAdds, vertexRemoves),
+                                        LWWElementSet(edgeAdds, edgeRemoves)))
+    else:
+        getattr(graph, method)(*args)
+
+def replay(graph, path, start=0, chunkSize=10000):
+    """
+    apply the records in the log at path from offset start to graph, one
+    chunk at a time, and return the offset reached (to be used as start for
+    the next replay)
+
+    the records are not journaled again while they are replayed
+    """
+    journal = graph.journal
+    graph.journal = None
+    offset = start
+    try:
+        for (offset, records) in readOperations(path, start, chunkSize):
+            for (method, args) in records:
+                apply(graph, method, args)
+    finally:
+        graph.journal = journal
+    return offset
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+from oplog import OperationLog, RECORD_HEADER, readOperations, replay
+
+def emptyGraph(journal=None):
+    return LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])),
+                           journal=journal)
+
+class testOperationLog(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'graph.oplog')
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def test_replay(self):
+        log = OperationLog(self.path, batchSize=3, fsync=False)
+        g = emptyGraph(log)
+        
+        g.addVertices(['a', 'b', 'c'], 0)
+        g.addEdgeBetween('a', 'b', 1)
+        g.addEdges([('b', 'c')], 1)
+        g.removeVertex('b', 2)
+        g.addVertex('b', 3)
+        
+        other = emptyGraph()
+        other.addVertex('d', 4)
+        g.mergeInto(other)
+        log.close()
+        
+        # rebuild the graph in small chunks
+        h = emptyGraph()
+        offset = replay(h, self.path, chunkSize=2)
+        self.assertEqual(h, g)
+        self.assertEqual(h.findAllVerticesConnectedTo('b', 3), set([]))
+        self.assertEqual(offset, os.path.getsize(self.path))
+        
+        # catch up with what has been written since
+        log = OperationLog(self.path, fsync=False)
+        g.journal = log
+        g.removeEdgeBetween('a', 'b', 5)
+        log.close()
+        
+        offset = replay(h, self.path, start=offset)
+        self.assertEqual(h, g)
+        self.assertEqual(offset, os.path.getsize(self.path))
+        
+    def test_tornRecord(self):
+        log = OperationLog(self.path, fsync=False)
+        g = emptyGraph(log)
+        g.addVertex('a', 0)
+        g.addVertex('b', 0)
+        log.close()
+        
+        # the last record was only partly written
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+        
+        self.assertEqual([len(records) for (_, records) in readOperations(self.path)], [1])
+        
+        # the partial record is cut off before new records are appended
+        log = OperationLog(self.path, fsync=False)
+        log.append('addVertex', ('c', 1))
+        log.close()
+        
+        h = emptyGraph()
+        replay(h, self.path)
+        self.assertEqual(h.vertices.addSet, set([('a', 0), ('c', 1)]))
+        
+    def test_zeroFilledTail(self):
+        log = OperationLog(self.path, fsync=False)
+        g = emptyGraph(log)
+        g.addVertex('a', 0)
+        log.close()
+        size = os.path.getsize(self.path)
+        
+        # a crash can leave zeros at the end of the file, which look like
+        # records of length 0 with a matching CRC
+        with open(self.path, 'ab') as f:
+            f.write(b'\0' * 16)
+        
+        h = emptyGraph()
+        self.assertEqual(replay(h, self.path), size)
+        self.assertEqual(h, g)
+        
+        # and they are cut off when the log is opened again
+        OperationLog(self.path, fsync=False).close()
+        self.assertEqual(os.path.getsize(self.path), size)
+        
+        # a record which passes its CRC check but does not unpickle stops
+        # the replay too
+        with open(self.path, 'ab') as f:
+            f.write(RECORD_HEADER.pack(3, zlib.crc32(b'bad')) + b'bad')
+        self.assertEqual(replay(emptyGraph(), self.path), size)
@@ -0,0 +1,571 @@
+# -*- coding: utf-8 -*-
+"""
+Binary file format for LWWElementSet and LWWElementGraph replicas
+
+A file holds an element table, where each distinct element (or vertex) is
+pickled once and given an integer id, and fixed width operation records
+(key, timestamp, isAdd). For an LWWElementSet the key is the id of the
+element. For an LWWElementGraph there are two record sections, one for the
+vertices keyed by vertex id, and one for the edges keyed by the ids of both
+endpoints packed into one integer, so edges are not pickled at all.
+
+Records are sorted by key, then timestamp, then isAdd (remove before add),
+so a file can be memory mapped with openMapped and queried with a binary
+search, without turning the operations into Python objects first. Writers
+sort each chunk of records as it is written and merge the sorted runs when
+they close, so memory use stays bounded by the chunk size.
+
+Layout (little endian):
+
+    header        see HEADER below
+    records       one section per record stream
+    element table offsets of the pickled elements (uint64, one more than
+                  the number of elements), hashes of the pickled elements in
+                  sorted order (uint64), ids in the same order (int64), then
+                  the pickled elements
+
+Elements are looked up by the hash of their pickle, so they should pickle
+the same way every time (strings, numbers and tuples of them do).
+
+Examples:
+---------
+save(g, 'replica.lww')
+
+# load everything back into an LWWElementGraph
+g = load('replica.lww')
+
+# or query the file directly
+m = openMapped('replica.lww')
+m.hasEdgeBetween('Paris', 'Bonn', now())
+
+# write a huge set without holding it in memory
+with LWWElementSetWriter('huge.lww') as w:
+    for (x, timestamp) in source:
+        w.addElement(x, timestamp)
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import struct
+import tempfile
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+from columnarlwwelementset import ColumnarLWWElementSet
+
+MAGIC = b'LWWF'
+VERSION = 1
+
+KIND_SET = 0
+KIND_GRAPH = 1
+
+# magic, version, kind, flags, timestamp dtype, number of elements, offset of
+# the element table, then (number of records, offset) of the vertex or set
+# records and of the edge records
+HEADER = struct.Struct('<4sHHH16sQQQQQQ')
+
+FLAG_SORTED = 1
+
+def _recordDtype(timestampDtype):
+    """
+    dtype of the fixed width operation records
+    """
+    return np.dtype([('key', '<i8'), ('timestamp', timestampDtype), ('isAdd', 'u1')])
+
+def _sortRecords(records):
+    """
+    return records sorted by key, then timestamp, then isAdd
+    """
+    return records[np.lexsort((records['isAdd'], records['timestamp'], records['key']))]
+
+def _mergeRuns(runs, f, blockSize):
+    """
+    merge sorted arrays of records (usually slices of a memory mapped file)
+    and write the result to f, holding at most blockSize records of each run
+    in memory at a time
+    """
+    # the block of each run in memory, and where the next block starts
+    blocks = [np.array(run[:blockSize]) for run in runs]
+    loaded = [len(block) for block in blocks]
+    while any([len(block) for block in blocks]):
+        # records up to the smallest last record of a block come before every
+        # record which is not in memory yet, so they can be written
+        ends = [block[-1:] for (run, block, n) in zip(runs, blocks, loaded)
+                if len(block) and n < len(run)]
+        if ends:
+            end = _sortRecords(np.concatenate(ends))[:1]
+            cuts = [int(np.searchsorted(block, end, side='right')[0]) for block in blocks]
+        else:
+            # every run is in memory
+            cuts = [len(block) for block in blocks]
+        _sortRecords(np.concatenate([block[:cut] for (block, cut) in zip(blocks, cuts)])).tofile(f)
+
+        for (i, run) in enumerate(runs):
+            block = blocks[i][cuts[i]:]
+            if len(block) == 0 and loaded[i] < len(run):
+                block = np.array(run[loaded[i]:loaded[i] + blockSize])
+                loaded[i] += len(block)
+            blocks[i] = block
+
+def _blockSize(chunkSize, count):
+    """
+    number of records to hold of each run of chunkSize records when count
+    records are merged, so that about chunkSize are held in all
+    """
+    runs = -(-count // chunkSize)
+    return max(1, chunkSize // max(runs, 1))
+
+def _sortedCopy(records, chunkSize):
+    """
+    sort records (usually memory mapped) into an unnamed temporary file,
+    chunkSize records at a time, and return the result memory mapped
+    """
+    runsFile = tempfile.TemporaryFile()
+    for start in range(0, len(records), chunkSize):
+        _sortRecords(np.array(records[start:start + chunkSize])).tofile(runsFile)
+    runsFile.flush()
+    runs = np.memmap(runsFile, dtype=records.dtype, mode='r', shape=(len(records),))
+
+    out = tempfile.TemporaryFile()
+    _mergeRuns([runs[start:start + chunkSize] for start in range(0, len(records), chunkSize)],
+               out, _blockSize(chunkSize, len(records)))
+    out.flush()
+    return np.memmap(out, dtype=records.dtype, mode='r', shape=(len(records),))
+
+def _hashElement(data):
+    """
+    stable 64 bit hash of a pickled element (the built in hash of strings
+    changes between processes)
+    """
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+def _edgeKey(ids):
+    """
+    pack the ids of the endpoints of an edge into one integer (so there can
+    be at most 2**31 distinct elements in a graph file)
+    """
+    ids = sorted(ids)
+    return (ids[0] << 32) | ids[-1]
+
+def _edgeEndpoints(key):
+    """
+    inverse of _edgeKey
+    """
+    return (key >> 32, key & 0xffffffff)
+
+class _RecordStream:
+    """
+    buffer of operation records which is written to a file in chunks
+    
+    the timestamp dtype is shared with the other streams of the writer, and
+    is taken from the first chunk written. If the writer sorts, each chunk
+    is sorted before it is written, and runs holds the number of records in
+    each of them
+    """
+    def __init__(self, path, chunkSize, writer):
+        self.path = path
+        self.chunkSize = chunkSize
+        self.writer = writer
+        self.count = 0
+        self.runs = []
+        self._file = open(path, 'wb')
+        self._buffer = []
+
+    def append(self, key, timestamp, isAdd):
+        self._buffer.append((key, timestamp, isAdd))
+        if len(self._buffer) >= self.chunkSize:
+            self.flush()
+
+    def flush(self):
+        """
+        write the buffered records
+        """
+        if not self._buffer:
+            return
+        keys, timestamps, isAdd = zip(*self._buffer)
+        self._buffer = []
+        timestamps = ColumnarLWWElementSet._timestampColumn(timestamps)
+        if self.writer._timestampDtype is None:
+            self.writer._timestampDtype = timestamps.dtype
+        timestampDtype = self.writer._timestampDtype
+        records = np.zeros(len(keys), dtype=_recordDtype(timestampDtype))
+        records['key'] = keys
+        # raises TypeError if the timestamps do not fit the dtype of the first chunk
+        records['timestamp'] = timestamps.astype(timestampDtype, casting='same_kind')
+        records['isAdd'] = isAdd
+        if self.writer.sort:
+            records = _sortRecords(records)
+        records.tofile(self._file)
+        self.count += len(keys)
+        self.runs.append(len(keys))
+
+    def close(self):
+        self._file.close()
+
+class _Writer:
+    """
+    streaming writer shared by LWWElementSetWriter and LWWElementGraphWriter
+
+    operations are buffered and written to a temporary file per record
+    stream in chunks of chunkSize, so memory use is bounded by the chunk size
+    and the number of distinct elements. close puts the file together,
+    merging the sorted chunks if the file is sorted
+    """
+    def __init__(self, path, kind, streams, chunkSize, sort):
+        self.path = path
+        self.kind = kind
+        self.sort = sort
+        self._ids = {}
+        self._elements = []
+        self._timestampDtype = None
+        self._streams = [_RecordStream(path + '.' + name, chunkSize, self)
+                         for name in streams]
+        self._closed = False
+
+    def _intern(self, x):
+        i = self._ids.get(x)
+        if i is None:
+            i = len(self._elements)
+            self._ids[x] = i
+            self._elements.append(pickle.dumps(x))
+        return i
+
+    def close(self):
+        """
+        finish writing the file
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for stream in self._streams:
+            stream.flush()
+            stream.close()
+        timestampDtype = self._timestampDtype
+        if timestampDtype is None:
+            timestampDtype = np.dtype('<i8')
+        timestampDtype = np.dtype(timestampDtype)
+
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * HEADER.size)
+
+            sections = []
+            for stream in self._streams:
+                sections.append((stream.count, f.tell()))
+                if self.sort and len(stream.runs) > 1:
+                    records = np.memmap(stream.path, dtype=_recordDtype(timestampDtype),
+                                        mode='r', shape=(stream.count,))
+                    bounds = np.cumsum([0] + stream.runs)
+                    _mergeRuns([records[a:b] for (a, b) in zip(bounds[:-1], bounds[1:])], f,
+                               _blockSize(stream.chunkSize, stream.count))
+                    del records
+                else:
+                    with open(stream.path, 'rb') as records:
+                        shutil.copyfileobj(records, f)
+                os.remove(stream.path)
+            while len(sections) < 2:
+                sections.append((0, f.tell()))
+
+            # element table
+            elementsOffset = f.tell()
+            offsets = np.zeros(len(self._elements) + 1, dtype='<u8')
+            offsets[1:] = np.cumsum([len(data) for data in self._elements])
+            hashes = np.array([_hashElement(data) for data in self._elements], dtype='<u8')
+            byHash = np.argsort(hashes, kind='stable').astype('<i8')
+            offsets.tofile(f)
+            hashes[byHash].tofile(f)
+            byHash.tofile(f)
+            for data in self._elements:
+                f.write(data)
+
+            flags = FLAG_SORTED if self.sort else 0
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, self.kind, flags,
+                                timestampDtype.str.encode('ascii'),
+                                len(self._elements), elementsOffset,
+                                sections[0][0], sections[0][1],
+                                sections[1][0], sections[1][1]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class LWWElementSetWriter(_Writer):
+    """
+    write the operations of an LWWElementSet to a file one at a time
+    """
+    def __init__(self, path, chunkSize=100000, sort=True):
+        _Writer.__init__(self, path, KIND_SET, ['records'], chunkSize, sort)
+
+    def addElement(self, x, timestamp):
+        self._streams[0].append(self._intern(x), timestamp, True)
+
+    def removeElement(self, x, timestamp):
+        self._streams[0].append(self._intern(x), timestamp, False)
+
+class LWWElementGraphWriter(_Writer):
+    """
+    write the operations of an LWWElementGraph to a file one at a time
+    """
+    def __init__(self, path, chunkSize=100000, sort=True):
+        _Writer.__init__(self, path, KIND_GRAPH, ['vertices', 'edges'], chunkSize, sort)
+
+    def addVertex(self, x, timestamp):
+        self._streams[0].append(self._intern(x), timestamp, True)
+
+    def removeVertex(self, x, timestamp):
+        self._streams[0].append(self._intern(x), timestamp, False)
+
+    def addEdge(self, e, timestamp):
+        self._streams[1].append(_edgeKey([self._intern(v) for v in e]), timestamp, True)
+
+    def removeEdge(self, e, timestamp):
+        self._streams[1].append(_edgeKey([self._intern(v) for v in e]), timestamp, False)
+
+def save(obj, path, chunkSize=100000):
+    """
+    write an LWWElementSet or LWWElementGraph to path
+    """
+    if isinstance(obj, LWWElementSet):
+        with LWWElementSetWriter(path, chunkSize) as w:
+            for (x, timestamp) in obj.addSet:
+                w.addElement(x, timestamp)
+            for (x, timestamp) in obj.removeSet:
+                w.removeElement(x, timestamp)
+    elif isinstance(obj, LWWElementGraph):
+        with LWWElementGraphWriter(path, chunkSize) as w:
+            for (x, timestamp) in obj.vertices.addSet:
+                w.addVertex(x, timestamp)
+            for (x, timestamp) in obj.vertices.removeSet:
+                w.removeVertex(x, timestamp)
+            for (e, timestamp) in obj.edges.addSet:
+                w.addEdge(e, timestamp)
+            for (e, timestamp) in obj.edges.removeSet:
+                w.removeEdge(e, timestamp)
+    else:
+        raise TypeError
+
+def openMapped(path, chunkSize=100000):
+    """
+    memory map the file at path, returning a MappedLWWElementSet or a
+    MappedLWWElementGraph
+
+    the records of files written without sorting are sorted into a
+    temporary file first, chunkSize records at a time
+    """
+    with open(path, 'rb') as f:
+        header = HEADER.unpack(f.read(HEADER.size))
+    if header[0] != MAGIC:
+        raise ValueError('Not an LWW replica file.')
+    if header[1] != VERSION:
+        raise ValueError('Unsupported LWW replica file version ' + str(header[1]) + '.')
+    if header[2] == KIND_SET:
+        return MappedLWWElementSet(path, header, chunkSize)
+    return MappedLWWElementGraph(path, header, chunkSize)
+
+def load(path):
+    """
+    read the file at path back into an LWWElementSet or LWWElementGraph
+    """
+    mapped = openMapped(path)
+    if isinstance(mapped, MappedLWWElementSet):
+        return mapped.toLWWElementSet()
+    return mapped.toLWWElementGraph()
+
+class _MappedFile:
+    """
+    memory mapped element table and record sections of a file
+    """
+    def __init__(self, path, header, chunkSize):
+        (_, _, self.kind, flags, timestampDtype, elementCount, elementsOffset,
+         count0, offset0, count1, offset1) = header
+        self.timestampDtype = np.dtype(timestampDtype.rstrip(b'\0').decode('ascii'))
+        recordDtype = _recordDtype(self.timestampDtype)
+
+        data = np.memmap(path, dtype='u1', mode='r')
+        n = elementCount
+        table = data[elementsOffset:]
+        self._offsets = table[:8 * (n + 1)].view('<u8')
+        self._hashes = table[8 * (n + 1):8 * (2 * n + 1)].view('<u8')
+        self._byHash = table[8 * (2 * n + 1):8 * (3 * n + 1)].view('<i8')
+        self._elementData = table[8 * (3 * n + 1):]
+        self._elementCache = {}
+
+        self.sections = []
+        for (count, offset) in [(count0, offset0), (count1, offset1)]:
+            records = data[offset:offset + count * recordDtype.itemsize].view(recordDtype)
+            if not (flags & FLAG_SORTED) and count > 0:
+                records = _sortedCopy(records, chunkSize)
+            self.sections.append(records)
+
+    def element(self, i):
+        """
+        unpickle the element with id i
+        """
+        if i not in self._elementCache:
+            start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+            self._elementCache[i] = pickle.loads(self._elementData[start:end].tobytes())
+        return self._elementCache[i]
+
+    def elementId(self, x):
+        """
+        return the id of element x, or None if it is not in the file
+        """
+        data = pickle.dumps(x)
+        h = _hashElement(data)
+        j = bisect_left(self._hashes, h)
+        while j < len(self._hashes) and self._hashes[j] == h:
+            i = int(self._byHash[j])
+            if self.element(i) == x:
+                return i
+            j += 1
+        return None
+
+    def timestamp(self, timestamp):
+        """
+        timestamp in a form which compares with the timestamp column without
+        rounding
+        """
+        return ColumnarLWWElementSet._queryTimestamp(self.timestampDtype, timestamp)
+
+    def contains(self, section, key, timestamp=None):
+        """
+        binary search for the last operation on key at or before timestamp
+        """
+        records = self.sections[section]
+        keys = records['key']
+        lo = bisect_left(keys, key)
+        hi = bisect_right(keys, key, lo)
+        if lo == hi:
+            return False
+        if timestamp is None:
+            j = hi
+        else:
+            j = bisect_right(records['timestamp'], self.timestamp(timestamp), lo, hi)
+        if j == lo:
+            return False
+        # an add sorts after a remove with the same timestamp, so ties go to add
+        return bool(records['isAdd'][j - 1])
+
+    def liveKeys(self, section, timestamp=None):
+        """
+        return the array of keys which are live at timestamp
+        """
+        records = self.sections[section]
+        if timestamp is not None:
+            records = records[records['timestamp'] <= self.timestamp(timestamp)]
+        keys = records['key']
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        return keys[last][records['isAdd'][last] == 1]
+
+    def operations(self, section):
+        """
+        return the operations in a section as lists (keys, timestamps, isAdd)
+        """
+        records = self.sections[section]
+        timestamps = ColumnarLWWElementSet._timestampList(records['timestamp'])
+        return records['key'].tolist(), timestamps, records['isAdd'].astype(bool).tolist()
+
+class MappedLWWElementSet:
+    """
+    read only LWWElementSet backed by a memory mapped file, see openMapped
+    """
+    def __init__(self, path, header, chunkSize=100000):
+        self._file = _MappedFile(path, header, chunkSize)
+
+    def contains(self, x, timestamp=None):
+        """
+        check whether the set contains x, or contained it at timestamp
+        """
+        i = self._file.elementId(x)
+        return i is not None and self._file.contains(0, i, timestamp)
+
+    def liveElements(self, timestamp=None):
+        """
+        return the set of elements in the set at timestamp
+        """
+        return set([self._file.element(i) for i in self._file.liveKeys(0, timestamp).tolist()])
+
+    def toColumnar(self):
+        """
+        convert to a ColumnarLWWElementSet without making a Python object per
+        operation
+        """
+        records = self._file.sections[0]
+        n = len(self._file._offsets) - 1
+        return ColumnarLWWElementSet.fromColumns([self._file.element(i) for i in range(n)],
+                                                 records['key'], records['timestamp'],
+                                                 records['isAdd'].astype(bool))
+
+    def merge(self, other):
+        """
+        merge with another MappedLWWElementSet or a ColumnarLWWElementSet,
+        returning a ColumnarLWWElementSet
+        """
+        if isinstance(other, MappedLWWElementSet):
+            other = other.toColumnar()
+        return self.toColumnar().merge(other)
+
+    def toLWWElementSet(self):
+        """
+        read everything into an LWWElementSet
+        """
+        addSet = set([])
+        removeSet = set([])
+        for (i, timestamp, isAdd) in zip(*self._file.operations(0)):
+            (addSet if isAdd else removeSet).add((self._file.element(i), timestamp))
+        return LWWElementSet(addSet, removeSet)
+
+class MappedLWWElementGraph:
+    """
+    read only LWWElementGraph backed by a memory mapped file, see openMapped
+    """
+    def __init__(self, path, header, chunkSize=100000):
+        self._file = _MappedFile(path, header, chunkSize)
+
+    def hasVertex(self, x, timestamp):
+        """
+        check if vertex x exists at timestamp
+        """
+        i = self._file.elementId(x)
+        return i is not None and self._file.contains(0, i, timestamp)
+
+    def hasEdge(self, e, timestamp):
+        """
+        check if edge e exists at timestamp (and so do its endpoints)
+        """
+        ids = [self._file.elementId(v) for v in e]
+        if None in ids:
+            return False
+        if not self._file.contains(1, _edgeKey(ids), timestamp):
+            return False
+        return all([self._file.contains(0, i, timestamp) for i in ids])
+
+    def hasEdgeBetween(self, v1, v2, timestamp):
+        """
+        check if edge between v1 and v2 exists at timestamp
+        """
+        return self.hasEdge(frozenset([v1, v2]), timestamp)
+
+    def _edge(self, key):
+        return frozenset([self._file.element(i) for i in _edgeEndpoints(key)])
+
+    def toLWWElementGraph(self):
+        """
+        read everything into an LWWElementGraph
+        """
+        sets = []
+        for (section, element) in [(0, self._file.element), (1, self._edge)]:
+            addSet = set([])
+            removeSet = set([])
+            for (key, timestamp, isAdd) in zip(*self._file.operations(section)):
+                (addSet if isAdd else removeSet).add((element(key), timestamp))
+            sets.append(LWWElementSet(addSet, removeSet))
+        return LWWElementGraph(sets[0], sets[1])
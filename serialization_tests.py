@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+from columnarlwwelementset import ColumnarLWWElementSet
+from serialization import save, load, openMapped, LWWElementSetWriter
+
+class testSerialization(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def test_set(self):
+        path = os.path.join(self.directory, 'set.lww')
+        u = LWWElementSet(set([(1, 0), ('a', 2), (1, 3), ((1, 'b'), 1)]), set([(1, 1), ('a', 2), (3, 0)]))
+        save(u, path)
+        
+        self.assertEqual(load(path), u)
+        
+        # query the file without loading it
+        m = openMapped(path)
+        for t in [None, -1, -0.5, 0, 0.5, 1, 2, 3]:
+            for x in [1, 'a', 3, (1, 'b'), 'missing']:
+                self.assertEqual(m.contains(x, t), u.contains(x, t))
+        self.assertEqual(m.liveElements(1), set([(1, 'b')]))
+        
+        # merge two files without making a tuple per operation
+        v = LWWElementSet(set([(3, 1)]), set([('a', 4)]))
+        save(v, os.path.join(self.directory, 'other.lww'))
+        merged = m.merge(openMapped(os.path.join(self.directory, 'other.lww')))
+        self.assertEqual(merged, ColumnarLWWElementSet.fromLWWElementSet(u.merge(v)))
+        
+    def test_graph(self):
+        path = os.path.join(self.directory, 'graph.lww')
+        g = LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+        g.addVertices(['Paris', 'Bonn', 'Tours'], 0)
+        g.addEdges([('Paris', 'Bonn'), ('Tours', 'Tours'), ('Paris', 'Tours')], 1)
+        g.removeVertex('Tours', 2)
+        save(g, path)
+        
+        self.assertEqual(load(path), g)
+        
+        m = openMapped(path)
+        for t in [0, 1, 2]:
+            for (v1, v2) in [('Paris', 'Bonn'), ('Bonn', 'Paris'), ('Tours', 'Tours'), ('Paris', 'Tours'), ('Paris', 'Lyon')]:
+                self.assertEqual(m.hasEdgeBetween(v1, v2, t), g.hasEdgeBetween(v1, v2, t))
+            self.assertEqual(m.hasVertex('Tours', t), g.hasVertex('Tours', t))
+        
+    def test_streamingWriter(self):
+        path = os.path.join(self.directory, 'stream.lww')
+        start = datetime.datetime(2020, 1, 1)
+        
+        # small chunks so that the writer has to flush several times
+        with LWWElementSetWriter(path, chunkSize=7) as w:
+            for i in range(100):
+                w.addElement(i % 10, start + datetime.timedelta(hours=i))
+            w.removeElement(3, start + datetime.timedelta(days=30))
+        
+        m = openMapped(path)
+        self.assertEqual(m.liveElements(), set(range(10)) - set([3]))
+        self.assertEqual(m.contains(3, start + datetime.timedelta(days=1)), True)
+        self.assertEqual(m.liveElements(start), set([0]))
+        self.assertEqual(len(load(path).addSet), 100)
+        
+        # the sorted chunks were merged, and datetimes come back as datetimes
+        u = LWWElementSet(set([(i % 10, start + datetime.timedelta(hours=i)) for i in range(100)]),
+                          set([(3, start + datetime.timedelta(days=30))]))
+        self.assertEqual(load(path), u)
+        keys = m._file.sections[0]['key']
+        self.assertEqual(bool((keys[1:] >= keys[:-1]).all()), True)
+        self.assertEqual(load(path).contains(3, start + datetime.timedelta(days=31)), False)
+        
+    def test_unsortedFile(self):
+        path = os.path.join(self.directory, 'unsorted.lww')
+        u = LWWElementSet(set([]), set([]))
+        with LWWElementSetWriter(path, chunkSize=7, sort=False) as w:
+            for i in range(60):
+                w.addElement(i % 7, (i * 13) % 17)
+                u.addElement(i % 7, (i * 13) % 17)
+                if i % 5 == 0:
+                    w.removeElement(i % 3, i % 11)
+                    u.removeElement(i % 3, i % 11)
+        
+        # sorted into a temporary file a few records at a time when opened
+        m = openMapped(path, chunkSize=5)
+        for t in [None, 0, 3, 8.5, 16]:
+            self.assertEqual(m.liveElements(t), set([x for x in range(7) if u.contains(x, t)]))
+        self.assertEqual(load(path), u)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+from lwwelementset import LWWElementSet
+from merkle import stableHash
+
+# the workers are sent the sorted add and remove timelines of a shard (dicts
+# of element -> sorted list of timestamps) rather than the shard itself, and
+# send back only what the parent needs, so that the sets and indexes of the
+# shard are not pickled both ways
+
+def _mergeShards(timelines):
+    """
+    merge the timelines of a pair of shards, returning the merged add and
+    remove timelines (run in a worker process)
+    """
+    ((adds1, removes1), (adds2, removes2)) = timelines
+    merged = []
+    for (a, b) in [(adds1, adds2), (removes1, removes2)]:
+        # copy the lists, which are shared with the shards when this runs in
+        # the parent process
+        timeline = dict([(x, list(times)) for (x, times) in a.items()])
+        for (x, times) in b.items():
+            timeline[x] = sorted(set(timeline[x]).union(times)) if x in timeline else list(times)
+        merged.append(timeline)
+    return tuple(merged)
+
+def _compactShard(args):
+    """
+    return the operations which compacting a shard at horizon drops (run in a
+    worker process)
+    """
+    adds, removes, horizon = args
+    return LWWElementSet._compactable(adds, removes, horizon)
+
+def _liveElements(args):
+    """
+    return the elements of a shard which are present at timestamp (run in a
+    worker process)
+    """
+    adds, removes, timestamp = args
+    return set([x for (x, times) in adds.items()
+                if LWWElementSet._containsIn(times, removes.get(x), timestamp)])
+
+class ShardedLWWElementSet:
+    """
+    Sharded Last Writer Wins Element Set Class
+
+    Has the same API as LWWElementSet, but the elements are hash partitioned
+    into a number of independent LWWElementSet shards. Every operation on an
+    element goes to the same shard, so the shards can be merged, compacted
+    and searched independently. merge, compact and liveElements take an
+    optional executor (such as a concurrent.futures.ProcessPoolExecutor) and
+    fan the shards out across it. Without one they run in this process.
+
+    The partition uses merkle.stableHash, so it is the same in every process
+    and shards of different replicas with the same number of shards line up.
+
+    Examples:
+    ---------
+    x = ShardedLWWElementSet(set([(1,0), (2,2), (1,3)]), set([(1,1)]), shards=4)
+    y = ShardedLWWElementSet(set([(3,0)]), set([]), shards=4)
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(32) as executor:
+        z = x.merge(y, executor)
+        z.compact(2, executor)
+        z.liveElements(3, executor) # set([1, 3])
+    """
+    def __init__(self, addSet, removeSet, shards=8):
+
+        # type checking
+        if not isinstance(addSet, set) or not isinstance(removeSet, set):
+            raise TypeError
+
+        self.shards = [LWWElementSet(set([]), set([])) for i in range(shards)]
+        for (x, timestamp) in addSet:
+            self.addElement(x, timestamp)
+        for (x, timestamp) in removeSet:
+            self.removeElement(x, timestamp)
+
+    def _shard(self, x):
+        """
+        return the shard which holds element x
+        """
+        return self.shards[stableHash(x) % len(self.shards)]
+
+    @staticmethod
+    def _map(function, items, executor):
+        if executor is None:
+            return list(map(function, items))
+        return list(executor.map(function, items))
+
+    @property
+    def addSet(self):
+        """
+        union of the addSets of the shards
+        """
+        return set([]).union(*[s.addSet for s in self.shards])
+
+    @property
+    def removeSet(self):
+        """
+        union of the removeSets of the shards
+        """
+        return set([]).union(*[s.removeSet for s in self.shards])
+
+    def __eq__(self, other):
+        """
+        test for equality
+        """
+        if isinstance(other, ShardedLWWElementSet) and len(other.shards) == len(self.shards):
+            return all([a == b for (a, b) in zip(self.shards, other.shards)])
+        return (self.addSet == other.addSet) and (self.removeSet == other.removeSet)
+
+    def __repr__(self):
+        """
+        print the contents of the object, for debugging
+        """
+        return 'addSet:   ' + str(self.addSet) + '\nremoveSet:' + str(self.removeSet)
+
+    def addElement(self, x, timestamp):
+        """
+        add element x at timestamp
+        """
+        self._shard(x).addElement(x, timestamp)
+
+    def removeElement(self, x, timestamp):
+        """
+        remove element x at timestamp
+        """
+        self._shard(x).removeElement(x, timestamp)
+
+    def contains(self, x, timestamp=None):
+        """
+        check whether the set contains x, or contained it at timestamp
+        """
+        return self._shard(x).contains(x, timestamp)
+
+    def snapshot(self, timestamp):
+        """
+        return the elements which have been added and removed up to timestamp
+        """
+        snapshot = ShardedLWWElementSet(set([]), set([]), len(self.shards))
+        snapshot.shards = [s.snapshot(timestamp).materialise() for s in self.shards]
+        return snapshot
+
+    def merge(self, other, executor=None):
+        """
+        merge two ShardedLWWElementSet objects with the same number of shards,
+        shard by shard
+        """
+        if len(other.shards) != len(self.shards):
+            raise ValueError('Cannot merge sets with different numbers of shards.')
+        merged = ShardedLWWElementSet(set([]), set([]), len(self.shards))
+        pairs = [((a._addTimeline, a._removeTimeline), (b._addTimeline, b._removeTimeline))
+                 for (a, b) in zip(self.shards, other.shards)]
+        merged.shards = [LWWElementSet._fromTimelines(adds, removes)
+                         for (adds, removes) in self._map(_mergeShards, pairs, executor)]
+        return merged
+
+    def compact(self, horizon, executor=None):
+        """
+        compact every shard (see LWWElementSet.compact), and return the number
+        of operations dropped
+        """
+        args = [(s._addTimeline, s._removeTimeline, horizon) for s in self.shards]
+        results = self._map(_compactShard, args, executor)
+        for (shard, dropped) in zip(self.shards, results):
+            shard._forget(dropped)
+        return sum([len(dropped) for dropped in results])
+
+    def liveElements(self, timestamp=None, executor=None):
+        """
+        return the set of elements present at timestamp (or now)
+        """
+        args = [(s._addTimeline, s._removeTimeline, timestamp) for s in self.shards]
+        return set([]).union(*self._map(_liveElements, args, executor))
+
+    def toLWWElementSet(self):
+        """
+        convert to a single LWWElementSet
+        """
+        return LWWElementSet.mergeAll(self.shards)
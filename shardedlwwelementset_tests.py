@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from lwwelementset import LWWElementSet
+from shardedlwwelementset import ShardedLWWElementSet
+
+class testShardedLWWElementSet(unittest.TestCase):
+    
+    def test_api(self):
+        u = LWWElementSet(set([(i, i % 3) for i in range(50)]), set([(i, 1) for i in range(0, 50, 5)]))
+        s = ShardedLWWElementSet(u.addSet, u.removeSet, shards=4)
+        
+        self.assertEqual(s.toLWWElementSet(), u)
+        for t in [None, 0, 1, 2]:
+            for x in range(51):
+                self.assertEqual(s.contains(x, t), u.contains(x, t))
+        self.assertEqual(s.snapshot(0).toLWWElementSet(), u.snapshot(0))
+        
+        s.removeElement(1, 3)
+        self.assertEqual(s.contains(1), False)
+        
+    def test_processPool(self):
+        u = LWWElementSet(set([(i, 0) for i in range(100)]), set([(i, 1) for i in range(0, 100, 2)]))
+        v = LWWElementSet(set([(i, 2) for i in range(0, 100, 4)]), set([(i, 3) for i in range(0, 100, 8)]))
+        a = ShardedLWWElementSet(u.addSet, u.removeSet, shards=4)
+        b = ShardedLWWElementSet(v.addSet, v.removeSet, shards=4)
+        
+        merged = u.merge(v)
+        live = set([x for x in range(100) if merged.contains(x)])
+        
+        with ProcessPoolExecutor(2) as executor:
+            c = a.merge(b, executor)
+            self.assertEqual(c.toLWWElementSet(), merged)
+            self.assertEqual(c.liveElements(None, executor), live)
+            
+            # compacting in the workers keeps the answers after the horizon
+            self.assertEqual(c.compact(4, executor), merged.compact(4))
+            self.assertEqual(c.toLWWElementSet(), merged)
+            self.assertEqual(c.liveElements(None, executor), live)
+        
+        self.assertRaises(ValueError, a.merge, ShardedLWWElementSet(set([]), set([]), shards=2))
+        
+    def test_mergeCopiesTimelines(self):
+        a = ShardedLWWElementSet(set([(1, 0)]), set([]), shards=2)
+        b = ShardedLWWElementSet(set([(2, 0)]), set([]), shards=2)
+        c = a.merge(b)
+        
+        # changing the merged set leaves the sets it was merged from alone
+        c.removeElement(1, 1)
+        c.removeElement(2, 1)
+        c.addElement(1, 2)
+        self.assertEqual(a.toLWWElementSet(), LWWElementSet(set([(1, 0)]), set([])))
+        self.assertEqual(b.toLWWElementSet(), LWWElementSet(set([(2, 0)]), set([])))
+        self.assertEqual(c.liveElements(), set([1]))
+        self.assertEqual(c.liveElements(0), set([1, 2]))
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio anti-entropy replication for LWWElementGraph
+
+A SyncServer serves one replica over a local Unix socket or a TCP socket on
+localhost, and sync (or syncMany) brings another replica and the server's
+replica up to date with each other. A session only transfers what the other
+side lacks: the roots of the Merkle digests of the vertices and edges are
+compared first, then the full trees of the sets which differ. Within the
+digest buckets which differ the server sends a hash of the operations on
+each element, and only the operations on the elements whose hashes differ
+are exchanged in both directions, so a session costs about one hash per
+element of the differing buckets plus the operations on the differing
+elements.
+
+Every session runs as its own task, so many sessions can be in flight at
+once. The number of sessions a server works on at the same time is limited
+by maxSessions (the others wait), and writers wait for the transport to
+drain before sending more.
+
+Messages are pickled, so only connect replicas which trust each other.
+
+Examples:
+---------
+# in one process
+server = SyncServer(g, path='/tmp/graph.sock')
+await server.start()
+
+# in another
+await sync(h, path='/tmp/graph.sock')
+"""
+
+import asyncio
+import pickle
+import struct
+
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+from merkle import RemoteDigest
+
+# length of the pickled message which follows
+FRAME = struct.Struct('<Q')
+
+# the two LWWElementSets of a graph, in the order they are synced
+SETS = ['vertices', 'edges']
+
+async def _send(writer, message):
+    """
+    send a message, waiting for the transport to drain so that a slow peer
+    pushes back on the sender
+    """
+    data = pickle.dumps(message)
+    writer.write(FRAME.pack(len(data)) + data)
+    await writer.drain()
+
+async def _receive(reader):
+    """
+    receive a message
+    """
+    length = FRAME.unpack(await reader.readexactly(FRAME.size))[0]
+    return pickle.loads(await reader.readexactly(length))
+
+def _setOf(graph, setName):
+    return getattr(graph, setName)
+
+def _operations(s):
+    """
+    the operations of an LWWElementSet as a picklable pair of sets
+    """
+    return (s.addSet, s.removeSet)
+
+def _mergeOperations(graph, operations, peer):
+    """
+    merge the operations received for each set into graph, and return how
+    many there were
+    """
+    sets = dict([(setName, LWWElementSet(set(adds), set(removes)))
+                 for (setName, (adds, removes)) in operations.items()])
+    for setName in SETS:
+        sets.setdefault(setName, LWWElementSet(set([]), set([])))
+    graph.mergeInto(LWWElementGraph(sets['vertices'], sets['edges']), peer)
+    return sum([len(adds) + len(removes) for (adds, removes) in operations.values()])
+
+class SyncServer:
+    """
+    serves an LWWElementGraph to sync clients over a Unix socket (if path is
+    given) or TCP on host and port (port 0 picks a free port, see
+    self.port after start)
+    """
+    def __init__(self, graph, path=None, host='127.0.0.1', port=0, maxSessions=16):
+        self.graph = graph
+        self.path = path
+        self.host = host
+        self.port = port
+        self.sessions = 0
+        self._server = None
+        self._maxSessions = maxSessions
+        self._semaphore = None
+
+    async def start(self):
+        """
+        start listening
+        """
+        self._semaphore = asyncio.Semaphore(self._maxSessions)
+        if self.path is not None:
+            self._server = await asyncio.start_unix_server(self._session, path=self.path)
+        else:
+            self._server = await asyncio.start_server(self._session, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        """
+        stop listening and wait for the server to shut down
+        """
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _session(self, reader, writer):
+        """
+        one sync session with a client
+        """
+        async with self._semaphore:
+            try:
+                peer, roots = await _receive(reader)
+                differs = [_setOf(self.graph, setName).digest.root != roots[setName]
+                           for setName in SETS]
+                await _send(writer, differs)
+
+                if any(differs):
+                    # the client's trees of the sets which differ
+                    trees = await _receive(reader)
+                    buckets = {}
+                    for (setName, (depth, nodes)) in trees.items():
+                        digest = _setOf(self.graph, setName).digest
+                        buckets[setName] = digest.diff(RemoteDigest(depth, nodes))
+
+                    # send the hashes of our elements in the differing
+                    # buckets, and receive the client's operations on the
+                    # elements which differ, with the elements it wants ours
+                    # on
+                    await _send(writer, dict([(setName, (b, _setOf(self.graph, setName).elementHashes(b)))
+                                              for (setName, b) in buckets.items()]))
+                    operations, wanted = await _receive(reader)
+
+                    # the reply is taken before the client's operations are
+                    # merged, so that they are not sent back
+                    reply = dict([(setName, _operations(_setOf(self.graph, setName).elementsDelta(xs)))
+                                  for (setName, xs) in wanted.items()])
+                    _mergeOperations(self.graph, operations, peer)
+                    await _send(writer, reply)
+                self.sessions += 1
+            except asyncio.IncompleteReadError:
+                # the client went away
+                pass
+            finally:
+                writer.close()
+
+async def sync(graph, path=None, host='127.0.0.1', port=None, name='client'):
+    """
+    sync graph with the SyncServer at path (a Unix socket) or host and port,
+    so that both replicas end up with the operations of both
+
+    return a pair (received, sent) of the number of operations transferred
+    """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        await _send(writer, (name, dict([(setName, _setOf(graph, setName).digest.root) for setName in SETS])))
+        differs = await _receive(reader)
+        if not any(differs):
+            return (0, 0)
+
+        await _send(writer, dict([(setName, (_setOf(graph, setName).digest.depth,
+                                           _setOf(graph, setName).digest.nodes()))
+                                  for (setName, d) in zip(SETS, differs) if d]))
+        theirs = await _receive(reader)
+
+        # send our operations on the elements whose hashes differ from the
+        # server's (or which it does not have), and ask for the server's on
+        # the elements which differ from ours
+        ours = {}
+        wanted = {}
+        for (setName, (b, hashes)) in theirs.items():
+            s = _setOf(graph, setName)
+            mine = s.elementHashes(b)
+            ours[setName] = _operations(s.elementsDelta([x for (x, h) in mine.items() if hashes.get(x) != h]))
+            wanted[setName] = [x for (x, h) in hashes.items() if mine.get(x) != h]
+        await _send(writer, (ours, wanted))
+        received = _mergeOperations(graph, await _receive(reader), (host, port) if path is None else path)
+        sent = sum([len(adds) + len(removes) for (adds, removes) in ours.values()])
+        return (received, sent)
+    finally:
+        writer.close()
+
+async def syncMany(graph, addresses, name='client'):
+    """
+    sync graph with several servers at once, where addresses is a list of
+    Unix socket paths or (host, port) pairs
+
+    return the list of (received, sent) pairs
+    """
+    sessions = []
+    for address in addresses:
+        if isinstance(address, tuple):
+            sessions.append(sync(graph, host=address[0], port=address[1], name=name))
+        else:
+            sessions.append(sync(graph, path=address, name=name))
+    return await asyncio.gather(*sessions)
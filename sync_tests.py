@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from lwwelementset import LWWElementSet
+from lwwelementgraph import LWWElementGraph
+from sync import SyncServer, sync, syncMany
+
+def emptyGraph():
+    return LWWElementGraph(LWWElementSet(set([]), set([])), LWWElementSet(set([]), set([])))
+
+class testSync(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def test_sync(self):
+        g = emptyGraph()
+        h = emptyGraph()
+        
+        # lots of shared history, and a few differences
+        g.addVertices(range(200), 0)
+        h.addVertices(range(200), 0)
+        g.addEdgeBetween(1, 2, 1)
+        h.removeVertex(3, 1)
+        
+        async def run():
+            async with SyncServer(g, path=os.path.join(self.directory, 'g.sock')) as server:
+                received, sent = await sync(h, path=server.path)
+                # only the differing buckets are transferred
+                self.assertEqual(received + sent < 20, True)
+                self.assertEqual(g, h)
+                
+                # nothing is transferred when the replicas are identical
+                self.assertEqual(await sync(h, path=server.path), (0, 0))
+                
+        asyncio.run(run())
+        self.assertEqual(h.findAllVerticesConnectedTo(1, 1), set([2]))
+        self.assertEqual(g.hasVertex(3, 1), False)
+        
+    def test_syncDifferingElements(self):
+        # with many elements in each bucket, only the operations on the
+        # element which differs are sent
+        g = emptyGraph()
+        h = emptyGraph()
+        g.addVertices(range(20000), 0)
+        h.addVertices(range(20000), 0)
+        g.addVertex(7, 1)
+        
+        async def run():
+            async with SyncServer(g, path=os.path.join(self.directory, 'g.sock')) as server:
+                self.assertEqual(await sync(h, path=server.path), (2, 1))
+                self.assertEqual(g, h)
+                
+        asyncio.run(run())
+        
+    def test_syncMany(self):
+        replicas = [emptyGraph() for i in range(4)]
+        for (i, r) in enumerate(replicas):
+            r.addVertex(i, i)
+        client = emptyGraph()
+        
+        async def run():
+            servers = [await SyncServer(r, path=os.path.join(self.directory, str(i) + '.sock')).start()
+                       for (i, r) in enumerate(replicas[:2])]
+            servers += [await SyncServer(r).start() for r in replicas[2:]]
+            
+            addresses = [s.path for s in servers[:2]] + [(s.host, s.port) for s in servers[2:]]
+            await syncMany(client, addresses)
+            for s in servers:
+                await s.close()
+            
+        asyncio.run(run())
+        self.assertEqual(client.hasVertices(range(4), 3), [True] * 4)
+        self.assertEqual(client, LWWElementGraph.mergeAll(replicas))